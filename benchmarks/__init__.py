@@ -0,0 +1,10 @@
+# coding=utf-8
+"""
+Benchmarks of the backup path, the retention index and the schedule runner, run against a
+synthetic OctoPrint data folder with stubbed backup helpers. Needs OctoPrint installed.
+
+    python -m benchmarks --output results.json
+
+Results are written as JSON, together with the commit they were measured at, so runs of
+different commits can be compared.
+"""
@@ -0,0 +1,49 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+from .datafolder import DataFolderSpec
+from .suite import run_all
+
+
+def _git_commit():
+	try:
+		return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmark the backup scheduler.")
+	parser.add_argument("--output", "-o", help="write the results to this JSON file instead of stdout")
+	parser.add_argument("--quick", action="store_true", help="fewer and shorter runs")
+	parser.add_argument("--uploads", type=int, default=20)
+	parser.add_argument("--upload-size", type=int, default=2 * 1024 * 1024)
+	parser.add_argument("--timelapses", type=int, default=2)
+	parser.add_argument("--timelapse-size", type=int, default=16 * 1024 * 1024)
+	parser.add_argument("--plugins", type=int, default=10)
+	parser.add_argument("--plugin-files", type=int, default=5)
+	parser.add_argument("--plugin-file-size", type=int, default=16 * 1024)
+	args = parser.parse_args(argv)
+
+	spec = DataFolderSpec(uploads=args.uploads, upload_size=args.upload_size, timelapses=args.timelapses,
+						  timelapse_size=args.timelapse_size, plugins=args.plugins, plugin_files=args.plugin_files,
+						  plugin_file_size=args.plugin_file_size)
+	results = {"commit": _git_commit(), "timestamp": time.time(), "python": platform.python_version(),
+			   "platform": platform.platform(), "spec": spec.to_dict(), "results": run_all(spec, quick=args.quick)}
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as f:
+			json.dump(results, f, indent=2)
+	else:
+		json.dump(results, sys.stdout, indent=2)
+		sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+	main()
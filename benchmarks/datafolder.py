@@ -0,0 +1,87 @@
+# coding=utf-8
+"""
+Generates synthetic OctoPrint data folders to back up.
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import random
+
+# a typical line of sliced gcode, repeated with varying coordinates
+GCODE_LINE = "G1 X{:.3f} Y{:.3f} E{:.5f}\n"
+
+
+class DataFolderSpec(object):
+	"""
+	Number and size (bytes) of the files :func:`generate_basedir` creates.
+	"""
+
+	def __init__(self, uploads=20, upload_size=2 * 1024 * 1024, timelapses=2, timelapse_size=16 * 1024 * 1024,
+				 plugins=10, plugin_files=5, plugin_file_size=16 * 1024, seed=0):
+		self.uploads = uploads
+		self.upload_size = upload_size
+		self.timelapses = timelapses
+		self.timelapse_size = timelapse_size
+		self.plugins = plugins
+		self.plugin_files = plugin_files
+		self.plugin_file_size = plugin_file_size
+		self.seed = seed
+
+	@property
+	def total_size(self):
+		return self.uploads * self.upload_size + self.timelapses * self.timelapse_size + \
+			self.plugins * self.plugin_files * self.plugin_file_size
+
+	def to_dict(self):
+		return dict(self.__dict__)
+
+
+def generate_basedir(basedir, spec):
+	"""
+	Fills `basedir` like an OctoPrint base folder: a ``config.yaml``, gcode uploads that compress
+	well, timelapse videos that don't, plugin data and the folders a backup leaves out.
+	"""
+	rng = random.Random(spec.seed)
+	for folder in ("uploads", "timelapse", "timelapse/tmp", "data", "logs", "generated", "watched"):
+		os.makedirs(os.path.join(basedir, folder), exist_ok=True)
+	with open(os.path.join(basedir, "config.yaml"), "w", encoding="utf-8") as f:
+		f.write("appearance:\n  name: benchmark\nserver:\n  firstRun: false\n")
+	for i in range(spec.uploads):
+		_write_gcode(os.path.join(basedir, "uploads", "part_{:04d}.gcode".format(i)), spec.upload_size, rng)
+	for i in range(spec.timelapses):
+		_write_random(os.path.join(basedir, "timelapse", "print_{:04d}.mp4".format(i)), spec.timelapse_size, rng)
+	for i in range(spec.plugins):
+		folder = os.path.join(basedir, "data", "plugin_{:02d}".format(i))
+		os.makedirs(folder, exist_ok=True)
+		for j in range(spec.plugin_files):
+			_write_json(os.path.join(folder, "data_{:02d}.json".format(j)), spec.plugin_file_size, rng)
+	_write_random(os.path.join(basedir, "logs", "octoprint.log"), 64 * 1024, rng)
+	return basedir
+
+
+def _write_gcode(path, size, rng):
+	with open(path, "w", encoding="ascii") as f:
+		written = 0
+		while written < size:
+			line = GCODE_LINE.format(rng.uniform(0, 250), rng.uniform(0, 210), rng.uniform(0, 5))
+			f.write(line)
+			written += len(line)
+
+
+def _write_random(path, size, rng, block=64 * 1024):
+	with open(path, "wb") as f:
+		while size > 0:
+			n = min(block, size)
+			f.write(rng.getrandbits(8 * n).to_bytes(n, "little"))
+			size -= n
+
+
+def _write_json(path, size, rng):
+	entries, length = [], 2
+	while length < size:
+		entry = {"id": rng.getrandbits(32), "name": "entry-{}".format(rng.getrandbits(16)), "value": rng.random()}
+		entries.append(entry)
+		length += len(json.dumps(entry)) + 2
+	with open(path, "w", encoding="utf-8") as f:
+		json.dump(entries, f)
@@ -0,0 +1,155 @@
+# coding=utf-8
+"""
+Stand-ins for the parts of OctoPrint the plugin talks to, enough to run a backup outside of a
+running server.
+"""
+from __future__ import absolute_import
+
+import copy
+import logging
+import os
+import types
+
+from octoprint_backupscheduler.archive import build_backup_archive, get_excluded_paths, get_external_folders, \
+	iter_backup_files
+
+BASE_FOLDERS = {"timelapse_tmp": os.path.join("timelapse", "tmp")}
+
+
+class FakeSettings(object):
+	"""
+	Plugin settings backed by a dict, counting how often they are saved.
+	"""
+
+	def __init__(self, defaults, basedir, overrides=None):
+		self._data = copy.deepcopy(defaults)
+		for path, value in (overrides or {}).items():
+			self.set(path.split("."), value)
+		self._basedir = basedir
+		self.settings = types.SimpleNamespace(_basedir=basedir, _configfile=os.path.join(basedir, "config.yaml"))
+		self.saves = 0
+		self.events = 0
+
+	def _node(self, path, create=False):
+		node = self._data
+		for key in path[:-1]:
+			if key not in node and create:
+				node[key] = {}
+			node = node.get(key, {})
+		return node
+
+	def get(self, path, merged=False):
+		return copy.deepcopy(self._node(path).get(path[-1]))
+
+	def get_boolean(self, path):
+		return bool(self.get(path))
+
+	def get_int(self, path):
+		value = self.get(path)
+		return int(value) if value is not None else None
+
+	def set(self, path, value):
+		self._node(path, create=True)[path[-1]] = value
+
+	def remove(self, path):
+		self._node(path).pop(path[-1], None)
+
+	def save(self, trigger_event=False):
+		self.saves += 1
+		if trigger_event:
+			self.events += 1
+
+	def global_get(self, path):
+		if path == ["appearance", "name"]:
+			return "benchmark"
+		return None
+
+	def getBaseFolder(self, name):
+		return os.path.join(self._basedir, BASE_FOLDERS.get(name, name))
+
+
+class FakePrinter(object):
+
+	def __init__(self, printing=False):
+		self.printing = printing
+
+	def is_printing(self):
+		return self.printing
+
+
+class FakePluginManager(object):
+	"""
+	Provides ``create_backup``/``delete_backup`` helpers that behave like the backup plugin's:
+	the archive is written to the backup folder, then the backup created event and the
+	``after_backup`` hook are fired.
+	"""
+
+	def __init__(self, settings):
+		self._settings = settings
+		self.plugin = None
+		self.enabled_plugins = {}
+		self.messages = 0
+		self.receivers = []
+
+	def get_helpers(self, name, *helpers):
+		return {"create_backup": self.create_backup, "delete_backup": self.delete_backup}
+
+	def get_hooks(self, name):
+		if name == "octoprint.plugin.backup.additional_excludes":
+			return {"backupscheduler": self.plugin.additional_excludes}
+		if name == "octoprint.plugin.backup.after_backup":
+			return {"backupscheduler": self.plugin.after_backup}
+		return {}
+
+	def register_message_receiver(self, client):
+		self.receivers.append(client)
+
+	def unregister_message_receiver(self, client):
+		if client in self.receivers:
+			self.receivers.remove(client)
+
+	def send_plugin_message(self, identifier, payload):
+		self.messages += 1
+		for client in list(self.receivers):
+			client(identifier, payload)
+
+	def _backup_folder(self):
+		return os.path.join(self._settings.getBaseFolder("data"), "backup")
+
+	def create_backup(self, exclude=None, filename=None):
+		os.makedirs(self._backup_folder(), exist_ok=True)
+		excluded = get_excluded_paths(self._settings, exclude or [])
+		files = iter_backup_files(self._settings.settings._basedir, self._settings.settings._configfile, excluded,
+								  get_external_folders(self._settings))
+		build_backup_archive(os.path.join(self._backup_folder(), filename), files,
+							 {"version": "1.10.0", "excludes": exclude or []}, [])
+		self.plugin.on_event("plugin_backup_backup_created", {"name": filename})
+		self.plugin.after_backup(False)
+
+	def delete_backup(self, filename):
+		path = os.path.join(self._backup_folder(), filename)
+		if os.path.exists(path):
+			os.remove(path)
+
+
+def create_plugin(basedir, data_folder, overrides=None, printing=False):
+	"""
+	A :class:`BackupschedulerPlugin` wired up to fakes, with backups going to
+	``basedir/data/backup``.
+	"""
+	from octoprint_backupscheduler import BackupschedulerPlugin
+
+	plugin = BackupschedulerPlugin()
+	plugin._identifier = "backupscheduler"
+	plugin._plugin_version = "benchmark"
+	plugin._basefolder = os.path.dirname(os.path.abspath(__import__("octoprint_backupscheduler").__file__))
+	plugin._logger = logging.getLogger("benchmarks.backupscheduler")
+	plugin._settings = FakeSettings(plugin.get_settings_defaults(), basedir, overrides)
+	plugin._printer = FakePrinter(printing)
+	plugin._plugin_manager = FakePluginManager(plugin._settings)
+	plugin._plugin_manager.plugin = plugin
+	plugin.get_plugin_data_folder = lambda: data_folder
+	os.makedirs(data_folder, exist_ok=True)
+	plugin.initialize()
+	plugin.backup_helpers = plugin._plugin_manager.get_helpers("backup", "create_backup", "delete_backup")
+	return plugin
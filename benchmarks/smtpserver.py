@@ -0,0 +1,99 @@
+# coding=utf-8
+"""
+A minimal SMTP server on localhost to send mails to without a real mail server.
+"""
+from __future__ import absolute_import
+
+import email
+import socketserver
+import threading
+import time
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+
+	def _reply(self, line):
+		self.wfile.write((line + "\r\n").encode("ascii"))
+
+	def handle(self):
+		self.server._connected()
+		self._reply("220 localhost SMTP stand-in")
+		for line in iter(self.rfile.readline, b""):
+			command = line.decode("ascii", "replace").strip().split(" ", 1)[0].upper()
+			if command in ("EHLO", "HELO"):
+				self._reply("250 localhost")
+			elif command in ("MAIL", "RCPT", "RSET", "NOOP"):
+				self._reply("250 OK")
+			elif command == "DATA":
+				self._reply("354 End data with <CR><LF>.<CR><LF>")
+				lines = []
+				for data in iter(self.rfile.readline, b""):
+					if data == b".\r\n":
+						break
+					lines.append(data[1:] if data.startswith(b"..") else data)
+				self._reply(self.server._receive(b"".join(lines)))
+			elif command == "QUIT":
+				self._reply("221 Bye")
+				return
+			else:
+				self._reply("502 Command not implemented")
+
+
+class SMTPStandIn(socketserver.ThreadingTCPServer):
+	"""
+	Accepts every mail sent to it and keeps it in :attr:`messages` as ``(received, message)``,
+	with the :func:`time.monotonic` time it was received. The first `failures` mails are
+	rejected with a temporary error.
+	"""
+
+	daemon_threads = True
+	allow_reuse_address = True
+
+	def __init__(self, failures=0):
+		socketserver.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), _SMTPHandler)
+		self.failures = failures
+		self.connections = 0
+		self.messages = []
+		self._received = threading.Condition()
+		self._thread = threading.Thread(target=self.serve_forever, name="SMTPStandIn", daemon=True)
+
+	def start(self):
+		self._thread.start()
+		return self
+
+	def stop(self):
+		self.shutdown()
+		self.server_close()
+
+	def config(self):
+		"""
+		``send_email`` settings that send to this server.
+		"""
+		return {"smtp_server": "127.0.0.1", "smtp_port": self.server_address[1], "smtp_tls": False,
+				"smtp_user": "", "smtp_password": "unused", "sender": "octoprint@localhost",
+				"recipient": "admin@localhost"}
+
+	def reset(self):
+		with self._received:
+			self.connections = 0
+			self.messages = []
+
+	def wait_for(self, count, timeout=10):
+		"""
+		Waits until `count` mails were received, returns whether they were.
+		"""
+		with self._received:
+			return self._received.wait_for(lambda: len(self.messages) >= count, timeout)
+
+	def _connected(self):
+		with self._received:
+			self.connections += 1
+
+	def _receive(self, data):
+		with self._received:
+			if self.failures:
+				self.failures -= 1
+				return "451 Try again later"
+			self.messages.append((time.monotonic(), email.message_from_bytes(data)))
+			self._received.notify_all()
+		return "250 OK"
@@ -0,0 +1,357 @@
+# coding=utf-8
+"""
+The individual benchmarks. Each one returns a dict of results.
+"""
+from __future__ import absolute_import
+
+import datetime
+import functools
+import operator
+import os
+import resource
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+from octoprint_backupscheduler import schedule
+from octoprint_backupscheduler.archive import build_backup_archive, build_backup_archive_parallel, \
+	get_excluded_paths, iter_backup_files
+from octoprint_backupscheduler.mailer import MailOutbox, open_connection, send_message
+from octoprint_backupscheduler.retention import plan_retention, scan_backups
+from octoprint_backupscheduler.runner import MAX_SLEEP, ScheduleRunner
+from octoprint_backupscheduler.throttle import IOThrottle, run_at_low_priority
+
+from .datafolder import generate_basedir
+from .fakes import FakeSettings, create_plugin
+from .smtpserver import SMTPStandIn
+
+
+def peak_rss():
+	"""
+	Peak resident set size of this process in bytes.
+	"""
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	# kilobytes on Linux, bytes on macOS
+	return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _summarize(values):
+	values = sorted(values)
+	if not values:
+		return {}
+	return {"count": len(values), "min": values[0], "median": statistics.median(values),
+			"p95": values[min(len(values) - 1, int(len(values) * 0.95))], "max": values[-1]}
+
+
+class _PollingRunner(threading.Thread):
+	"""
+	Runs the jobs of a scheduler the way the plugin used to, calling ``run_pending`` every
+	`interval` seconds like ``RepeatedTimer(60, schedule.run_pending)`` did.
+	"""
+
+	def __init__(self, scheduler, interval):
+		threading.Thread.__init__(self, name="BenchmarkPollingRunner")
+		self.daemon = True
+		self._scheduler = scheduler
+		self._interval = interval
+		self._stopped = threading.Event()
+
+	def stop(self):
+		self._stopped.set()
+
+	def run(self):
+		while not self._stopped.wait(self._interval):
+			self._scheduler.run_pending()
+
+
+def bench_scheduler_wake(duration=10, jobs=5, poll_interval=0.75):
+	"""
+	How late jobs that are due every second start and how often the runner wakes up, polling
+	every `poll_interval` seconds like the plugin used to compared to the schedule runner.
+	Polling is sped up from the former 60 seconds to fit the run, its lateness grows with the
+	interval.
+	"""
+	results = {"jobs": jobs, "duration": duration, "poll_interval": poll_interval}
+	for engine in ("poll", "runner"):
+		scheduler = schedule.Scheduler()
+		lateness = []
+		wakeups = []
+		run_pending = scheduler.run_pending
+
+		def count_wakeup():
+			wakeups.append(time.perf_counter())
+			run_pending()
+
+		def job(job_ref):
+			lateness.append((datetime.datetime.now() - job_ref[0].next_run).total_seconds())
+
+		scheduler.run_pending = count_wakeup
+		for _ in range(jobs):
+			job_ref = []
+			job_ref.append(scheduler.every(1).seconds.do(job, job_ref))
+		runner = _PollingRunner(scheduler, poll_interval) if engine == "poll" else ScheduleRunner(scheduler)
+		cpu = time.process_time()
+		runner.start()
+		time.sleep(duration)
+		runner.stop()
+		runner.join()
+		results[engine] = {"lateness_seconds": _summarize(lateness), "wakeups": len(wakeups),
+						   "cpu_seconds": time.process_time() - cpu}
+	# a day without any job due, the runner only wakes up to notice wall clock changes
+	results["idle_wakeups_per_day"] = {"poll": 86400 // 60, "runner": 86400 // MAX_SLEEP}
+	return results
+
+
+def _time_calls(func, calls):
+	started = time.perf_counter()
+	for _ in range(calls):
+		func()
+	return (time.perf_counter() - started) / calls * 1e6
+
+
+def bench_run_pending(sizes=(10, 100, 1000, 10000)):
+	"""
+	Cost of a ``run_pending`` tick with nothing due and of looking up the next run, by number
+	of scheduled jobs, next to the scan over all jobs and ``min(jobs)`` the heap replaced.
+	"""
+	results = {}
+	for size in sizes:
+		scheduler = schedule.Scheduler()
+		for i in range(size):
+			scheduler.every(1 + i % 24).hours.do(lambda: None)
+		jobs = list(scheduler.jobs)
+		calls = max(10, 100000 // size)
+		results[str(size)] = {
+			"calls": calls,
+			"run_pending_us": _time_calls(scheduler.run_pending, calls),
+			"scan_us": _time_calls(lambda: sorted(job for job in jobs if job.should_run), calls),
+			"next_run_us": _time_calls(lambda: scheduler.next_run, calls),
+			"min_us": _time_calls(lambda: min(jobs), calls),
+		}
+	return results
+
+
+def bench_archive(basedir, strategies=("store", "fast", "deflate", "best")):
+	"""
+	Throughput of building a backup archive of `basedir` per compression strategy.
+	"""
+	settings = FakeSettings({}, basedir)
+	excluded = get_excluded_paths(settings, [])
+	results = {}
+	with tempfile.TemporaryDirectory() as target:
+		for strategy in strategies:
+			path = os.path.join(target, strategy + ".zip")
+			files = list(iter_backup_files(basedir, settings.settings._configfile, excluded))
+			started, cpu = time.perf_counter(), time.process_time()
+			stats = build_backup_archive(path, files, {"version": "benchmark", "excludes": []}, [], strategy=strategy)
+			elapsed = time.perf_counter() - started
+			results[strategy] = {"seconds": elapsed, "cpu_seconds": time.process_time() - cpu,
+								 "files": stats["files"], "bytes": stats["bytes"],
+								 "archive_bytes": os.path.getsize(path),
+								 "mb_per_second": stats["bytes"] / elapsed / 1024 / 1024 if elapsed else None}
+	return results
+
+
+def bench_parallel_archive(basedir, strategy="deflate", workers=None):
+	"""
+	Speedup of the parallel archive builder per number of workers over the single threaded one.
+	"""
+	settings = FakeSettings({}, basedir)
+	files = list(iter_backup_files(basedir, settings.settings._configfile, get_excluded_paths(settings, [])))
+	cores = os.cpu_count() or 1
+	workers = workers or sorted(set([1, 2, 4, cores]))
+	results = {"cores": cores, "strategy": strategy, "workers": {}}
+	with tempfile.TemporaryDirectory() as target:
+		path = os.path.join(target, "backup.zip")
+		started = time.perf_counter()
+		build_backup_archive(path, files, {"version": "benchmark", "excludes": []}, [], strategy=strategy)
+		baseline = time.perf_counter() - started
+		results["single_threaded_seconds"] = baseline
+		for count in workers:
+			started = time.perf_counter()
+			stats = build_backup_archive_parallel(path, files, {"version": "benchmark", "excludes": []}, [],
+												  strategy=strategy, workers=count)
+			elapsed = time.perf_counter() - started
+			results["workers"][str(count)] = {"seconds": elapsed, "speedup": baseline / elapsed if elapsed else None,
+											  "mb_per_second": stats["bytes"] / elapsed / 1024 / 1024 if elapsed else None,
+											  "archive_bytes": os.path.getsize(path)}
+	return results
+
+
+class _SerialProbe(threading.Thread):
+	"""
+	Stands in for the printer's serial connection: wakes up every `interval` seconds to handle
+	a line and records how late it woke up.
+	"""
+
+	def __init__(self, interval):
+		threading.Thread.__init__(self, name="BenchmarkSerialProbe")
+		self.daemon = True
+		self._interval = interval
+		self._stopped = threading.Event()
+		self.lateness = []
+
+	def stop(self):
+		self._stopped.set()
+
+	def run(self):
+		due = time.perf_counter() + self._interval
+		while not self._stopped.is_set():
+			time.sleep(max(0.0, due - time.perf_counter()))
+			now = time.perf_counter()
+			self.lateness.append(now - due)
+			# checksum a line of gcode like the printer communication does
+			functools.reduce(operator.xor, b"N123 G1 X10.000 Y10.000 E0.12345", 0)
+			due = max(due + self._interval, now)
+
+
+def bench_print_latency(basedir, interval=0.01, idle=2):
+	"""
+	How late a simulated serial connection handles its lines without a backup, during a
+	backup of `basedir` at full speed and during a low impact backup, which runs at low
+	priority and writes at half the speed of the full speed one.
+	"""
+	settings = FakeSettings({}, basedir)
+	files = list(iter_backup_files(basedir, settings.settings._configfile, get_excluded_paths(settings, [])))
+	metadata = {"version": "benchmark", "excludes": []}
+	results = {"interval": interval}
+
+	def measure(func):
+		probe = _SerialProbe(interval)
+		probe.start()
+		started = time.perf_counter()
+		func()
+		elapsed = time.perf_counter() - started
+		probe.stop()
+		probe.join()
+		return {"seconds": elapsed, "lateness_ms": _summarize([lateness * 1000 for lateness in probe.lateness])}
+
+	with tempfile.TemporaryDirectory() as target:
+		path = os.path.join(target, "backup.zip")
+		results["idle"] = measure(lambda: time.sleep(idle))
+		results["full_speed"] = measure(lambda: build_backup_archive(path, files, metadata, []))
+		throttle = IOThrottle(int(os.path.getsize(path) / results["full_speed"]["seconds"] / 2))
+		results["low_impact"] = measure(lambda: run_at_low_priority(build_backup_archive, path, files, metadata, [],
+																	throttle=throttle))
+		results["low_impact"]["write_limit"] = throttle.rate
+	return results
+
+
+def bench_retention(backups=1000, keep=10, rounds=20):
+	"""
+	Cost of indexing a backup folder with `backups` archives and planning retention over it.
+	"""
+	types = ("daily", "weekly", "monthly", "startup")
+	with tempfile.TemporaryDirectory() as folder:
+		assigned = {"{}_backups".format(t): [] for t in types}
+		start = datetime.datetime(2020, 1, 1)
+		for i in range(backups):
+			backup_type = types[i % len(types)]
+			name = "benchmark-{}-{:%Y%m%d-%H%M%S}.zip".format(backup_type, start + datetime.timedelta(hours=i))
+			with zipfile.ZipFile(os.path.join(folder, name), "w") as zip_file:
+				zip_file.writestr("metadata.json", "{}")
+			assigned["{}_backups".format(backup_type)].append(name)
+		policies = {backup_type: (keep, 0) for backup_type in assigned}
+		scans, plans = [], []
+		for _ in range(rounds):
+			started = time.perf_counter()
+			entries = scan_backups(folder, "benchmark", assigned)
+			scans.append(time.perf_counter() - started)
+			started = time.perf_counter()
+			plan_retention(entries, policies, quota=backups * 100)
+			plans.append(time.perf_counter() - started)
+	return {"backups": backups, "scan_seconds": _summarize(scans), "plan_seconds": _summarize(plans)}
+
+
+def bench_backup_job(basedir, runs=3, mode="full", compression="default"):
+	"""
+	The plugin's backup path end to end, with stubbed backup helpers and a fake printer.
+	"""
+	with tempfile.TemporaryDirectory() as data_folder:
+		plugin = create_plugin(basedir, data_folder, {
+			"daily.enabled": True, "daily.retention": 1, "daily.compression": compression,
+			"weekly.enabled": True, "weekly.retention": 1, "backup_mode": mode})
+		durations = []
+		try:
+			for _ in range(runs):
+				started = time.perf_counter()
+				plugin._perform_backup(["daily_backups", "weekly_backups"])
+				# wait for cataloging and retention
+				plugin._maintenance_executor.submit(lambda: None).result()
+				durations.append(time.perf_counter() - started)
+				# backup names have a resolution of a second
+				time.sleep(1.0)
+		finally:
+			plugin._mail_outbox.stop()
+		backup_folder = os.path.join(basedir, "data", "backup")
+		for name in os.listdir(backup_folder) if os.path.isdir(backup_folder) else []:
+			path = os.path.join(backup_folder, name)
+			# snapshots are folders
+			shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+		return {"mode": mode, "compression": compression, "seconds": _summarize(durations),
+				"settings_saves": plugin._settings.saves, "settings_events": plugin._settings.events,
+				"metrics": plugin._metrics.to_dict()["counters"]}
+
+
+def bench_mail_outbox(messages=200):
+	"""
+	Throughput and latency of mails sent through the outbox to a local SMTP stand-in, next to
+	opening a connection for every mail like the plugin used to.
+	"""
+	results = {"messages": messages}
+	server = SMTPStandIn().start()
+	try:
+		config = server.config()
+		started = time.perf_counter()
+		for i in range(messages):
+			connection = open_connection(config)
+			send_message(connection, config, f"mail {i}", "<p>Backup created.</p>")
+			connection.quit()
+		elapsed = time.perf_counter() - started
+		results["connection_per_mail"] = {"seconds": elapsed, "mails_per_second": messages / elapsed,
+										  "connections": server.connections}
+
+		server.reset()
+		queued = {}
+		with tempfile.TemporaryDirectory() as folder:
+			outbox = MailOutbox(os.path.join(folder, "outbox.json"), lambda: config)
+			outbox.start()
+			started = time.perf_counter()
+			for i in range(messages):
+				queued[f"mail {i}"] = time.monotonic()
+				outbox.enqueue(f"mail {i}", "<p>Backup created.</p>")
+			server.wait_for(messages, timeout=60)
+			elapsed = time.perf_counter() - started
+			outbox.stop()
+			outbox.join()
+		latencies = [received - queued[message["Subject"]] for received, message in server.messages]
+		results["outbox"] = {"seconds": elapsed, "mails_per_second": len(latencies) / elapsed,
+							 "connections": server.connections, "latency_seconds": _summarize(latencies)}
+	finally:
+		server.stop()
+	return results
+
+
+def run_all(spec, quick=False):
+	results = {}
+	with tempfile.TemporaryDirectory() as basedir:
+		started = time.perf_counter()
+		generate_basedir(basedir, spec)
+		results["generate_seconds"] = time.perf_counter() - started
+		results["archive"] = bench_archive(basedir, ("store", "deflate") if quick else
+										   ("store", "fast", "deflate", "best"))
+		results["parallel_archive"] = bench_parallel_archive(basedir)
+		results["print_latency"] = bench_print_latency(basedir)
+		results["backup_job"] = [bench_backup_job(basedir, runs=1 if quick else 3),
+								 bench_backup_job(basedir, runs=1 if quick else 3, mode="incremental"),
+								 bench_backup_job(basedir, runs=1 if quick else 3, mode="snapshot")]
+	results["retention"] = bench_retention(backups=200 if quick else 1000)
+	results["scheduler_wake"] = bench_scheduler_wake(duration=3 if quick else 10)
+	results["mail_outbox"] = bench_mail_outbox(50 if quick else 200)
+	results["run_pending"] = bench_run_pending((10, 100, 1000) if quick else (10, 100, 1000, 10000))
+	results["peak_rss_bytes"] = peak_rss()
+	return results
@@ -2,22 +2,58 @@
 from __future__ import absolute_import
 
 import logging
-from time import sleep
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from time import monotonic, process_time, time
 
 import octoprint.plugin
-from octoprint.settings import valid_boolean_trues
-from octoprint.util.version import is_octoprint_compatible
+from octoprint.util.version import get_octoprint_version_string, is_octoprint_compatible
 
 from . import schedule
+from .runner import ScheduleRunner
+from .completion import BackupCompletionTracker, BackupFailedError
+from .coalesce import BackupCoalescer
+from .archive import build_backup_archive, build_backup_archive_parallel, get_excluded_paths, get_external_folders, \
+	get_hook_excluded_paths, get_source_manifest, get_unchanged_manifest, iter_backup_files
+from .chunkstore import ChunkStore
+from .snapshot import SnapshotStore
+from .throttle import IOThrottle, run_at_low_priority
+from .pending import PendingQueue, PendingWorker
+from .retention import plan_retention, scan_backups
+from .catalog import BackupCatalog, file_digest
+from .mailer import MailOutbox, open_connection, send_message
+from .mailtemplate import MailTemplates, format_size
+from .state import DebouncedWriter, PluginState
+from .metrics import BackupMetrics
+from .verify import verify_archive
+from .replication import Replicator
+from .statindex import StatIndex, get_free_space
+from .changes import ChangeTracker, tree_digest
+from .utilisation import UtilisationHistogram
+from . import coordination
+from .coordination import HostCoordinator, get_member_id
+import calendar
+import functools
 import threading
-from datetime import datetime
-from octoprint.util import RepeatedTimer
+from datetime import datetime, timedelta
 from octoprint.access.permissions import Permissions
 import os
-import smtplib
-from email.mime.text import MIMEText
+import zipfile
 from flask_babel import gettext
 
+# schedule job properties by ISO weekday, as stored in the weekly "day" setting
+WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday")
+BACKUP_TYPES = ("daily", "weekly", "monthly", "startup")
+# head room on top of the estimated size of a backup, archives are never estimated exactly
+FREE_SPACE_MARGIN = 1.1
+# how far apart backups with an automatic time are, at least half and at most one and a half of it
+AUTO_TIME_PERIODS = {"daily": timedelta(days=1), "weekly": timedelta(weeks=1), "monthly": timedelta(days=31)}
+# assumed duration of a backup before one was timed, in seconds
+DEFAULT_BACKUP_DURATION = 600
+# how long backups that didn't get their turn on the host wait before trying again, in seconds
+COORDINATION_RETRY_DELAY = 5 * 60
+# shared by the instances on a host if no other folder is configured
+DEFAULT_COORDINATION_FOLDER = os.path.join(os.path.expanduser("~"), ".octoprint-backupscheduler")
 
 class BackupschedulerPlugin(octoprint.plugin.SettingsPlugin,
 							octoprint.plugin.AssetPlugin,
@@ -25,24 +61,97 @@ class BackupschedulerPlugin(octoprint.plugin.SettingsPlugin,
 							octoprint.plugin.EventHandlerPlugin,
 							octoprint.plugin.SimpleApiPlugin,
 							octoprint.plugin.StartupPlugin,
+							octoprint.plugin.ShutdownPlugin,
 							octoprint.plugin.WizardPlugin):
 
 	def __init__(self):
-		self._repeated_timer = None
+		self._scheduler = schedule.Scheduler()
+		# a clock jump may skip over a scheduled backup
+		self._scheduler.on_clock_jump = lambda jump: self._queue_missed_backups()
+		self._checked_missed_backups = False
+		self._queued_at = {}
+		self._schedule_runner = None
 		self._wizard_required = False
-		self.backup_pending = False
-		self.backup_pending_type = []
+		self._pending_backups = None
+		self._catalog = None
+		self._mail_outbox = None
+		self._mail_templates = None
+		self._replicator = None
+		self._replication_throttle = None
+		self._state = None
+		self._metrics = BackupMetrics()
+		# several saves during a backup job end up as a single write of config.yaml
+		self._settings_writer = DebouncedWriter(lambda trigger_event: self._settings.save(trigger_event=trigger_event))
+		self._creating_backup = threading.Event()
+		# set once after_backup reported the failure of the backup being created
+		self._failure_notified = threading.Event()
+		self._pending_worker = None
+		# the coordinator and the slot on the host of the running backup
+		self._backup_slot = None
 		self.current_settings = None
 		self.backup_helpers = None
-		self.creating_backup = False
+		self._backup_completion = BackupCompletionTracker()
+		# backups run one at a time on this worker, never on the scheduler or event threads
+		self._backup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="BackupSchedulerWorker")
+		self._backup_coalescer = BackupCoalescer(self._submit_backups)
+		# hashing, cataloging and deleting backups happens here, after a backup finished
+		self._maintenance_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="BackupSchedulerMaintenance")
+		self._retention_lock = threading.RLock()
+		self._chunk_store = None
+		self._snapshot_store = None
+		self._stat_index = None
+		self._change_tracker = None
+		self._utilisation = None
+		self._coordinator = None
+		self._io_throttle = None
+
+	def initialize(self):
+		self._get_state()
+		self._utilisation = UtilisationHistogram(self._state.get("utilisation"))
+		self._pending_backups = PendingQueue(os.path.join(self.get_plugin_data_folder(), "pending.json"))
+		self._catalog = BackupCatalog(os.path.join(self.get_plugin_data_folder(), "catalog.jsonl"))
+		self._mail_outbox = MailOutbox(os.path.join(self.get_plugin_data_folder(), "outbox.json"),
+									   lambda: self._settings.get(["send_email"], merged=True),
+									   digest_interval=lambda: self._settings.get_int(["send_email", "digest_interval"]) * 3600,
+									   on_failure=self._notify_mail_failed, metrics=self._metrics, logger=self._logger)
+		self._mail_outbox.start()
+		self._mail_templates = MailTemplates(os.path.join(self._basefolder, "static", "mailtmpl"))
+		self._replication_throttle = IOThrottle()
+		self._update_replication_throttle()
+		self._replicator = Replicator(os.path.join(self.get_plugin_data_folder(), "replication.json"),
+									  lambda: self._settings.get(["replication"], merged=True),
+									  lambda name: os.path.join(self._get_backup_folder(), name),
+									  throttle=self._replication_throttle, on_failure=self._notify_replication_failed,
+									  logger=self._logger)
+		self._replicator.start()
+		self._update_coordinator()
+		# the backup plugin reports backups failing before they started only to its clients
+		self._plugin_manager.register_message_receiver(self._on_plugin_message)
+
+	def _update_replication_throttle(self):
+		self._replication_throttle.rate = (self._settings.get_int(["replication", "bandwidth_limit"]) or 0) * 1024
+
+	def _get_state(self):
+		if self._state is None:
+			self._state = PluginState(os.path.join(self.get_plugin_data_folder(), "state.json"))
+		return self._state
 
 	# ~~ SettingsPlugin mixin
 
 	def get_settings_version(self):
-		return 4
+		return 5
 
 	def on_settings_migrate(self, target, current):
 		if current is not None:
+			if current < 5:
+				# retained backups are runtime state and live in state.json now
+				state = self._get_state()
+				for backup_type in BACKUP_TYPES:
+					key = "{}_backups".format(backup_type)
+					if key not in state:
+						state.set(key, self._settings.get([key]) or [])
+					self._settings.remove([key])
+				state.flush()
 			if current < 4:
 				self._settings.set(["send_email", "smtp_password"], "")
 				self._wizard_required = True
@@ -54,21 +163,35 @@ class BackupschedulerPlugin(octoprint.plugin.SettingsPlugin,
 	def get_settings_defaults(self):
 		return {'installed_version': self._plugin_version,
 				'daily': {"enabled": False, "time": "00:00", "retention": 1, "exclude_uploads": False,
-						  "exclude_timelapse": False}, 'daily_backups': [],
+						  "exclude_timelapse": False, "compression": "default", "max_age": 0, "auto_time": False},
 				'weekly': {"enabled": False, "time": "00:00", "day": 7, "retention": 1, "exclude_uploads": False,
-						   "exclude_timelapse": False}, 'weekly_backups': [],
+						   "exclude_timelapse": False, "compression": "default", "max_age": 0, "auto_time": False},
 				'monthly': {"enabled": False, "time": "00:00", "day": 1, "retention": 1, "exclude_uploads": False,
-							"exclude_timelapse": False}, 'monthly_backups': [],
-				'startup': {"enabled": False, "retention": 1, "exclude_uploads": False, "exclude_timelapse": False},
-				'startup_backups': [], 'check_mount': False,
+							"exclude_timelapse": False, "compression": "default", "max_age": 0, "auto_time": False},
+				'startup': {"enabled": False, "retention": 1, "exclude_uploads": False, "exclude_timelapse": False,
+							"compression": "default", "max_age": 0},
+				'check_mount': False, 'backup_timeout': 120,
+				'backup_mode': "full", 'retention_quota': 0, 'catch_up_window': 24, 'archive_workers': 1,
+				'verify_backups': True, 'check_free_space': True, 'free_space_prune': False,
+				'skip_unchanged': {"enabled": False, "max_staleness": 7},
+				'replication': {"enabled": False, "target": "local", "mirror_deletes": True, "bandwidth_limit": 0,
+								"parallel_uploads": 4, "local": {"folder": ""},
+								"sftp": {"host": "", "port": 22, "username": "", "password": "", "key_file": "",
+										 "folder": ""},
+								"s3": {"endpoint": "", "bucket": "", "prefix": "", "access_key": "", "secret_key": "",
+									   "region": ""}},
+				'coordination': {"enabled": False, "folder": "", "max_concurrent": 1, "stagger": 2,
+								 "share_chunks": False},
+				'low_impact': {"enabled": False, "write_limit": 0, "on_print": "pause", "print_write_limit": 256},
 				'send_email': {"enabled": False, "send_successful": False, "smtp_server": "", "smtp_port": 25,
-							   "smtp_tls": False, "smtp_user": "", "smtp_password": "", "sender": "", "recipient": ""},
+							   "smtp_tls": False, "smtp_user": "", "smtp_password": "", "sender": "", "recipient": "",
+							   "digest_interval": 0},
 				'notification': {"enabled": True, "retained_message": {"notifyTitle": "", "notifyMessage": "",
 																	   "notifyType": "", "notifyHide": True}}}
 
 	# blacklist SMTP settings for REST API
 	def get_settings_restricted_paths(self):
-		return {'admin': [["send_email"]]}
+		return {'admin': [["send_email"], ["replication"]]}
 
 	# ~ StartupPlugin mixin
 
@@ -78,70 +201,272 @@ class BackupschedulerPlugin(octoprint.plugin.SettingsPlugin,
 		if "create_backup" not in self.backup_helpers or "delete_backup" not in self.backup_helpers:
 			self._logger.info("Missing backup helpers, aborting.")
 			return
+		if len(self._pending_backups):
+			self._logger.info(f"Backups pending from before the restart: {self._pending_backups.backup_types}")
+		self._pending_worker = PendingWorker(self._pending_backups, self._run_pending_backups,
+											 lambda: not self._printer.is_printing(), logger=self._logger)
+		self._pending_worker.start()
 		if self._settings.get_boolean(["startup", "enabled"]):
-			t = threading.Timer(1, self._perform_backup, kwargs={"backup_type": "startup_backups"})
+			t = threading.Timer(1, self._queue_backup, kwargs={"backup_type": "startup_backups"})
 			t.daemon = True
 			t.start()
+		self._update_change_tracker()
+
+	# ~~ ShutdownPlugin mixin
+
+	def on_shutdown(self):
+		self._utilisation.update()
+		self._state.set("utilisation", self._utilisation.to_dict())
+		self._state.flush()
+		self._settings_writer.flush()
+		self._plugin_manager.unregister_message_receiver(self._on_plugin_message)
+		if self._schedule_runner is not None:
+			self._schedule_runner.stop()
+		if self._pending_worker is not None:
+			self._pending_worker.stop()
+		self._mail_outbox.stop()
+		self._replicator.stop()
+		if self._coordinator is not None:
+			self._coordinator.stop()
+		if self._change_tracker is not None:
+			self._change_tracker.stop()
 
 	# ~~ EventHandlerPlugin mixin
 
 	def on_event(self, event, payload):
-		if event not in ("Startup", "SettingsUpdated", "PrintFailed", "PrintDone", "plugin_backup_backup_created"):
+		if event not in ("Startup", "SettingsUpdated", "PrintStarted", "PrintFailed", "PrintDone",
+						 "plugin_backup_backup_created", "plugin_backup_backup_error"):
 			return
 		if event == "plugin_backup_backup_created":
-			self.creating_backup = False
+			self._backup_completion.created(payload.get("name"))
+		if event == "plugin_backup_backup_error":
+			self._backup_completion.failed(payload.get("name"), f"Backup failed ({payload.get('error')})")
+		if event == "PrintStarted":
+			self._utilisation.print_started()
+			self._state.set("utilisation", self._utilisation.to_dict())
+		if event in ("PrintFailed", "PrintDone"):
+			self._utilisation.print_ended()
+			self._state.set("utilisation", self._utilisation.to_dict())
+		if event in ("PrintStarted", "PrintFailed", "PrintDone") and self._io_throttle is not None:
+			self._update_io_throttle(self._io_throttle, printing=event == "PrintStarted")
+		if event == "SettingsUpdated":
+			self._update_replication_throttle()
+			self._update_coordinator()
+			self._update_change_tracker()
+		if event in ("PrintFailed", "PrintDone") and self._pending_worker is not None:
+			# pending backups are started by the worker, not on the event thread
+			self._pending_worker.wake()
+			self._queue_missed_backups()
 		if self._settings.get_boolean(["daily", "enabled"]) or self._settings.get_boolean(
 			["weekly", "enabled"]) or self._settings.get_boolean(["monthly", "enabled"]):
 			if event == "Startup":
 				self.current_settings = {"daily": self._settings.get(["daily"]),
 										 "weekly": self._settings.get(["weekly"]),
 										 "monthly": self._settings.get(["monthly"])}
-				backups_enabled = False
 				self._logger.debug("Clearing scheduled jobs.")
-				schedule.clear("backupscheduler")
-				if self._settings.get_boolean(["daily", "enabled"]) and self._settings.get(["daily", "time"]) != "":
-					backups_enabled = True
-					self._logger.debug("Scheduling daily backup for %s." % self._settings.get(["daily", "time"]))
-					schedule.every().day.at(self._settings.get(["daily", "time"])).do(self._perform_backup,
-																					  backup_type="daily_backups").tag(
-						"backupscheduler")
-				if self._settings.get_boolean(["weekly", "enabled"]) and self._settings.get(["weekly", "time"]) != "":
-					backups_enabled = True
-					self._logger.debug("Scheduling weekly backup for %s." % self._settings.get(["weekly", "time"]))
-					schedule.every().day.at(self._settings.get(["weekly", "time"])).do(self._perform_backup,
-																					   backup_type="weekly_backups").tag(
-						"backupscheduler")
-				if self._settings.get_boolean(["monthly", "enabled"]) and self._settings.get(["monthly", "time"]) != "":
-					backups_enabled = True
-					self._logger.debug("Scheduling monthly backup for %s." % self._settings.get(["monthly", "time"]))
-					schedule.every().day.at(self._settings.get(["monthly", "time"])).do(self._perform_backup,
-																						backup_type="monthly_backups").tag(
-						"backupscheduler")
-				if not self._repeated_timer and backups_enabled is True:
-					self._repeated_timer = RepeatedTimer(60, schedule.run_pending)
-					self._repeated_timer.start()
+				self._scheduler.clear("backupscheduler")
+				backups_enabled = self._schedule_backups()
+				if not self._schedule_runner and backups_enabled is True:
+					self._schedule_runner = ScheduleRunner(self._scheduler, logger=self._logger)
+					self._schedule_runner.start()
+				elif self._schedule_runner:
+					# jobs changed, recalculate how long to sleep
+					self._schedule_runner.wake()
+				if not self._checked_missed_backups:
+					# only at startup, rescheduling after a settings change doesn't miss anything
+					self._checked_missed_backups = True
+					self._queue_missed_backups()
 			if event == "SettingsUpdated":
 				if self.current_settings != {"daily": self._settings.get(["daily"]),
 											 "weekly": self._settings.get(["weekly"]),
 											 "monthly": self._settings.get(["monthly"])}:
 					self._logger.debug("Settings updated.")
 					self.on_event("Startup", {})
-			if event in ("PrintFailed", "PrintDone") and self.backup_pending is True:
-				for backup in self.backup_pending_type:
-					self._logger.debug(f"Starting {backup} after print completion.")
-					self._perform_backup(backup_type=backup)
 
-	def _perform_backup(self, backup_type=None):
+	def _on_plugin_message(self, plugin, data, permissions=None):
+		if plugin == "backup" and isinstance(data, dict) and data.get("type") == "backup_error":
+			self._backup_completion.failed(data.get("name"), f"Backup failed ({data.get('error')})")
+
+	def _schedule_backups(self):
+		backups_enabled = False
+		if self._settings.get_boolean(["daily", "enabled"]) and self._settings.get(["daily", "time"]) != "":
+			backups_enabled = True
+			self._logger.debug("Scheduling daily backup for %s." % self._settings.get(["daily", "time"]))
+			job = self._plan_job("daily") or self._scheduler.every().day.at(self._settings.get(["daily", "time"]))
+			job.do(self._queue_backup, backup_type="daily_backups").tag("backupscheduler")
+		if self._settings.get_boolean(["weekly", "enabled"]) and self._settings.get(["weekly", "time"]) != "":
+			backups_enabled = True
+			weekday = WEEKDAYS[self._settings.get_int(["weekly", "day"]) - 1]
+			self._logger.debug("Scheduling weekly backup for %s at %s." % (weekday, self._settings.get(["weekly", "time"])))
+			job = self._plan_job("weekly") or getattr(self._scheduler.every(), weekday).at(
+				self._settings.get(["weekly", "time"]))
+			job.do(self._queue_backup, backup_type="weekly_backups").tag("backupscheduler")
+		if self._settings.get_boolean(["monthly", "enabled"]) and self._settings.get(["monthly", "time"]) != "":
+			backups_enabled = True
+			self._logger.debug("Scheduling monthly backup for day %s at %s." % (self._settings.get_int(["monthly", "day"]),
+																				self._settings.get(["monthly", "time"])))
+			job = self._plan_job("monthly") or self._scheduler.every().month.on(
+				self._settings.get_int(["monthly", "day"])).at(self._settings.get(["monthly", "time"]))
+			job.do(self._queue_backup, backup_type="monthly_backups").tag("backupscheduler")
+		for job in self._scheduler.jobs:
+			self._logger.debug(f"Next run of {job.job_func.keywords['backup_type']}: {job.next_run}")
+		return backups_enabled
+
+	def _plan_job(self, schedule_type):
+		if not self._settings.get_boolean([schedule_type, "auto_time"]):
+			return None
+		return self._scheduler.every().planned(functools.partial(self._plan_backup, schedule_type))
+
+	def _plan_backup(self, schedule_type, now):
+		# the hour the printer is most likely idle for a whole backup, on the schedule's day
+		period = AUTO_TIME_PERIODS[schedule_type]
+		backup_type = schedule_type + "_backups"
+		# the job is planned again right after it queued its backup, before that ran
+		last_run = max((self._state.get("last_runs", {}) or {}).get(backup_type, 0), self._queued_at.get(backup_type, 0))
+		earliest = now
+		if last_run:
+			earliest = max(now, datetime.fromtimestamp(last_run) + period / 2)
+		preferred = datetime.strptime(self._settings.get([schedule_type, "time"]) or "00:00", "%H:%M").time()
+		first = earliest.replace(minute=preferred.minute, second=0, microsecond=0)
+		if first <= earliest:
+			first += timedelta(hours=1)
+		candidates = [first + timedelta(hours=hour) for hour in range(int(period.total_seconds() // 3600))]
+		if schedule_type == "weekly":
+			weekday = self._settings.get_int(["weekly", "day"]) - 1
+			candidates = [c for c in candidates if c.weekday() == weekday]
+		elif schedule_type == "monthly":
+			day = self._settings.get_int(["monthly", "day"])
+			candidates = [c for c in candidates if c.day == min(day, calendar.monthrange(c.year, c.month)[1])]
+		if schedule_type != "daily":
+			candidates = [c for c in candidates if c.date() == candidates[0].date()]
+		self._utilisation.update()
+		slot = self._utilisation.best_slot(candidates, self._state.get("backup_duration") or DEFAULT_BACKUP_DURATION,
+										   preferred)
+		self._logger.debug(f"Planned {schedule_type} backup for {slot}.")
+		return slot or first
+
+	def _get_next_runs(self):
+		return {job.job_func.keywords["backup_type"]: job.next_run.isoformat() for job in self._scheduler.jobs
+				if "backupscheduler" in job.tags}
+
+	def _queue_backup(self, backup_type=None):
+		self._queued_at[backup_type] = time()
+		self._backup_coalescer.add(backup_type)
+
+	def _queue_missed_backups(self):
+		# one run of every schedule that was due within the catch-up window but didn't happen,
+		# because OctoPrint wasn't running or the clock jumped past it
+		window = self._settings.get_int(["catch_up_window"]) or 0
+		if not window or self._state is None:
+			return
+		now = datetime.now()
+		last_runs = self._state.get("last_runs", {}) or {}
+		seeded = {}
+		for job in self._scheduler.jobs:
+			if "backupscheduler" not in job.tags:
+				continue
+			backup_type = job.job_func.keywords["backup_type"]
+			due = job.last_due(now, timedelta(hours=window))
+			if job.unit == "planned" and backup_type in last_runs:
+				due = self._last_planned_due(backup_type, last_runs[backup_type], now, timedelta(hours=window))
+			if due is None or backup_type in self._pending_backups:
+				continue
+			if backup_type not in last_runs:
+				# nothing recorded yet, don't treat the whole window as missed
+				seeded[backup_type] = time()
+				continue
+			if max(last_runs[backup_type], self._queued_at.get(backup_type, 0)) < due.timestamp():
+				self._logger.info(f"Catching up on {backup_type} that was due at {due}.")
+				self._queue_backup(backup_type)
+		if seeded:
+			# a backup may have finished since, its run isn't overwritten
+			self._state.update("last_runs", lambda last_runs: dict(seeded, **(last_runs or {})))
+
+	def _last_planned_due(self, backup_type, last_run, now, window):
+		# learned times can't be replayed, a planned backup is missed once it's later than any plan would
+		# put it, and a period later for every further plan
+		period = AUTO_TIME_PERIODS[backup_type.replace("_backups", "")]
+		due = datetime.fromtimestamp(last_run) + period * 3 / 2
+		if due > now:
+			return None
+		due += period * int((now - due) / period)
+		return due if due >= now - window else None
+
+	def _submit_backups(self, backup_types):
+		self._backup_executor.submit(self._perform_backup, backup_types=backup_types)
+
+	def _run_pending_backups(self, backup_types):
+		self._backup_executor.submit(self._perform_backup, backup_types=backup_types).result()
+
+	def _get_backup_folder(self):
+		return os.path.join(self._settings.getBaseFolder("data"), "backup")
+
+	def _get_backup_options(self, backup_type):
+		schedule_type = backup_type.replace("_backups", "")
+		if schedule_type not in BACKUP_TYPES or not self._settings.get_boolean([schedule_type, "enabled"]):
+			return None
+		exclusions = []
+		if self._settings.get_boolean([schedule_type, "exclude_uploads"]):
+			exclusions.append("uploads")
+		if self._settings.get_boolean([schedule_type, "exclude_timelapse"]):
+			exclusions.append("timelapse")
+		return {"exclusions": exclusions, "retention": self._settings.get_int([schedule_type, "retention"]),
+				"max_age": self._settings.get_int([schedule_type, "max_age"]) or 0,
+				"compression": self._settings.get([schedule_type, "compression"]) or "default"}
+
+	def _perform_backup(self, backup_types=None):
+		coordinator = self._coordinator
+		if coordinator is None:
+			return self._run_backup_job(backup_types)
+		# other OctoPrint instances on the host may be backing up right now
+		with self._metrics.timer("coordination_wait"):
+			slot = coordinator.acquire(timeout=self._settings.get_int(["backup_timeout"]) * 60)
+		if slot is None:
+			self._logger.warning(f"Deferring {backup_types}, it wasn't their turn on this host in time.")
+			self._metrics.count("coordination_timeouts")
+			self._pending_backups.add(backup_type for backup_type in backup_types or [] if backup_type != "all")
+			if self._pending_worker is not None:
+				# also keeps the worker from dropping them if it started them
+				self._pending_worker.retry_later(COORDINATION_RETRY_DELAY)
+			return
+		self._backup_slot = (coordinator, slot)
+		try:
+			self._run_backup_job(backup_types)
+		finally:
+			coordinator, slot = self._backup_slot
+			self._backup_slot = None
+			if slot is not None:
+				coordinator.release(slot)
+
+	def _release_backup_slot(self):
+		# a paused backup doesn't keep the other instances on the host waiting
+		coordinator, slot = self._backup_slot
+		if slot is not None:
+			self._logger.info("Releasing the backup slot on this host while the backup is paused.")
+			coordinator.release(slot)
+			self._backup_slot = (coordinator, None)
+
+	def _reacquire_backup_slot(self):
+		coordinator, slot = self._backup_slot
+		if slot is None:
+			with self._metrics.timer("coordination_wait"):
+				self._backup_slot = (coordinator, coordinator.acquire())
+
+	def _run_backup_job(self, backup_types):
+		backup_types = list(OrderedDict.fromkeys(backup_types or []))
+		started = monotonic()
 		if self._printer.is_printing():
-			self._logger.debug(f"Skipping {backup_type} for now because a print is ongoing.")
-			self.backup_pending = True
-			if backup_type != "all" and backup_type not in self.backup_pending_type:
-				self.backup_pending_type.append(backup_type)
+			self._logger.debug(f"Skipping {backup_types} for now because a print is ongoing.")
+			self._metrics.count("skipped_printing")
+			self._pending_backups.add(backup_type for backup_type in backup_types if backup_type != "all")
 			return
 		if self._settings.get_boolean(["check_mount"]):
-			backup_folder = os.path.join(self._settings.getBaseFolder("data"), "backup")
-			if not os.path.ismount(backup_folder):
-				self._logger.debug(f"Skipping {backup_type} because there is no mount.")
+			backup_folder = self._get_backup_folder()
+			with self._metrics.timer("mount_check"):
+				mounted = os.path.ismount(backup_folder)
+			if not mounted:
+				self._logger.debug(f"Skipping {backup_types} because there is no mount.")
+				self._metrics.count("mount_failures")
 				data = {
 					"notifyTitle": gettext("Backup Failed"),
 					"notifyMessage": gettext(
@@ -154,95 +479,720 @@ class BackupschedulerPlugin(octoprint.plugin.SettingsPlugin,
 					body = self._loadFileWithPlaceholders("no_mount.html", {"backup_folder": backup_folder})
 					self._sendEmailNotification("OctoPrint Backup failed: Mount was missing!", body)
 				return
-		exclusions = []
-		retention = 0
-		if backup_type == "monthly_backups":
-			if datetime.now().day == self._settings.get_int(["monthly", "day"]) and self._settings.get_boolean(
-				["monthly", "enabled"]):
-				if self._settings.get_boolean(["monthly", "exclude_uploads"]):
-					exclusions.append("uploads")
-				if self._settings.get_boolean(["monthly", "exclude_timelapse"]):
-					exclusions.append("timelapse")
-				retention = self._settings.get_int(["monthly", "retention"])
-				if "monthly_backups" in self.backup_pending_type:
-					self.backup_pending_type.remove("monthly_backups")
-			else:
-				return
-		if backup_type == "weekly_backups":
-			if datetime.now().isoweekday() == self._settings.get_int(["weekly", "day"]) and self._settings.get_boolean(
-				["weekly", "enabled"]):
-				if self._settings.get_boolean(["weekly", "exclude_uploads"]):
-					exclusions.append("uploads")
-				if self._settings.get_boolean(["weekly", "exclude_timelapse"]):
-					exclusions.append("timelapse")
-				retention = self._settings.get_int(["weekly", "retention"])
-				if "weekly_backups" in self.backup_pending_type:
-					self.backup_pending_type.remove("weekly_backups")
-			else:
+
+		# backups due together with the same exclusions and compression share a single archive
+		groups = OrderedDict()
+		for backup_type in backup_types:
+			self._pending_backups.remove(backup_type)
+			options = self._get_backup_options(backup_type)
+			if options is None:
+				continue
+			key = (tuple(sorted(options["exclusions"])), options["compression"])
+			groups.setdefault(key, []).append(backup_type)
+		changes = {}
+		if self._settings.get_boolean(["skip_unchanged", "enabled"]):
+			for key in list(groups):
+				with self._metrics.timer("change_check"):
+					changes[key] = self._get_change_mark(list(key[0]))
+					previous = self._find_unchanged_backup(groups[key], list(key[0]), key[1], changes[key])
+				if previous is not None:
+					self._relabel_backup(groups.pop(key), list(key[0]), key[1], previous, changes[key])
+		estimates = {}
+		if groups and self._settings.get_boolean(["check_free_space"]) and \
+				self._settings.get(["backup_mode"]) == "full":
+			estimates = self._check_free_space(groups)
+			if estimates is None:
 				return
-		if backup_type == "daily_backups":
-			if self._settings.get_boolean(["daily", "enabled"]):
-				if self._settings.get_boolean(["daily", "exclude_uploads"]):
-					exclusions.append("uploads")
-				if self._settings.get_boolean(["daily", "exclude_timelapse"]):
-					exclusions.append("timelapse")
-				retention = self._settings.get_int(["daily", "retention"])
-				if "daily_backups" in self.backup_pending_type:
-					self.backup_pending_type.remove("daily_backups")
+		for key, group in groups.items():
+			exclusions, compression = key
+			self._create_backup(group, list(exclusions), compression, estimate=estimates.get(key),
+								change=changes.get(key))
+		# how long backups take, to plan automatic backup times around
+		if groups:
+			elapsed = monotonic() - started
+			self._state.update("backup_duration",
+							   lambda duration: elapsed if duration is None else duration + 0.3 * (elapsed - duration))
+		# write everything the job changed at once
+		with self._metrics.timer("settings_save"):
+			self._state.flush()
+			self._settings_writer.flush()
+		self._metrics.observe("backup", monotonic() - started)
+
+	def _check_free_space(self, groups):
+		# estimates the archives about to be created from the stat index, before writing any of them
+		backup_folder = self._get_backup_folder()
+		with self._metrics.timer("preflight"):
+			basedir = self._settings.settings._basedir
+			configfile = os.path.realpath(self._settings.settings._configfile)
+			stat_index = self._get_stat_index()
+			stat_index.refresh(basedir, self._get_excluded_paths([]))
+			ratios = self._state.get("archive_ratios", {}) or {}
+			estimates = OrderedDict()
+			required = 0
+			for exclusions, compression in groups:
+				estimate = stat_index.size(basedir, self._get_excluded_paths(list(exclusions)))
+				if os.path.dirname(configfile) != os.path.realpath(basedir) and os.path.isfile(configfile):
+					estimate += os.path.getsize(configfile)
+				estimates[(exclusions, compression)] = estimate
+				required += estimate * ratios.get(compression, 1.0)
+			required = int(required * FREE_SPACE_MARGIN)
+			free = get_free_space(backup_folder)
+		self._logger.debug(f"Backups need an estimated {required} bytes, {free} bytes are free.")
+		if required > free and self._settings.get_boolean(["free_space_prune"]):
+			self._logger.info(f"Pruning old backups to free {required - free} bytes.")
+			self._run_retention(free=required - free)
+			free = get_free_space(backup_folder)
+		if required <= free:
+			return estimates
+		self._logger.error(f"Skipping backups, they need an estimated {required} bytes but only {free} bytes are free.")
+		self._metrics.count("insufficient_space")
+		data = {"notifyTitle": gettext("Backup Failed"),
+				"notifyMessage": gettext("Last Backup was skipped because the backup folder is out of space, it needs about %(required)s but only %(free)s are free.",
+										 required=format_size(required), free=format_size(free)),
+				"notifyType": "error", "notifyHide": False}
+		self._sendNotificationToClient(data, True)
+		if self._settings.get_boolean(["send_email", "enabled"]):
+			body = self._loadFileWithPlaceholders("no_space.html", {"backup_folder": backup_folder,
+																	 "required": format_size(required),
+																	 "free": format_size(free)})
+			self._sendEmailNotification("OctoPrint Backup failed: Not enough space!", body)
+		return None
+
+	def _get_stat_index(self):
+		if self._stat_index is None:
+			self._stat_index = StatIndex(os.path.join(self.get_plugin_data_folder(), "statindex.json"))
+		return self._stat_index
+
+	def _get_backup_filenames(self, group):
+		instance_name = self._settings.global_get(["appearance", "name"]).replace(" ", "-") or "octoprint"
+		now = datetime.now()
+		return OrderedDict((backup_type, "{}-{}-{:%Y%m%d-%H%M%S}.zip".format(
+			instance_name, backup_type.replace("_backups", ""), now)) for backup_type in group)
+
+	def _create_backup(self, group, exclusions, compression="default", estimate=None, change=None):
+		filenames = self._get_backup_filenames(group)
+		backup_filename = next(iter(filenames.values()))
+		self._logger.debug("Performing {} with exclusions: {} and compression: {} as {}.".format(
+			list(filenames), exclusions, compression, backup_filename))
+		started = monotonic()
+		# the success mail of a scheduled backup is sent below, with the details of the backup
+		self._creating_backup.set()
+		try:
+			with self._metrics.timer("archive"):
+				if self._settings.get(["backup_mode"]) == "incremental":
+					stats = self._create_incremental_backup(backup_filename, exclusions, compression)
+				elif self._settings.get(["backup_mode"]) == "snapshot":
+					stats = self._create_snapshot_backup(backup_filename, exclusions, compression)
+				elif compression != "default" or self._settings.get_boolean(["low_impact", "enabled"]) or \
+						self._settings.get_int(["archive_workers"]) != 1:
+					# the backup plugin's archiver can be neither throttled, parallelized nor told how to compress
+					stats = self._create_compressed_backup(backup_filename, exclusions,
+														   "deflate" if compression == "default" else compression)
+				else:
+					stats = self._create_full_backup(backup_filename, exclusions)
+		finally:
+			self._creating_backup.clear()
+		if stats is None:
+			self._metrics.count("backups_failed")
+			return
+		duration = monotonic() - started
+		self._metrics.count("backups_created", len(filenames))
+		self._metrics.count("bytes_written", self._get_backup_size(backup_filename, stats))
+		if estimate:
+			# how much this compression shrinks the data, for the next estimate
+			ratio = self._get_backup_size(backup_filename, stats) / float(estimate)
+			self._state.update("archive_ratios", lambda ratios: dict(ratios or {}, **{compression: ratio}))
+		self._metrics.count("files_archived", stats.get("files") or 0)
+		if len(filenames) > 1:
+			self._link_backup(backup_filename, filenames, duration, exclusions)
+		for backup_type in filenames:
+			self._record_backup(backup_type, filenames[backup_type])
+		self._record_last_runs(filenames)
+		fields = {}
+		if change is not None:
+			self._record_change_marks(filenames, exclusions, compression, change, time())
+			fields["skip_ratio"] = self._count_change_check(False)
+		self._catalog_backup(filenames, stats, exclusions=exclusions, compression=compression, duration=duration,
+							 **fields)
+		if self._settings.get_boolean(["send_email", "send_successful"]):
+			self._send_backup_created_mail(filenames, stats, duration)
+		# hashing the archive and deleting old backups doesn't need to hold up the next backup
+		self._maintenance_executor.submit(self._complete_catalog_entries, set(filenames.values()))
+		if self._settings.get_boolean(["verify_backups"]):
+			self._maintenance_executor.submit(self._verify_backup, filenames, stats.get("manifest"), stats.get("sources"))
+		if self._settings.get_boolean(["replication", "enabled"]):
+			self._replicate_backups(filenames.values())
+		self._maintenance_executor.submit(self._run_retention)
+
+	def _create_full_backup(self, backup_filename, exclusions):
+		sources = None
+		if self._settings.get_boolean(["verify_backups"]):
+			# the backup plugin doesn't tell what it archived, verify against what it should have
+			sources = get_source_manifest(self._iter_backup_files(exclusions))
+		backup_created = self._backup_completion.expect(backup_filename)
+		self._failure_notified.clear()
+		try:
+			self.backup_helpers["create_backup"](exclude=exclusions, filename=backup_filename)
+			with self._metrics.timer("wait_for_completion"):
+				backup_created.result(timeout=self._settings.get_int(["backup_timeout"]) * 60)
+		except BackupFailedError as e:
+			self._logger.error(str(e))
+			# backups failing before they started (not enough space) never reach after_backup
+			if not self._failure_notified.is_set():
+				self._notify_backup_failed()
+			return None
+		except Exception as e:
+			self._backup_completion.discard(backup_filename)
+			if isinstance(e, TimeoutError):
+				self._logger.error(f"Timed out waiting for {backup_filename} to be created.")
 			else:
+				self._logger.exception(f"Error while creating {backup_filename}.")
+			self._notify_backup_failed()
+			return None
+		# the backup plugin doesn't tell, but the archive's central directory does
+		try:
+			return {"files": self._count_archive_files(os.path.join(self._get_backup_folder(), backup_filename)),
+					"sources": sources}
+		except (IOError, OSError, zipfile.BadZipFile):
+			return {"sources": sources}
+
+	@staticmethod
+	def _count_archive_files(path):
+		with zipfile.ZipFile(path) as zip_file:
+			return sum(1 for n in zip_file.namelist() if n.startswith("basedir/") and not n.endswith("/"))
+
+	def _create_compressed_backup(self, backup_filename, exclusions, compression):
+		# the backup plugin always deflates everything, so build the archive ourselves
+		started = process_time()
+		workers = self._settings.get_int(["archive_workers"])
+		kwargs = {"strategy": compression}
+		if workers != 1:
+			# 0 uses a worker per CPU core
+			kwargs["workers"] = workers or None
+		self._call_backup_hooks("before_backup")
+		try:
+			stats = self._run_archiver(build_backup_archive if workers == 1 else build_backup_archive_parallel,
+									   os.path.join(self._get_backup_folder(), backup_filename),
+									   self._iter_backup_files(exclusions),
+									   {"version": get_octoprint_version_string(), "excludes": exclusions},
+									   self._get_plugin_list(), **kwargs)
+		except Exception:
+			self._logger.exception(f"Error while creating {backup_filename}.")
+			self._call_backup_hooks("after_backup", error=True)
+			return None
+		self._logger.info("Backup {} archived {files} files ({bytes} bytes, {stored_bytes} stored uncompressed) "
+						  "in {cpu:.1f} CPU seconds with {compression} compression.".format(
+							backup_filename, cpu=process_time() - started, compression=compression, **stats))
+		self._call_backup_hooks("after_backup", error=False)
+		return stats
+
+	def _create_incremental_backup(self, backup_filename, exclusions, compression):
+		self._call_backup_hooks("before_backup")
+		try:
+			chunk_store = self._get_chunk_store(exclusions)
+			metadata = {"backup": {"version": get_octoprint_version_string(), "excludes": exclusions},
+						"plugin_list": self._get_plugin_list(), "compression": compression}
+			stats = self._run_archiver(chunk_store.snapshot, backup_filename, self._iter_backup_files(exclusions),
+									   metadata, previous=chunk_store.latest_manifest())
+		except Exception:
+			self._logger.exception(f"Error while creating incremental backup {backup_filename}.")
+			self._call_backup_hooks("after_backup", error=True)
+			return None
+		self._logger.info("Incremental backup {} recorded {files} files ({bytes} bytes), {reused_files} unchanged, "
+						  "{new_chunks} new chunks ({new_bytes} bytes).".format(backup_filename, **stats))
+		self._call_backup_hooks("after_backup", error=False)
+		return stats
+
+	def _create_snapshot_backup(self, backup_filename, exclusions, compression):
+		self._call_backup_hooks("before_backup")
+		try:
+			snapshot_store = self._get_snapshot_store()
+			metadata = {"backup": {"version": get_octoprint_version_string(), "excludes": exclusions},
+						"plugin_list": self._get_plugin_list(), "compression": compression}
+			stats = self._run_archiver(snapshot_store.snapshot, backup_filename, self._iter_backup_files(exclusions),
+									   metadata, previous=snapshot_store.latest_manifest())
+		except Exception:
+			self._logger.exception(f"Error while creating snapshot backup {backup_filename}.")
+			self._call_backup_hooks("after_backup", error=True)
+			return None
+		self._logger.info("Snapshot {} recorded {files} files ({bytes} bytes), {linked_files} linked to the previous "
+						  "snapshot, {new_files} copied ({new_bytes} bytes).".format(backup_filename, **stats))
+		self._call_backup_hooks("after_backup", error=False)
+		return stats
+
+	def _call_backup_hooks(self, name, **kwargs):
+		# what the backup plugin calls around the backups it creates, for the ones built here
+		hook_name = "octoprint.plugin.backup." + name
+		for plugin, hook in self._plugin_manager.get_hooks(hook_name).items():
+			try:
+				hook(**kwargs)
+			except Exception:
+				self._logger.exception(f"Error while calling the {hook_name} hook of plugin {plugin}.")
+
+	def _run_archiver(self, archiver, *args, **kwargs):
+		if not self._settings.get_boolean(["low_impact", "enabled"]):
+			return archiver(*args, **kwargs)
+		throttle = IOThrottle()
+		if self._backup_slot is not None:
+			throttle.on_pause = self._release_backup_slot
+			throttle.on_resume = self._reacquire_backup_slot
+		self._update_io_throttle(throttle, printing=self._printer.is_printing())
+		self._io_throttle = throttle
+		try:
+			return run_at_low_priority(archiver, *args, throttle=throttle, **kwargs)
+		finally:
+			self._io_throttle = None
+			throttle.resume()
+
+	def _update_io_throttle(self, throttle, printing=False):
+		if printing and self._settings.get(["low_impact", "on_print"]) == "pause":
+			self._logger.info("Pausing backup while printing.")
+			throttle.pause()
+			return
+		limit = self._settings.get_int(["low_impact", "print_write_limit" if printing else "write_limit"])
+		self._logger.debug("Limiting backup writes to {} KiB/s.".format(limit or "unlimited"))
+		throttle.rate = limit * 1024
+		throttle.resume()
+
+	def _get_chunk_store(self, exclusions=()):
+		if self._coordinator is not None and self._settings.get_boolean(["coordination", "share_chunks"]):
+			return self._coordinator.chunk_store(exclusions)
+		return self._get_local_chunk_store()
+
+	def _get_local_chunk_store(self):
+		if self._chunk_store is None:
+			self._chunk_store = ChunkStore(os.path.join(self.get_plugin_data_folder(), "incremental"))
+		return self._chunk_store
+
+	def _get_snapshot_store(self):
+		if self._snapshot_store is None:
+			self._snapshot_store = SnapshotStore(os.path.join(self._get_backup_folder(), "snapshots"))
+		return self._snapshot_store
+
+	def _get_backup_store(self, exclusions=()):
+		# where backups of the current mode are kept if they aren't archives, both stores share an interface
+		mode = self._settings.get(["backup_mode"])
+		if mode == "incremental":
+			return self._get_chunk_store(exclusions)
+		if mode == "snapshot":
+			return self._get_snapshot_store()
+		return None
+
+	def _get_backup_stores(self):
+		# stores that may hold backups, also of a mode that isn't used anymore
+		stores = []
+		if self._chunk_store is not None or os.path.isdir(os.path.join(self.get_plugin_data_folder(), "incremental")):
+			stores.append(self._get_local_chunk_store())
+		if self._coordinator is not None:
+			stores.extend(self._coordinator.chunk_stores())
+		if self._snapshot_store is not None or self._settings.get(["backup_mode"]) == "snapshot" or \
+				os.path.isdir(os.path.join(self._get_backup_folder(), "snapshots")):
+			stores.append(self._get_snapshot_store())
+		return stores
+
+	def _find_backup_store(self, name):
+		return next((store for store in self._get_backup_stores() if store.has_manifest(name)), None)
+
+	def _get_excluded_paths(self, exclusions):
+		additional = [os.path.join(self.get_plugin_data_folder(), "incremental")]
+		# what other plugins keep out of backups, the backup plugin honours the same hook
+		additional += get_hook_excluded_paths(self._plugin_manager.get_hooks("octoprint.plugin.backup.additional_excludes"),
+											  self._settings.getBaseFolder("data"), exclusions, self._logger)
+		if self._coordinator is not None:
+			# may be inside the base folder, and it holds the other instances' backups
+			additional.append(self._coordinator.folder)
+		return get_excluded_paths(self._settings, exclusions, additional)
+
+	def _iter_backup_files(self, exclusions, additional=None):
+		return iter_backup_files(self._settings.settings._basedir, self._settings.settings._configfile,
+								 self._get_excluded_paths(exclusions) + (additional or []),
+								 get_external_folders(self._settings))
+
+	def _get_plugin_list(self):
+		# same format as the backup plugin's plugin_list.json
+		return [{"key": plugin.key, "name": plugin.name, "url": plugin.url}
+				for plugin in self._plugin_manager.enabled_plugins.values() if not plugin.bundled]
+
+	def _export_backup(self, name):
+		target = os.path.join(self._get_backup_folder(), name)
+		self._logger.info(f"Exporting backup {name} to {target}.")
+		try:
+			store = self._find_backup_store(name)
+			compression = store.load_manifest(name)["metadata"].get("compression", "default")
+			store.export(name, target, strategy="deflate" if compression == "default" else compression)
+		except Exception:
+			self._logger.exception(f"Error while exporting backup {name}.")
+			self._notify_backup_failed()
+
+	def _link_backup(self, backup_filename, filenames, duration, exclusions=()):
+		backup_folder = self._get_backup_folder()
+		source = os.path.join(backup_folder, backup_filename)
+		store = self._get_backup_store(exclusions)
+		for backup_type, filename in filenames.items():
+			if filename == backup_filename:
+				continue
+			try:
+				if store is not None:
+					store.copy_manifest(backup_filename, filename)
+				else:
+					os.link(source, os.path.join(backup_folder, filename))
+			except OSError as e:
+				# no hardlinks on this filesystem, let the retention lists share the archive instead
+				self._logger.debug(f"Could not link {filename} to {backup_filename}, sharing it instead: {e}")
+				filenames[backup_type] = backup_filename
+		saved = len(filenames) - 1
+		try:
+			saved_bytes = 0 if store is not None else os.path.getsize(source) * saved
+		except OSError:
+			saved_bytes = 0
+		self._logger.info("Created one archive for {}, saving {} archive(s), {:.1f}s and {} bytes.".format(
+			", ".join(filenames), saved, duration * saved, saved_bytes))
+
+	# ~~ Host coordination
+
+	def _update_coordinator(self):
+		enabled = self._settings.get_boolean(["coordination", "enabled"])
+		folder = self._settings.get(["coordination", "folder"]) or DEFAULT_COORDINATION_FOLDER
+		if self._coordinator is not None and (not enabled or self._coordinator.folder != folder):
+			self._coordinator.stop()
+			self._coordinator = None
+		if not enabled:
+			return
+		if not coordination.SUPPORTED:
+			self._logger.warning("Backups can't be coordinated with other instances on this platform.")
+			return
+		if self._coordinator is None:
+			instance_name = self._settings.global_get(["appearance", "name"]) or "octoprint"
+			try:
+				self._coordinator = HostCoordinator(folder, get_member_id(instance_name, self._settings.settings._basedir),
+													logger=self._logger)
+			except OSError as e:
+				self._logger.error(f"Could not coordinate backups through {folder}: {e}")
 				return
-		if backup_type == "startup_backups":
-			if self._settings.get_boolean(["startup", "enabled"]):
-				if self._settings.get_boolean(["startup", "exclude_uploads"]):
-					exclusions.append("uploads")
-				if self._settings.get_boolean(["startup", "exclude_timelapse"]):
-					exclusions.append("timelapse")
-				retention = self._settings.get_int(["startup", "retention"])
-				if "startup_backups" in self.backup_pending_type:
-					self.backup_pending_type.remove("startup_backups")
+			self._logger.info(f"Coordinating backups with other instances through {folder} as {self._coordinator.member}.")
+		self._coordinator.max_concurrent = max(1, self._settings.get_int(["coordination", "max_concurrent"]) or 1)
+		self._coordinator.stagger = (self._settings.get_int(["coordination", "stagger"]) or 0) * 60
+
+	# ~~ Change tracking
+
+	def _update_change_tracker(self):
+		enabled = self._settings.get_boolean(["skip_unchanged", "enabled"])
+		if enabled and self._change_tracker is None:
+			# the plugin's own bookkeeping doesn't count as a change
+			self._change_tracker = ChangeTracker(self._settings.settings._basedir,
+												 self._get_excluded_paths([]) + [self.get_plugin_data_folder()],
+												 logger=self._logger)
+			self._change_tracker.start()
+		elif not enabled and self._change_tracker is not None:
+			self._change_tracker.stop()
+			self._change_tracker = None
+
+	def _get_change_mark(self, exclusions):
+		# where the watcher stands before archiving, or a digest of the files if there is no watcher
+		tracker = self._change_tracker
+		# the watcher only sees the base folder, not the folders configured outside of it
+		if tracker is not None and tracker.watching and not get_external_folders(self._settings):
+			return {"session": tracker.session, "sequence": tracker.mark()}
+		files = self._iter_backup_files(exclusions, [os.path.realpath(self.get_plugin_data_folder())])
+		return {"digest": tree_digest(files)}
+
+	def _find_unchanged_backup(self, group, exclusions, compression, change):
+		# the newest backup of the group, if nothing it covers changed since and it isn't too old
+		marks = self._state.get("change_marks", {}) or {}
+		max_staleness = self._settings.get_int(["skip_unchanged", "max_staleness"]) * 86400
+		previous = [marks.get(backup_type) for backup_type in group]
+		for mark in previous:
+			if mark is None or mark["exclusions"] != sorted(exclusions) or mark["compression"] != compression or \
+					mark["mode"] != self._settings.get(["backup_mode"]):
+				return None
+			if max_staleness and time() - mark["archived"] > max_staleness:
+				return None
+			if not self._backup_exists(mark["backup"], exclusions):
+				return None
+			if "digest" in change:
+				if mark.get("digest") != change["digest"]:
+					return None
+			elif mark.get("session") != change["session"] or self._change_tracker.changed_since(
+					mark["sequence"], self._get_excluded_paths(exclusions)):
+				return None
+		return max(previous, key=lambda mark: mark["archived"])
+
+	def _backup_exists(self, backup_filename, exclusions=()):
+		store = self._get_backup_store(exclusions)
+		if store is not None:
+			return store.has_manifest(backup_filename)
+		return os.path.exists(os.path.join(self._get_backup_folder(), backup_filename))
+
+	def _relabel_backup(self, group, exclusions, compression, previous, change):
+		# nothing changed, the new backups are links to the previous archive instead of new ones
+		source = previous["backup"]
+		filenames = self._get_backup_filenames(group)
+		store = self._get_backup_store(exclusions)
+		for backup_type, filename in filenames.items():
+			try:
+				if store is not None:
+					store.copy_manifest(source, filename)
+				else:
+					os.link(os.path.join(self._get_backup_folder(), source),
+							os.path.join(self._get_backup_folder(), filename))
+			except OSError as e:
+				self._logger.debug(f"Could not link {filename} to {source}, sharing it instead: {e}")
+				filenames[backup_type] = source
+		self._logger.info("Nothing changed since {}, recorded it as {}.".format(source, ", ".join(
+			OrderedDict.fromkeys(filenames.values()))))
+		self._metrics.count("backups_unchanged", len(filenames))
+		for backup_type in filenames:
+			self._record_backup(backup_type, filenames[backup_type])
+		self._record_last_runs(filenames)
+		self._record_change_marks(filenames, exclusions, compression, change, previous["archived"])
+		new_filenames = OrderedDict((t, f) for t, f in filenames.items() if f != source)
+		if new_filenames:
+			# same content, no need to read it back again
+			entry = self._catalog.get(source) or {}
+			self._catalog_backup(new_filenames, {"files": entry.get("files")}, exclusions=exclusions,
+								 compression=compression, duration=0, size=entry.get("size"), hash=entry.get("hash"),
+								 unchanged_since=source, skip_ratio=self._count_change_check(True))
+			if entry.get("hash") is None or store is not None:
+				self._maintenance_executor.submit(self._complete_catalog_entries, set(new_filenames.values()))
+			if self._settings.get_boolean(["replication", "enabled"]):
+				self._replicate_backups(new_filenames.values())
+		self._maintenance_executor.submit(self._run_retention)
+
+	def _record_last_runs(self, backup_types):
+		now = time()
+		self._state.update("last_runs",
+						   lambda last_runs: dict(last_runs or {}, **{backup_type: now for backup_type in backup_types}))
+
+	def _record_change_marks(self, filenames, exclusions, compression, change, archived):
+		mode = self._settings.get(["backup_mode"])
+
+		def record(marks):
+			marks = marks or {}
+			for backup_type, filename in filenames.items():
+				marks[backup_type] = dict(change, backup=filename, archived=archived, exclusions=sorted(exclusions),
+										  compression=compression, mode=mode)
+			return marks
+
+		self._state.update("change_marks", record)
+
+	def _count_change_check(self, unchanged):
+		# share of the scheduled backups that were skipped because nothing changed
+		def count(counts):
+			counts = counts or {"checked": 0, "unchanged": 0}
+			counts["checked"] += 1
+			counts["unchanged"] += 1 if unchanged else 0
+			return counts
+
+		counts = self._state.update("change_checks", count)
+		return counts["unchanged"] / float(counts["checked"])
+
+	def _get_backup_size(self, backup_filename, stats):
+		# incremental and snapshot backups take up the space of the chunks or files they added
+		if stats.get("new_bytes") is not None:
+			return stats["new_bytes"]
+		try:
+			return os.path.getsize(os.path.join(self._get_backup_folder(), backup_filename))
+		except OSError:
+			return 0
+
+	def _send_backup_created_mail(self, filenames, stats, duration):
+		backup_filename = next(iter(filenames.values()))
+		size = self._get_backup_size(backup_filename, stats)
+		next_runs = self._get_next_runs()
+		next_run = min((next_runs[backup_type] for backup_type in filenames if backup_type in next_runs), default=None)
+		body = self._mail_templates.render("backup_created.html", {
+			"backup_name": backup_filename,
+			"backup_types": ", ".join(backup_type.replace("_backups", "") for backup_type in filenames),
+			"size": format_size(size),
+			"duration": "{:.1f} s".format(duration),
+			"files": stats["files"] if stats.get("files") is not None else "-",
+			"next_run": next_run.replace("T", " ") if next_run else "-"})
+		self._sendEmailNotification("OctoPrint Backup Successful", body, digest=True)
+
+	def _catalog_backup(self, filenames, stats, **fields):
+		backup_types = OrderedDict()
+		for backup_type, filename in filenames.items():
+			backup_types.setdefault(filename, []).append(backup_type)
+		for filename, types in backup_types.items():
+			entry = {"name": filename, "backup_types": types, "created": time(), "files": stats.get("files"),
+					 "size": stats.get("new_bytes"), "hash": None, "mode": self._settings.get(["backup_mode"])}
+			entry.update(fields)
+			self._catalog.put(entry)
+
+	def _complete_catalog_entries(self, names):
+		# size, hash and file count of new archives, read back from disk with a fixed size buffer
+		for name in names:
+			try:
+				store = self._find_backup_store(name)
+				if store is not None:
+					self._catalog.update(name, hash=file_digest(store.manifest_path(name)))
+					continue
+				path = os.path.join(self._get_backup_folder(), name)
+				fields = {"size": os.path.getsize(path), "hash": file_digest(path)}
+				if self._catalog.get(name).get("files") is None:
+					fields["files"] = self._count_archive_files(path)
+				self._catalog.update(name, **fields)
+			except Exception:
+				self._logger.exception(f"Error while reading back {name} for the backup catalog.")
+
+	def _verify_backup(self, filenames, manifest=None, sources=None):
+		# coalesced backups are hardlinks of the same archive, reading one of them is enough
+		backup_filename = next(iter(filenames.values()))
+		try:
+			with self._metrics.timer("verify"):
+				if manifest is None and sources:
+					manifest = get_unchanged_manifest(sources)
+				store = self._find_backup_store(backup_filename)
+				if store is not None:
+					result = run_at_low_priority(store.verify, backup_filename)
+				else:
+					result = run_at_low_priority(verify_archive, os.path.join(self._get_backup_folder(), backup_filename),
+												 manifest)
+		except Exception:
+			self._logger.exception(f"Error while verifying {backup_filename}.")
+			return
+		verified = {"ok": not result["errors"], "time": time(), "errors": result["errors"][:10]}
+		for name in set(filenames.values()):
+			self._catalog.update(name, verified=verified)
+		if verified["ok"]:
+			self._metrics.count("backups_verified")
+			self._logger.info("Verified {} entries ({} bytes) of {}.".format(result["entries"], result["bytes"],
+																			 backup_filename))
+			return
+		self._metrics.count("verification_failures")
+		self._logger.error("Backup {} is corrupt: {}".format(backup_filename, "; ".join(result["errors"][:10])))
+		self._notify_backup_corrupt(backup_filename, result["errors"])
+
+	def _replicate_backups(self, names):
+		# coalesced backups are links of one archive, its bytes only need to go over the wire once
+		uploaded = {}
+		unreplicated = []
+		for name in OrderedDict.fromkeys(names):
+			try:
+				st = os.stat(os.path.join(self._get_backup_folder(), name))
+			except OSError:
+				# incremental and snapshot backups aren't archives until they are exported
+				unreplicated.append(name)
+				continue
+			if (st.st_dev, st.st_ino) in uploaded:
+				self._replicator.copy(uploaded[(st.st_dev, st.st_ino)], name)
 			else:
+				uploaded[(st.st_dev, st.st_ino)] = name
+				self._replicator.upload(name)
+		if unreplicated:
+			self._logger.warning(f"Not replicating {', '.join(unreplicated)}, there is no archive of it to upload.")
+			self._notify_not_replicated(unreplicated)
+
+	def _notify_replication_failed(self, job, error):
+		data = {"notifyTitle": gettext("Replication Failed"), "notifyMessage": f"{job['name']}: {error}",
+				"notifyType": "error", "notifyHide": False}
+		self._sendNotificationToClient(data, True)
+
+	def _notify_not_replicated(self, names):
+		data = {"notifyTitle": gettext("Backup Not Replicated"),
+				"notifyMessage": gettext("%(names)s can't be replicated, only archives are. Export the backup to replicate it, or use the full backup mode.",
+										 names=", ".join(names)),
+				"notifyType": "error", "notifyHide": False}
+		self._sendNotificationToClient(data)
+
+	def _sync_catalog(self, entries):
+		on_disk = {entry.name: entry for entry in entries}
+		for entry in self._catalog.entries():
+			if entry["name"] not in on_disk:
+				self._catalog.delete(entry["name"])
+		for name, entry in on_disk.items():
+			if name not in self._catalog:
+				self._catalog.put({"name": name, "backup_types": sorted(entry.backup_types), "created": entry.created,
+								   "size": entry.size})
+
+	def _record_backup(self, backup_type, backup_filename):
+		with self._retention_lock:
+			completed_backups = self._state.get(backup_type, [])
+			if backup_filename in completed_backups:
 				return
+			completed_backups.append(backup_filename)
+			self._state.set(backup_type, completed_backups)
 
-		instance_name = self._settings.global_get(["appearance", "name"]).replace(" ", "-") or "octoprint"
-		backup_filename = "{}-{}-{:%Y%m%d-%H%M%S}.zip".format(instance_name, backup_type.replace("_backups", ""),
-															  datetime.now())
-		self._logger.debug("Performing {} with exclusions: {} as {}.".format(backup_type, exclusions, backup_filename))
-		self.creating_backup = True
-		self.backup_helpers["create_backup"](exclude=exclusions, filename=backup_filename)
-		while self.creating_backup:
-			sleep(1)
-		completed_backups = self._settings.get([backup_type])
-		completed_backups.append(backup_filename)
-		# do retention check here and delete older backups
-		delete_backups = completed_backups[:-retention]
-		for backup in delete_backups:
-			self._logger.debug(f"Deleting backup: {backup}")
-			self.backup_helpers["delete_backup"](backup)
-		retained_backups = completed_backups[-retention:]
-		self._settings.set([backup_type], retained_backups)
-		self._settings.save(trigger_event=False)
-		self._logger.debug(self._settings.get([backup_type]))
-		self.backup_pending = False
+	def _run_retention(self, free=0):
+		# runs in the background after a backup, pruning against the backups that actually exist, or
+		# before one to free `free` bytes
+		with self._retention_lock, self._metrics.timer("retention"):
+			instance_name = self._settings.global_get(["appearance", "name"]).replace(" ", "-") or "octoprint"
+			assigned = {"{}_backups".format(t): self._state.get("{}_backups".format(t), []) for t in BACKUP_TYPES}
+			stored = [name for store in self._get_backup_stores() for name in store.list_manifests()]
+			entries = scan_backups(self._get_backup_folder(), instance_name, assigned, stored)
+			policies = {}
+			for backup_type in assigned:
+				options = self._get_backup_options(backup_type)
+				if options is not None:
+					policies[backup_type] = (options["retention"], options["max_age"] * 86400)
+			delete_backups, retained_backups = plan_retention(entries, policies,
+															  self._settings.get_int(["retention_quota"]) * 1024 * 1024,
+															  free=free)
+			for backup in delete_backups:
+				try:
+					self._delete_backup(backup)
+					self._metrics.count("backups_deleted")
+				except Exception:
+					self._logger.exception(f"Error while deleting backup {backup}.")
+					continue
+				if self._settings.get_boolean(["replication", "enabled"]) and \
+						self._settings.get_boolean(["replication", "mirror_deletes"]):
+					self._replicator.delete(backup)
+			for backup_type in assigned:
+				self._state.set(backup_type, retained_backups.get(backup_type, []))
+			self._sync_catalog(entry for entry in entries if entry.name not in delete_backups)
+			self._state.flush()
+			self._logger.debug(f"Retained backups: {retained_backups}")
+
+	def _delete_backup(self, backup):
+		self._logger.debug(f"Deleting backup: {backup}")
+		store = self._find_backup_store(backup)
+		if store is not None:
+			freed = store.delete_manifest(backup)
+			self._logger.debug(f"Deleted stored backup {backup}, freed {freed} bytes.")
+			if not os.path.exists(os.path.join(self._get_backup_folder(), backup)):
+				return
+		self.backup_helpers["delete_backup"](backup)
 
 	# ~~ BackupPlugin hooks
 
 	def after_backup(self, error):
 		if error:
-			data = {"notifyTitle": gettext("Backup Failed"),
-					"notifyMessage": gettext(
-						"Something went wrong with the last backup. Please check octoprint.log for possible causes."),
-					"notfiyType": "error", "notifyHide": False}
-			self._sendNotificationToClient(data, True)
-			if self._settings.get_boolean(["send_email", "enabled"]):
-				body = self._loadFileWithPlaceholders("backup_failed.html")
-				self._sendEmailNotification("OctoPrint Backup Failed", body)
+			self._failure_notified.set()
+			self._notify_backup_failed()
 		else:
 			self._sendNotificationToClient({"notifyTitle": "", "clear_notification": True})
 			self._settings.remove(["notification", "retained_message"])
-			self._settings.save(trigger_event=True)
-			if self._settings.get_boolean(["send_email", "send_successful"]):
+			self._settings_writer.request(True)
+			if self._settings.get_boolean(["send_email", "send_successful"]) and not self._creating_backup.is_set():
 				body = self._loadFileWithPlaceholders("backup_successful.html")
-				self._sendEmailNotification("OctoPrint Backup Successful", body)
+				self._sendEmailNotification("OctoPrint Backup Successful", body, digest=True)
+
+	def additional_excludes(self, excludes, *args, **kwargs):
+		# the chunk store of incremental backups doesn't belong into full backups
+		return ["incremental"]
+
+	def _notify_backup_failed(self):
+		data = {"notifyTitle": gettext("Backup Failed"),
+				"notifyMessage": gettext(
+					"Something went wrong with the last backup. Please check octoprint.log for possible causes."),
+				"notfiyType": "error", "notifyHide": False}
+		self._sendNotificationToClient(data, True)
+		if self._settings.get_boolean(["send_email", "enabled"]):
+			body = self._loadFileWithPlaceholders("backup_failed.html")
+			self._sendEmailNotification("OctoPrint Backup Failed", body)
+
+	def _notify_backup_corrupt(self, backup_filename, errors):
+		data = {"notifyTitle": gettext("Backup Verification Failed"),
+				"notifyMessage": gettext("The backup %(name)s can't be read back correctly, check the backup folder's storage.",
+										 name=backup_filename),
+				"notifyType": "error", "notifyHide": False}
+		self._sendNotificationToClient(data, True)
+		if self._settings.get_boolean(["send_email", "enabled"]):
+			body = self._loadFileWithPlaceholders("backup_corrupt.html", {"backup_name": backup_filename,
+																		  "errors": "<br>".join(errors[:10])})
+			self._sendEmailNotification("OctoPrint Backup Corrupt", body)
 
 	# ~~ Client notifications
 
@@ -258,61 +1208,42 @@ class BackupschedulerPlugin(octoprint.plugin.SettingsPlugin,
 		if retain:
 			# TODO: add timestamp and append to previous notification message?
 			self._settings.set(["notification", "retained_message"], payload)
-			self._settings.save(trigger_event=True)
+			self._settings_writer.request(True)
 		self._plugin_manager.send_plugin_message(self._identifier, payload)
 
 	# Load html-template files for mails - {{placeholder}} format for replacement
-	def _loadFileWithPlaceholders(self, filename, placeholders=dict()):
-		returnText = ""
-		file = os.path.join(self._basefolder, "static", "mailtmpl", filename)
-		with open(file, 'r', encoding='utf-8') as f:
-			for row in f:
-				returnText += row
-			for key, value in placeholders.items():
-				returnText = returnText.replace("{{" + key + "}}", value)
-		return returnText
-
-	def _sendEmailNotification(self, subject, body, smtp_server=None, smtp_port=None, smtp_tls=None, smtp_user=None,
-							   smtp_password=None, smtp_sender=None, smtp_recipient=None):
-		# fill in values from settings if not supplied
-		smtp_server = smtp_server or self._settings.get(["send_email", "smtp_server"])
-		smtp_port = smtp_port or self._settings.get_int(["send_email", "smtp_port"])
-		smtp_tls = smtp_tls or self._settings.get_boolean(["send_email", "smtp_tls"])
-		smtp_user = smtp_user or self._settings.get(["send_email", "smtp_user"])
-		smtp_password = smtp_password or self._settings.get(["send_email", "smtp_password"])
-		smtp_sender = smtp_sender or self._settings.get(["send_email", "sender"])
-		smtp_recipient = smtp_recipient or self._settings.get(["send_email", "recipient"])
+	def _loadFileWithPlaceholders(self, filename, placeholders=None):
+		return self._mail_templates.render(filename, placeholders)
+
+	def _sendEmailNotification(self, subject, body, digest=False):
+		# sent in the background by the outbox, never holding up a backup
+		self._mail_outbox.enqueue(subject, body, digest=digest)
 
+	def _notify_mail_failed(self, subject, error):
+		data = {"notifyTitle": gettext("SMTP Error"), "notifyMessage": str(error), "notifyType": "error",
+				"notifyHide": False}
+		self._sendNotificationToClient(data, True)
+
+	def _sendTestEmail(self, subject, body, smtp_server=None, smtp_port=None, smtp_tls=None, smtp_user=None,
+					   smtp_password=None, smtp_sender=None, smtp_recipient=None):
+		# fill in values from settings if not supplied
+		config = {"smtp_server": smtp_server or self._settings.get(["send_email", "smtp_server"]),
+				  "smtp_port": smtp_port or self._settings.get_int(["send_email", "smtp_port"]),
+				  "smtp_tls": smtp_tls or self._settings.get_boolean(["send_email", "smtp_tls"]),
+				  "smtp_user": smtp_user or self._settings.get(["send_email", "smtp_user"]),
+				  "smtp_password": smtp_password or self._settings.get(["send_email", "smtp_password"]),
+				  "sender": smtp_sender or self._settings.get(["send_email", "sender"]),
+				  "recipient": smtp_recipient or self._settings.get(["send_email", "recipient"])}
 		try:
-			if smtp_password == "":
-				raise ValueError("SMTP password is empty.")
-
-			msg = MIMEText(body, "html")
-			msg['Subject'] = subject
-			msg['From'] = smtp_sender
-			msg['To'] = smtp_recipient
-		# Send the message via an SMTP server
-			if smtp_tls in valid_boolean_trues:
-				server = smtplib.SMTP_SSL()
-			else:
-				server = smtplib.SMTP()
-			# set host manually to deal with python bug value error, see https://bugs.python.org/issue36094
-			server._host = smtp_server
-			server.connect(smtp_server, int(smtp_port))
-			server.ehlo()
-			if smtp_user != "":
-				server.login(smtp_user, smtp_password)
+			server = open_connection(config)
 			try:
-				server.sendmail(msg['From'], msg['To'], msg.as_string())
+				send_message(server, config, subject, body)
 			finally:
 				server.quit()
 			return True
 		except Exception as e:
-			error_message = str(e)
-			self._logger.error(error_message)
-			data = {"notifyTitle": gettext("SMTP Error"), "notifyMessage": error_message, "notifyType": "error",
-					"notifyHide": False}
-			self._sendNotificationToClient(data, True)
+			self._logger.error(str(e))
+			self._notify_mail_failed(subject, e)
 			return False
 
 	# ~~ ApiPlugin mixin
@@ -322,7 +1253,23 @@ class BackupschedulerPlugin(octoprint.plugin.SettingsPlugin,
 
 	def get_api_commands(self):
 		return {'sendTestEmail': ["smtp_server", "smtp_port", "smtp_tls", "smtp_user", "smtp_password", "smtp_sender",
-								  "smtp_recipient"], 'clearRetainedMessage': []}
+								  "smtp_recipient"], 'clearRetainedMessage': [], 'exportBackup': ["name"]}
+
+	def on_api_get(self, request):
+		import flask
+		if not Permissions.ADMIN.can():
+			return flask.make_response("Insufficient rights", 403)
+
+		if "metrics" in request.values:
+			if request.values.get("metrics") == "prometheus":
+				return flask.Response(self._metrics.to_prometheus(), mimetype="text/plain; version=0.0.4")
+			return flask.jsonify(self._metrics.to_dict())
+		incremental_backups = sorted(name for store in self._get_backup_stores() for name in store.list_manifests())
+		return flask.jsonify({"next_runs": self._get_next_runs(), "incremental_backups": incremental_backups,
+							  "summary": self._catalog.summary(),
+							  "change_checks": self._state.get("change_checks", {}),
+							  "utilisation": self._utilisation.to_dict(),
+							  "backups": self._catalog.entries(request.values.get("type"))})
 
 	def on_api_command(self, command, data):
 		import flask
@@ -331,10 +1278,15 @@ class BackupschedulerPlugin(octoprint.plugin.SettingsPlugin,
 
 		if command == "sendTestEmail":
 			self._logger.debug("Sending an Email to test settings.")
-			results = self._sendEmailNotification("OctoPrint Backup: Test Message", "OctoPrint Backup: Test Message",
-										data["smtp_server"], data["smtp_port"], data["smtp_tls"], data["smtp_user"],
-										data["smtp_password"], data["smtp_sender"], data["smtp_recipient"])
+			results = self._sendTestEmail("OctoPrint Backup: Test Message", "OctoPrint Backup: Test Message",
+										  data["smtp_server"], data["smtp_port"], data["smtp_tls"], data["smtp_user"],
+										  data["smtp_password"], data["smtp_sender"], data["smtp_recipient"])
 			return flask.jsonify({"success": results})
+		if command == "exportBackup":
+			if self._find_backup_store(data["name"]) is None:
+				return flask.make_response("Unknown backup", 404)
+			self._backup_executor.submit(self._export_backup, data["name"])
+			return flask.jsonify({"success": True})
 		if command == "clearRetainedMessage":
 			self._logger.debug("Clearing retained message")
 			default_settings = self.get_settings_defaults()
@@ -415,4 +1367,5 @@ def __plugin_load__():
 	__plugin_hooks__ = {
 		"octoprint.plugin.softwareupdate.check_config": __plugin_implementation__.get_update_information,
 		"octoprint.plugin.backup.after_backup": __plugin_implementation__.after_backup,
+		"octoprint.plugin.backup.additional_excludes": __plugin_implementation__.additional_excludes,
 	}
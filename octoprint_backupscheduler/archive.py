@@ -0,0 +1,352 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import collections
+import json
+import os
+import zipfile
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .throttle import ThrottledFile
+
+# always left out of OctoPrint backups, like the backup plugin does
+DEFAULT_EXCLUDES = ["generated", "logs", "watched"]
+
+# base folders that may be configured outside of the base folder, by their default location in it,
+# which is where they go in a backup archive
+BASE_FOLDERS = collections.OrderedDict([
+	("uploads", "uploads"), ("timelapse", "timelapse"), ("timelapse_tmp", "timelapse/tmp"), ("logs", "logs"),
+	("virtualSd", "virtualSd"), ("watched", "watched"), ("plugins", "plugins"), ("slicingProfiles", "slicingProfiles"),
+	("printerProfiles", "printerProfiles"), ("scripts", "scripts"), ("translations", "translations"),
+	("generated", "generated"), ("data", "data"),
+])
+
+# deflate level per compression strategy, None stores entries uncompressed
+COMPRESSION_STRATEGIES = {"store": None, "fast": 1, "deflate": 6, "best": 9}
+
+# entries are read and compressed in chunks of this size by the parallel archive builder
+PARALLEL_CHUNK_SIZE = 1024 * 1024
+
+# file types that are compressed already and are stored as is, deflating them only costs CPU time
+ALREADY_COMPRESSED = frozenset([
+	".mp4", ".mkv", ".webm", ".avi", ".mov", ".mpg", ".mpeg",
+	".jpg", ".jpeg", ".png", ".gif", ".webp",
+	".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".zst", ".bgcode", ".3mf",
+])
+
+
+def get_excluded_paths(settings, exclusions, additional=None):
+	"""
+	Maps backup exclusions ("uploads", "timelapse") to the absolute folders the backup plugin
+	would leave out of an archive, plus any `additional` paths.
+	"""
+	folders = DEFAULT_EXCLUDES + list(exclusions)
+	if "timelapse" in folders:
+		folders.append("timelapse_tmp")
+	paths = [os.path.join(settings.getBaseFolder("data"), "backup")]
+	paths += [settings.getBaseFolder(folder) for folder in folders]
+	paths += additional or []
+	return [os.path.realpath(path) for path in paths]
+
+
+def get_hook_excluded_paths(hooks, data_folder, exclusions, logger=None):
+	"""
+	Asks the ``octoprint.plugin.backup.additional_excludes`` `hooks`, by plugin identifier,
+	what else to leave out of a backup with `exclusions`, the way the backup plugin does: paths
+	relative to the plugin's folder below `data_folder`, or "." for all of it.
+	"""
+	paths = []
+	for name, hook in hooks.items():
+		try:
+			additional = hook(list(exclusions))
+		except Exception:
+			if logger is not None:
+				logger.exception(f"Error while retrieving additional excludes from plugin {name}.")
+			continue
+		if not isinstance(additional, (list, tuple)):
+			continue
+		if "." in additional:
+			paths.append(os.path.join(data_folder, name))
+		else:
+			paths += [os.path.join(data_folder, name, path) for path in additional]
+	return paths
+
+
+def get_external_folders(settings):
+	"""
+	The base folders `settings` puts outside of the base folder, by the name they go in a backup
+	archive under, like the backup plugin adds them.
+	"""
+	basedir = os.path.realpath(settings.settings._basedir)
+	folders = collections.OrderedDict()
+	for folder, name in BASE_FOLDERS.items():
+		path = os.path.realpath(settings.getBaseFolder(folder))
+		if path == basedir or path.startswith(basedir + os.sep):
+			continue
+		# e.g. a timelapse_tmp folder in a timelapse folder that was moved
+		if any(path == other or path.startswith(other + os.sep) for other in folders.values()):
+			continue
+		folders[name] = path
+	return folders
+
+
+def iter_backup_files(basedir, configfile, excluded_paths, folders=None):
+	"""
+	Yields ``(name, path)`` for every file that goes into a backup of `basedir`, with `name`
+	relative to the ``basedir`` folder of an OctoPrint backup archive. `folders` maps names in
+	the archive to folders outside of `basedir` that go into the backup as well, see
+	:func:`get_external_folders`.
+	"""
+	basedir = os.path.realpath(basedir)
+	excluded = set(excluded_paths)
+	configfile = os.path.realpath(configfile)
+	if os.path.dirname(configfile) != basedir and os.path.isfile(configfile):
+		yield "config.yaml", configfile
+	for prefix, folder in [("", basedir)] + list((folders or {}).items()):
+		if folder in excluded:
+			continue
+		for root, dirs, files in os.walk(folder):
+			dirs[:] = sorted(d for d in dirs if os.path.join(root, d) not in excluded)
+			for filename in sorted(files):
+				path = os.path.join(root, filename)
+				if path in excluded or not os.path.isfile(path):
+					continue
+				name = os.path.relpath(path, folder).replace(os.sep, "/")
+				yield (prefix + "/" + name if prefix else name), path
+
+
+def write_backup_metadata(zip_file, metadata, plugin_list):
+	"""
+	Writes the ``metadata.json`` and ``plugin_list.json`` entries the backup plugin expects when
+	restoring an archive.
+	"""
+	zip_file.writestr("metadata.json", json.dumps(metadata))
+	zip_file.writestr("plugin_list.json", json.dumps(plugin_list))
+
+
+def get_archive_manifest(zip_file):
+	"""
+	Size and CRC of every entry of `zip_file` as ``{name: [size, crc]}``, taken while the
+	archive is written, to verify it against once it has been stored.
+	"""
+	return {info.filename: [info.file_size, info.CRC] for info in zip_file.infolist()}
+
+
+def get_source_manifest(files):
+	"""
+	Path, size and modification time of every file of `files` (as yielded by
+	:func:`iter_backup_files`) as ``{name: [path, size, mtime]}``, by the name it has in an
+	archive, for archives written by someone else.
+	"""
+	manifest = {}
+	for name, path in files:
+		try:
+			st = os.stat(path)
+		except OSError:
+			continue
+		manifest["basedir/" + name] = [path, st.st_size, st.st_mtime_ns]
+	return manifest
+
+
+def get_unchanged_manifest(source_manifest):
+	"""
+	The entries of `source_manifest` whose file didn't change since, as ``{name: [size, None]}``
+	to verify an archive against, see :func:`verify.verify_archive`. Files that changed or
+	were removed may legitimately differ in the archive.
+	"""
+	manifest = {}
+	for name, (path, size, mtime) in source_manifest.items():
+		try:
+			st = os.stat(path)
+		except OSError:
+			continue
+		if (st.st_size, st.st_mtime_ns) == (size, mtime):
+			manifest[name] = [size, None]
+	return manifest
+
+
+def open_for_writing(path, throttle=None):
+	"""
+	Opens `path` for binary writing, throttled by `throttle` if given.
+	"""
+	f = open(path, "wb")
+	if throttle is not None:
+		return ThrottledFile(f, throttle)
+	return f
+
+
+def get_entry_compression(name, strategy):
+	"""
+	The ``(compress_type, compresslevel)`` to use for archive entry `name` with compression
+	`strategy`. Zip archives only support stored and deflated entries when they are to be
+	restored by the backup plugin, so faster codecs are limited to a lower deflate level.
+	"""
+	level = COMPRESSION_STRATEGIES.get(strategy, COMPRESSION_STRATEGIES["deflate"])
+	if level is None or os.path.splitext(name)[1].lower() in ALREADY_COMPRESSED:
+		return zipfile.ZIP_STORED, None
+	return zipfile.ZIP_DEFLATED, level
+
+
+def build_backup_archive(target_path, files, metadata, plugin_list, strategy="deflate", throttle=None):
+	"""
+	Writes an OctoPrint backup archive of `files` (as yielded by :func:`iter_backup_files`) to
+	`target_path`, compressing every entry according to `strategy`. Writes go through
+	`throttle` if given.
+
+	:return: statistics of the run - files, bytes and bytes stored uncompressed - and the
+	         manifest of the archive, see :func:`get_archive_manifest`
+	"""
+	stats = {"files": 0, "bytes": 0, "stored_bytes": 0}
+	temp_path = target_path + ".tmp"
+	try:
+		with open_for_writing(temp_path, throttle) as f, \
+				zipfile.ZipFile(f, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zip_file:
+			for name, path in files:
+				compress_type, level = get_entry_compression(name, strategy)
+				try:
+					size = os.path.getsize(path)
+					zip_file.write(path, "basedir/" + name, compress_type=compress_type, compresslevel=level)
+				except (IOError, OSError):
+					# removed while the backup was running
+					continue
+				stats["files"] += 1
+				stats["bytes"] += size
+				if compress_type == zipfile.ZIP_STORED:
+					stats["stored_bytes"] += size
+			write_backup_metadata(zip_file, metadata, plugin_list)
+			stats["manifest"] = get_archive_manifest(zip_file)
+		os.replace(temp_path, target_path)
+	finally:
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+	return stats
+
+
+def build_backup_archive_parallel(target_path, files, metadata, plugin_list, strategy="deflate", throttle=None,
+								  workers=None, chunk_size=PARALLEL_CHUNK_SIZE):
+	"""
+	Like :func:`build_backup_archive`, but compresses on a pool of `workers` threads (one per
+	CPU core by default). Every entry is split into chunks of `chunk_size` bytes that are
+	deflated independently and concatenated, like pigz does, so large files are spread over
+	all workers as well. The archive is still written sequentially by the calling thread and
+	at most four chunks per worker are in flight, which bounds memory use.
+
+	:return: statistics of the run - files, bytes and bytes stored uncompressed - and the
+	         manifest of the archive, see :func:`get_archive_manifest`
+	"""
+	workers = workers or os.cpu_count() or 1
+	stats = {"files": 0, "bytes": 0, "stored_bytes": 0}
+	temp_path = target_path + ".tmp"
+	try:
+		with open_for_writing(temp_path, throttle) as f, \
+				zipfile.ZipFile(f, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zip_file, \
+				ThreadPoolExecutor(max_workers=workers, thread_name_prefix="BackupSchedulerArchiver") as pool:
+			writer = _ParallelEntryWriter(zip_file)
+			in_flight = collections.deque()
+			chunks = _iter_chunks(files, strategy, chunk_size, pool)
+			for chunk in chunks:
+				in_flight.append(chunk)
+				while len(in_flight) >= workers * 4:
+					writer.write(*in_flight.popleft())
+			while in_flight:
+				writer.write(*in_flight.popleft())
+			for zinfo in writer.written:
+				stats["files"] += 1
+				stats["bytes"] += zinfo.file_size
+				if zinfo.compress_type == zipfile.ZIP_STORED:
+					stats["stored_bytes"] += zinfo.file_size
+			write_backup_metadata(zip_file, metadata, plugin_list)
+			stats["manifest"] = get_archive_manifest(zip_file)
+		os.replace(temp_path, target_path)
+	finally:
+		if os.path.exists(temp_path):
+			os.remove(temp_path)
+	return stats
+
+
+def _iter_chunks(files, strategy, chunk_size, pool):
+	# yields (zinfo, data, future of the compressed data, last) in archive order
+	for name, path in files:
+		compress_type, level = get_entry_compression(name, strategy)
+		try:
+			zinfo = zipfile.ZipInfo.from_file(path, "basedir/" + name)
+			f = open(path, "rb")
+		except (IOError, OSError):
+			# removed while the backup was running
+			continue
+		zinfo.compress_type = compress_type
+		with f:
+			data = f.read(chunk_size)
+			while True:
+				following = f.read(chunk_size) if data else b""
+				last = not following
+				if compress_type == zipfile.ZIP_STORED:
+					compressed = Future()
+					compressed.set_result(data)
+				else:
+					compressed = pool.submit(_deflate, data, level, last)
+				yield zinfo, data, compressed, last
+				if last:
+					break
+				data = following
+
+
+def _deflate(data, level, last):
+	compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+	# a sync flush ends the chunk on a byte boundary, so the next one can simply be appended
+	return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+class _ParallelEntryWriter(object):
+	"""
+	Writes entries chunk by chunk into an open :class:`zipfile.ZipFile`, rewriting the local
+	header with the final sizes and CRC once an entry is complete.
+	"""
+
+	def __init__(self, zip_file):
+		self._zip_file = zip_file
+		self._fp = zip_file.fp
+		self._current = None
+		self._zip64 = False
+		self._crc = 0
+		self._size = 0
+		self._compress_size = 0
+		self.written = []
+
+	def write(self, zinfo, data, compressed, last):
+		if self._current is not zinfo:
+			self._start(zinfo)
+		compressed = compressed.result()
+		self._crc = zlib.crc32(data, self._crc)
+		self._size += len(data)
+		self._compress_size += len(compressed)
+		self._fp.write(compressed)
+		if last:
+			self._finish()
+
+	def _start(self, zinfo):
+		self._current = zinfo
+		self._crc = self._size = self._compress_size = 0
+		# same rule as zipfile, files that might grow past the limit while being read get zip64 headers
+		self._zip64 = zinfo.file_size * 1.05 > zipfile.ZIP64_LIMIT
+		self._fp.seek(self._zip_file.start_dir)
+		zinfo.header_offset = self._fp.tell()
+		zinfo.CRC = zinfo.compress_size = 0
+		self._fp.write(zinfo.FileHeader(self._zip64))
+
+	def _finish(self):
+		zinfo = self._current
+		zinfo.CRC = self._crc
+		zinfo.file_size = self._size
+		zinfo.compress_size = self._compress_size
+		end = self._fp.tell()
+		self._fp.seek(zinfo.header_offset)
+		self._fp.write(zinfo.FileHeader(self._zip64))
+		self._fp.seek(end)
+		self._zip_file.start_dir = end
+		self._zip_file.filelist.append(zinfo)
+		self._zip_file.NameToInfo[zinfo.filename] = zinfo
+		self._zip_file._didModify = True
+		self.written.append(zinfo)
+		self._current = None
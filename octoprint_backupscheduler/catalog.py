@@ -0,0 +1,117 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import threading
+
+
+class BackupCatalog(object):
+	"""
+	Metadata of every backup - schedule types, size, hash, duration, exclusions, file count and
+	so on - kept in memory and persisted as an append-only journal of JSON lines. Every change
+	appends a single line, the journal is rewritten from memory once it holds more than twice as
+	many records as there are entries.
+	"""
+
+	def __init__(self, path):
+		self._path = path
+		self._lock = threading.RLock()
+		self._entries = {}
+		self._records = 0
+		self._load()
+
+	def _load(self):
+		try:
+			with open(self._path, "r", encoding="utf-8") as f:
+				for line in f:
+					try:
+						record = json.loads(line)
+					except ValueError:
+						# torn last line after a crash
+						continue
+					self._replay(record)
+					self._records += 1
+		except (IOError, OSError):
+			pass
+
+	def _replay(self, record):
+		if record.get("op") == "put":
+			self._entries[record["entry"]["name"]] = record["entry"]
+		elif record.get("op") == "update" and record["name"] in self._entries:
+			self._entries[record["name"]].update(record["fields"])
+		elif record.get("op") == "delete":
+			self._entries.pop(record["name"], None)
+
+	def _append(self, record):
+		with self._lock:
+			self._replay(record)
+			with open(self._path, "a", encoding="utf-8") as f:
+				f.write(json.dumps(record) + "\n")
+			self._records += 1
+			if self._records > 2 * len(self._entries) + 64:
+				self.compact()
+
+	def compact(self):
+		with self._lock:
+			with open(self._path + ".tmp", "w", encoding="utf-8") as f:
+				for entry in self._entries.values():
+					f.write(json.dumps({"op": "put", "entry": entry}) + "\n")
+			os.replace(self._path + ".tmp", self._path)
+			self._records = len(self._entries)
+
+	def __contains__(self, name):
+		return name in self._entries
+
+	def __len__(self):
+		return len(self._entries)
+
+	def get(self, name):
+		with self._lock:
+			entry = self._entries.get(name)
+			return dict(entry) if entry is not None else None
+
+	def put(self, entry):
+		self._append({"op": "put", "entry": dict(entry)})
+
+	def update(self, name, **fields):
+		if name in self._entries:
+			self._append({"op": "update", "name": name, "fields": fields})
+
+	def delete(self, name):
+		if name in self._entries:
+			self._append({"op": "delete", "name": name})
+
+	def entries(self, backup_type=None):
+		"""
+		All entries, or those of `backup_type`, oldest first.
+		"""
+		with self._lock:
+			entries = [dict(entry) for entry in self._entries.values()
+					   if backup_type is None or backup_type in entry.get("backup_types", [])]
+		return sorted(entries, key=lambda entry: entry.get("created", 0))
+
+	def summary(self):
+		"""
+		Number and total size of the backups per schedule type.
+		"""
+		summary = {}
+		with self._lock:
+			for entry in self._entries.values():
+				for backup_type in entry.get("backup_types", []):
+					totals = summary.setdefault(backup_type, {"count": 0, "size": 0})
+					totals["count"] += 1
+					totals["size"] += entry.get("size") or 0
+		return summary
+
+
+def file_digest(path, buffer_size=1024 * 1024):
+	"""
+	SHA-256 of the file at `path`, read with a fixed size buffer.
+	"""
+	digest = hashlib.sha256()
+	with open(path, "rb") as f:
+		for data in iter(lambda: f.read(buffer_size), b""):
+			digest.update(data)
+	return digest.hexdigest()
@@ -0,0 +1,112 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import hashlib
+import logging
+import os
+import threading
+import uuid
+
+from .statindex import is_below
+
+
+def tree_digest(files):
+	"""
+	Digest of the name, size and mtime of `files`, an iterable of ``(name, path)`` tuples as
+	yielded by :func:`archive.iter_backup_files`. Only stats the files, nothing is read.
+	"""
+	digest = hashlib.sha1()
+	for name, path in files:
+		try:
+			st = os.stat(path)
+		except OSError:
+			continue
+		digest.update("{}\0{}\0{}\n".format(name, st.st_size, st.st_mtime_ns).encode("utf-8", "surrogateescape"))
+	return digest.hexdigest()
+
+
+class ChangeTracker(object):
+	"""
+	Watches `root` with inotify (through watchdog, which OctoPrint depends on anyway) and keeps
+	the set of paths that changed, leaving out everything below `skip`. Every change gets a
+	sequence number, so any number of schedules can ask whether something they cover changed
+	since their last backup without walking the tree.
+
+	Changes are only known while the tracker runs. Marks are tied to the `session` they were
+	taken in, if the watcher can't be started at all the tracker isn't `watching` and callers
+	fall back to comparing :func:`tree_digest`.
+	"""
+
+	def __init__(self, root, skip=(), logger=None):
+		self._root = os.path.realpath(root)
+		self._skip = tuple(os.path.realpath(path) for path in skip)
+		self._logger = logger or logging.getLogger(__name__)
+		self._lock = threading.Lock()
+		self._observer = None
+		self._sequence = 0
+		self._dirty = {}
+		self.session = None
+
+	@property
+	def watching(self):
+		return self._observer is not None
+
+	def start(self):
+		try:
+			from watchdog.events import FileSystemEventHandler
+			from watchdog.observers import Observer
+
+			tracker = self
+
+			class Handler(FileSystemEventHandler):
+				def on_any_event(self, event):
+					if event.is_directory and event.event_type == "modified":
+						# comes with an event for the entry that changed in the folder
+						return
+					tracker._changed(event.src_path)
+					if getattr(event, "dest_path", None):
+						tracker._changed(event.dest_path)
+
+			observer = Observer()
+			observer.schedule(Handler(), self._root, recursive=True)
+			observer.start()
+		except Exception as e:
+			# no watchdog or out of inotify watches, see fs.inotify.max_user_watches
+			self._logger.warning(f"Could not watch {self._root} for changes, falling back to polling: {e}")
+			return False
+		self._observer = observer
+		self.session = uuid.uuid4().hex
+		self._logger.debug(f"Watching {self._root} for changes.")
+		return True
+
+	def stop(self):
+		if self._observer is not None:
+			self._observer.stop()
+			self._observer = None
+		self.session = None
+		with self._lock:
+			self._dirty.clear()
+
+	def _changed(self, path):
+		path = os.path.join(self._root, path) if not os.path.isabs(path) else path
+		if any(is_below(path, skip) for skip in self._skip):
+			return
+		with self._lock:
+			self._sequence += 1
+			self._dirty[path] = self._sequence
+
+	def mark(self):
+		"""
+		The current position in the change log, pass it to :meth:`changed_since` later.
+		"""
+		with self._lock:
+			return self._sequence
+
+	def changed_since(self, mark, excluded_paths=()):
+		"""
+		Whether anything changed since `mark`, leaving out the paths below `excluded_paths`.
+		"""
+		with self._lock:
+			dirty = [path for path, sequence in self._dirty.items() if sequence > mark]
+		return any(not any(is_below(path, excluded) for excluded in excluded_paths) for path in dirty)
+
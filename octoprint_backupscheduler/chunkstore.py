@@ -0,0 +1,237 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import zipfile
+from contextlib import nullcontext
+
+from .archive import get_entry_compression, open_for_writing, write_backup_metadata
+
+CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class ChunkStore(object):
+	"""
+	A content addressed store for incremental backups.
+
+	Files are split into fixed size chunks stored once under their SHA-256 digest. Every backup
+	is a manifest listing the chunks of each file, so a backup only writes chunks that are not
+	in the store yet, and files whose size and mtime did not change since the previous manifest
+	are not even read. Any manifest can be exported as a regular OctoPrint backup archive.
+
+	Several OctoPrint instances can share the chunks of a store, each with its manifests in
+	its own `namespace`. Garbage collection then keeps the chunks of every namespace, and
+	`host_lock` (a :class:`coordination.FileLock`) keeps it from running while another
+	process records a manifest.
+	"""
+
+	def __init__(self, folder, chunk_size=CHUNK_SIZE, namespace=None, host_lock=None):
+		self._chunk_folder = os.path.join(folder, "chunks")
+		self._manifest_root = os.path.join(folder, "manifests")
+		self._manifest_folder = os.path.join(self._manifest_root, namespace) if namespace else self._manifest_root
+		self._namespaced = namespace is not None
+		self._chunk_size = chunk_size
+		self._lock = threading.RLock()
+		self._host_lock = host_lock
+		for path in (self._chunk_folder, self._manifest_folder):
+			if not os.path.isdir(path):
+				os.makedirs(path)
+
+	# ~~ chunks
+
+	def _chunk_path(self, digest):
+		return os.path.join(self._chunk_folder, digest[:2], digest)
+
+	def _has_chunk(self, digest):
+		return os.path.exists(self._chunk_path(digest))
+
+	def _store_chunk(self, data, throttle=None):
+		digest = hashlib.sha256(data).hexdigest()
+		path = self._chunk_path(digest)
+		if os.path.exists(path):
+			return digest, False
+		folder = os.path.dirname(path)
+		if not os.path.isdir(folder):
+			os.makedirs(folder)
+		temp_path = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+		with open_for_writing(temp_path, throttle) as f:
+			f.write(data)
+		os.replace(temp_path, path)
+		return digest, True
+
+	# ~~ manifests
+
+	def manifest_path(self, name):
+		return os.path.join(self._manifest_folder, name + ".json")
+
+	def has_manifest(self, name):
+		return os.path.exists(self.manifest_path(name))
+
+	def list_manifests(self):
+		return sorted(filename[:-5] for filename in os.listdir(self._manifest_folder) if filename.endswith(".json"))
+
+	def _iter_manifest_paths(self):
+		# of every namespace sharing the chunks
+		folders = [self._manifest_folder]
+		if self._namespaced:
+			folders = [os.path.join(self._manifest_root, namespace) for namespace in os.listdir(self._manifest_root)]
+		for folder in folders:
+			for filename in os.listdir(folder) if os.path.isdir(folder) else []:
+				if filename.endswith(".json"):
+					yield os.path.join(folder, filename)
+
+	def _host_locked(self, exclusive):
+		return self._host_lock.held(exclusive) if self._host_lock is not None else nullcontext()
+
+	def load_manifest(self, name):
+		with open(self.manifest_path(name), "r", encoding="utf-8") as f:
+			return json.load(f)
+
+	def _save_manifest(self, manifest):
+		path = self.manifest_path(manifest["name"])
+		with open(path + ".tmp", "w", encoding="utf-8") as f:
+			json.dump(manifest, f)
+		os.replace(path + ".tmp", path)
+
+	def latest_manifest(self):
+		names = self.list_manifests()
+		if not names:
+			return None
+		return self.load_manifest(max(names, key=lambda name: os.path.getmtime(self.manifest_path(name))))
+
+	def copy_manifest(self, name, target):
+		shutil.copyfile(self.manifest_path(name), self.manifest_path(target))
+		manifest = self.load_manifest(target)
+		manifest["name"] = target
+		self._save_manifest(manifest)
+
+	def delete_manifest(self, name):
+		with self._lock:
+			if self.has_manifest(name):
+				os.remove(self.manifest_path(name))
+			return self.collect_garbage()
+
+	# ~~ backups
+
+	def snapshot(self, name, files, metadata=None, previous=None, throttle=None):
+		"""
+		Records a new manifest `name` from `files`, an iterable of ``(name, path)`` tuples.
+		Chunk writes go through `throttle` if given.
+
+		:return: statistics of the run - files, bytes, new chunks/bytes and reused files
+		"""
+		previous_files = previous["files"] if previous else {}
+		stats = {"files": 0, "bytes": 0, "new_chunks": 0, "new_bytes": 0, "reused_files": 0}
+		entries = {}
+		with self._lock, self._host_locked(False):
+			for arcname, path in files:
+				try:
+					st = os.stat(path)
+				except OSError:
+					continue
+				entry = {"size": st.st_size, "mtime": st.st_mtime, "mode": st.st_mode & 0o7777}
+				known = previous_files.get(arcname)
+				if known and known["size"] == st.st_size and known["mtime"] == st.st_mtime \
+						and all(self._has_chunk(digest) for digest in known["chunks"]):
+					entry["chunks"] = known["chunks"]
+					stats["reused_files"] += 1
+				else:
+					entry["chunks"] = []
+					with open(path, "rb") as f:
+						for data in iter(lambda: f.read(self._chunk_size), b""):
+							digest, new = self._store_chunk(data, throttle)
+							entry["chunks"].append(digest)
+							if new:
+								stats["new_chunks"] += 1
+								stats["new_bytes"] += len(data)
+				entries[arcname] = entry
+				stats["files"] += 1
+				stats["bytes"] += st.st_size
+			manifest = {"name": name, "created": time.time(), "metadata": metadata or {}, "files": entries}
+			self._save_manifest(manifest)
+		return stats
+
+	def verify(self, name, throttle=None):
+		"""
+		Reads back every chunk manifest `name` references and checks it against its hash and
+		the recorded file sizes. Reads go through `throttle` if given.
+
+		:return: ``{"entries", "bytes", "errors"}``, with a message for every problem found
+		"""
+		result = {"entries": 0, "bytes": 0, "errors": []}
+		verified = {}
+		for arcname, entry in sorted(self.load_manifest(name)["files"].items()):
+			size = 0
+			for digest in entry["chunks"]:
+				if digest not in verified:
+					verified[digest] = self._verify_chunk(digest, throttle)
+				if verified[digest] is None:
+					result["errors"].append(f"{arcname}: chunk {digest} is missing or corrupt")
+					break
+				size += verified[digest]
+			else:
+				if size != entry["size"]:
+					result["errors"].append(f"{arcname}: {size} bytes instead of {entry['size']}")
+			result["entries"] += 1
+			result["bytes"] += size
+		return result
+
+	def _verify_chunk(self, digest, throttle=None):
+		# size of the chunk if its content matches its hash, else None
+		try:
+			with open(self._chunk_path(digest), "rb") as f:
+				data = f.read()
+		except (IOError, OSError):
+			return None
+		if throttle is not None:
+			throttle.consume(len(data))
+		return len(data) if hashlib.sha256(data).hexdigest() == digest else None
+
+	def export(self, name, target_path, strategy="deflate"):
+		"""
+		Writes manifest `name` as an OctoPrint backup archive to `target_path`, compressed
+		according to `strategy` (see :func:`archive.get_entry_compression`).
+		"""
+		manifest = self.load_manifest(name)
+		metadata = manifest["metadata"]
+		temp_path = target_path + ".tmp"
+		with zipfile.ZipFile(temp_path, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zip_file:
+			for arcname, entry in sorted(manifest["files"].items()):
+				info = zipfile.ZipInfo("basedir/" + arcname, date_time=time.localtime(max(entry["mtime"], 315532800))[:6])
+				info.external_attr = (0o100000 | entry["mode"]) << 16
+				info.compress_type, level = get_entry_compression(arcname, strategy)
+				# ZipFile.open() has no compresslevel argument, it takes the level from the entry
+				info._compresslevel = level
+				with zip_file.open(info, mode="w", force_zip64=entry["size"] > 0x7fffffff) as target:
+					for digest in entry["chunks"]:
+						with open(self._chunk_path(digest), "rb") as f:
+							shutil.copyfileobj(f, target)
+			write_backup_metadata(zip_file, metadata.get("backup", {}), metadata.get("plugin_list", []))
+		os.replace(temp_path, target_path)
+
+	def collect_garbage(self):
+		"""
+		Removes all chunks no manifest references anymore.
+
+		:return: the number of bytes freed
+		"""
+		with self._lock, self._host_locked(True):
+			referenced = set()
+			for path in self._iter_manifest_paths():
+				with open(path, "r", encoding="utf-8") as f:
+					for entry in json.load(f)["files"].values():
+						referenced.update(entry["chunks"])
+			freed = 0
+			for folder in os.listdir(self._chunk_folder):
+				folder = os.path.join(self._chunk_folder, folder)
+				for digest in os.listdir(folder):
+					if digest not in referenced:
+						path = os.path.join(folder, digest)
+						freed += os.path.getsize(path)
+						os.remove(path)
+			return freed
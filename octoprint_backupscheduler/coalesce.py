@@ -0,0 +1,38 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+
+# how long to wait for further backups to join a batch, in seconds
+COALESCE_WINDOW = 2.0
+
+
+class BackupCoalescer(object):
+	"""
+	Collects backup requests arriving within a short window and hands them on as one batch,
+	so backups that are due together can share a single archive.
+	"""
+
+	def __init__(self, callback, window=COALESCE_WINDOW):
+		self._callback = callback
+		self._window = window
+		self._lock = threading.Lock()
+		self._pending = []
+		self._timer = None
+
+	def add(self, backup_type):
+		with self._lock:
+			self._pending.append(backup_type)
+			if self._timer is None:
+				self._timer = threading.Timer(self._window, self.flush)
+				self._timer.daemon = True
+				self._timer.start()
+
+	def flush(self):
+		with self._lock:
+			batch, self._pending = self._pending, []
+			if self._timer is not None:
+				self._timer.cancel()
+				self._timer = None
+		if batch:
+			self._callback(batch)
@@ -0,0 +1,49 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class BackupFailedError(Exception):
+	pass
+
+
+class BackupCompletionTracker(object):
+	"""
+	Keeps a future per backup started through the backup plugin's ``create_backup`` helper.
+
+	The futures are resolved by the ``plugin_backup_backup_created`` event and failed by the
+	``backup_error`` message of the backup plugin, both of which carry the filename. The
+	``after_backup`` hook can't fail one, it doesn't tell which backup (maybe one started from the
+	UI) went wrong.
+	"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._pending = OrderedDict()
+
+	def expect(self, filename):
+		future = Future()
+		with self._lock:
+			self._pending[filename] = future
+		return future
+
+	def discard(self, filename):
+		with self._lock:
+			self._pending.pop(filename, None)
+
+	def created(self, filename):
+		with self._lock:
+			future = self._pending.pop(filename, None)
+		if future is not None:
+			future.set_result(filename)
+		return future is not None
+
+	def failed(self, filename, message="Backup failed"):
+		with self._lock:
+			future = self._pending.pop(filename, None)
+		if future is not None:
+			future.set_exception(BackupFailedError("{}: {}".format(message, filename)))
+		return future is not None
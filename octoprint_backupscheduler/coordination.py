@@ -0,0 +1,214 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from .chunkstore import ChunkStore
+
+try:
+	import fcntl
+except ImportError:
+	# Windows, instances are not coordinated there
+	fcntl = None
+
+SUPPORTED = fcntl is not None
+
+# how often a waiting backup checks again whether it may start, in seconds
+POLL_INTERVAL = 5
+
+# waiting instances that didn't check in for this many poll intervals are gone
+WAITER_EXPIRY = 3
+
+
+def get_member_id(name, basedir):
+	"""
+	Identifies an OctoPrint instance on the host by its name and base folder, which no two
+	instances share.
+	"""
+	name = re.sub(r"[^\w.-]", "-", name or "") or "octoprint"
+	return "{}-{}".format(name, hashlib.sha1(os.path.realpath(basedir).encode("utf-8")).hexdigest()[:8])
+
+
+def get_exclusion_key(exclusions):
+	return "+".join(sorted(exclusions)) or "everything"
+
+
+class FileLock(object):
+	"""
+	An advisory ``flock`` on the file `path`. The lock belongs to the open file, so the OS
+	releases it when the process dies, and every acquisition opens the file again, so locks
+	on the same path also exclude each other within one process.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+
+	def acquire(self, exclusive=True, blocking=True):
+		"""
+		:return: the open file holding the lock, close it to release the lock. None if not
+			`blocking` and the lock is held elsewhere.
+		"""
+		f = open(self.path, "a+")
+		try:
+			fcntl.flock(f.fileno(), (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB))
+		except BlockingIOError:
+			f.close()
+			return None
+		except Exception:
+			f.close()
+			raise
+		return f
+
+	@contextmanager
+	def held(self, exclusive=True):
+		f = self.acquire(exclusive)
+		try:
+			yield
+		finally:
+			f.close()
+
+
+class HostCoordinator(object):
+	"""
+	Coordinates the backups of the OctoPrint instances on a host that share `folder`, so
+	instances scheduled for the same time take turns instead of all hitting the disk at once.
+
+	At most `max_concurrent` backups run at a time, each holding one of the slot locks below
+	`folder`, and backups start at least `stagger` seconds apart. Waiting instances go in the
+	order they started waiting. Only ``flock`` locks and a small JSON file are involved, the
+	OS releases the locks of an instance that dies and an instance that stops checking in is
+	dropped from the waiting list, so nothing has to be cleaned up after a crash.
+
+	Incremental backups of instances with the same exclusions can share a chunk store below
+	`folder`, see :meth:`chunk_store`. `member` identifies this instance, see
+	:func:`get_member_id`. `clock` and `sleep` are the wall clock and a way to wait, by
+	default one that :meth:`stop` interrupts.
+	"""
+
+	def __init__(self, folder, member, max_concurrent=1, stagger=0, clock=time.time, sleep=None, logger=None):
+		self.folder = folder
+		self.member = member
+		self.max_concurrent = max_concurrent
+		self.stagger = stagger
+		self._clock = clock
+		self._stopped = threading.Event()
+		self._sleep = sleep or self._stopped.wait
+		self._logger = logger or logging.getLogger(__name__)
+		self._lock = FileLock(os.path.join(folder, "coordinator.lock"))
+		self._state_path = os.path.join(folder, "coordinator.json")
+		self._chunk_stores = {}
+		self._chunk_stores_lock = threading.Lock()
+		os.makedirs(os.path.join(folder, "slots"), exist_ok=True)
+
+	def stop(self):
+		self._stopped.set()
+
+	# ~~ slots
+
+	def _load_state(self):
+		try:
+			with open(self._state_path, "r", encoding="utf-8") as f:
+				return json.load(f)
+		except (IOError, OSError, ValueError):
+			return {}
+
+	def _save_state(self, state):
+		with open(self._state_path + ".tmp", "w", encoding="utf-8") as f:
+			json.dump(state, f)
+		os.replace(self._state_path + ".tmp", self._state_path)
+
+	def _claim_slot(self):
+		for number in range(max(1, self.max_concurrent)):
+			slot = FileLock(os.path.join(self.folder, "slots", f"{number}.lock")).acquire(blocking=False)
+			if slot is not None:
+				return slot
+		return None
+
+	def acquire(self, timeout=None):
+		"""
+		Waits for this instance's turn: a free slot, no instance that has been waiting longer,
+		and `stagger` seconds since the last backup on the host started.
+
+		:return: the slot to pass to :meth:`release`, None if it wasn't this instance's turn
+			within `timeout` seconds or the coordinator was stopped
+		"""
+		started = self._clock()
+		while not self._stopped.is_set():
+			now = self._clock()
+			with self._lock.held():
+				state = self._load_state()
+				waiting = state.setdefault("waiting", {})
+				# the clock may have jumped back since the last start
+				last_start = min(state.get("last_start", 0), now)
+				for member, waiter in list(waiting.items()):
+					if member != self.member and not now - POLL_INTERVAL * WAITER_EXPIRY <= waiter["seen"] <= now:
+						del waiting[member]
+				waiter = waiting.setdefault(self.member, {"since": now})
+				waiter["seen"] = now
+				first = min(waiting, key=lambda member: (waiting[member]["since"], member))
+				wait = last_start + self.stagger - now
+				slot = None
+				if first != self.member:
+					wait = POLL_INTERVAL
+				elif wait <= 0:
+					slot = self._claim_slot()
+					wait = POLL_INTERVAL
+				if slot is not None:
+					del waiting[self.member]
+					state["last_start"] = now
+				self._save_state(state)
+			if slot is not None:
+				self._logger.debug(f"Backup slot acquired after {now - started:.0f}s.")
+				return slot
+			if timeout is not None and now - started >= timeout:
+				break
+			self._sleep(max(0.0, min(wait, POLL_INTERVAL)))
+		self._leave()
+		return None
+
+	def _leave(self):
+		with self._lock.held():
+			state = self._load_state()
+			if self.member in state.get("waiting", {}):
+				del state["waiting"][self.member]
+				self._save_state(state)
+
+	def release(self, slot):
+		slot.close()
+
+	# ~~ shared chunk stores
+
+	def _chunk_store_folder(self, key):
+		return os.path.join(self.folder, "incremental", key)
+
+	def chunk_store(self, exclusions):
+		"""
+		The chunk store this instance shares with the instances on the host that back up with
+		the same `exclusions`. Every instance keeps its own manifests in it.
+		"""
+		return self._get_chunk_store(get_exclusion_key(exclusions))
+
+	def _get_chunk_store(self, key):
+		with self._chunk_stores_lock:
+			if key not in self._chunk_stores:
+				folder = self._chunk_store_folder(key)
+				os.makedirs(folder, exist_ok=True)
+				self._chunk_stores[key] = ChunkStore(folder, namespace=self.member,
+													 host_lock=FileLock(os.path.join(folder, "store.lock")))
+			return self._chunk_stores[key]
+
+	def chunk_stores(self):
+		"""
+		The shared chunk stores this instance has backups in.
+		"""
+		folder = os.path.join(self.folder, "incremental")
+		keys = os.listdir(folder) if os.path.isdir(folder) else []
+		return [self._get_chunk_store(key) for key in sorted(keys)
+				if os.path.isdir(os.path.join(self._chunk_store_folder(key), "manifests", self.member))]
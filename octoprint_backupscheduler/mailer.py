@@ -0,0 +1,218 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import smtplib
+import threading
+import time
+import uuid
+from email.mime.text import MIMEText
+
+from octoprint.settings import valid_boolean_trues
+
+# retry delays double from RETRY_DELAY up to MAX_RETRY_DELAY, a message is given up after MAX_ATTEMPTS
+RETRY_DELAY = 30
+MAX_RETRY_DELAY = 3600
+MAX_ATTEMPTS = 8
+
+# an idle connection is kept open this long for the next message
+KEEPALIVE = 30
+
+# errors retrying won't fix
+PERMANENT_ERRORS = (ValueError, smtplib.SMTPAuthenticationError, smtplib.SMTPRecipientsRefused,
+					smtplib.SMTPSenderRefused)
+
+
+def build_message(subject, body, sender, recipient):
+	msg = MIMEText(body, "html")
+	msg['Subject'] = subject
+	msg['From'] = sender
+	msg['To'] = recipient
+	return msg
+
+
+def open_connection(config, timeout=60):
+	"""
+	Connects and logs in to the SMTP server in `config`, the ``send_email`` settings.
+	"""
+	if config.get("smtp_password", "") == "":
+		raise ValueError("SMTP password is empty.")
+	if config.get("smtp_tls") in valid_boolean_trues:
+		server = smtplib.SMTP_SSL(timeout=timeout)
+	else:
+		server = smtplib.SMTP(timeout=timeout)
+	# set host manually to deal with python bug value error, see https://bugs.python.org/issue36094
+	server._host = config["smtp_server"]
+	server.connect(config["smtp_server"], int(config["smtp_port"]))
+	server.ehlo()
+	if config.get("smtp_user", "") != "":
+		server.login(config["smtp_user"], config["smtp_password"])
+	return server
+
+
+def send_message(server, config, subject, body):
+	msg = build_message(subject, body, config["sender"], config["recipient"])
+	server.sendmail(msg['From'], msg['To'], msg.as_string())
+
+
+class MailOutbox(threading.Thread):
+	"""
+	Sends mails in the background. Queued messages are persisted to a JSON file so they survive
+	a restart, sent over a single connection that is reused as long as messages keep coming,
+	and retried with exponential backoff. Messages queued with ``digest=True`` are held for
+	`digest_interval()` seconds and then sent as one combined mail, 0 sends them right away.
+
+	`get_config` returns the current ``send_email`` settings, `on_failure` is called with
+	the subject and error of every message that is given up. Send times and outcomes are
+	recorded in `metrics` if given.
+	"""
+
+	def __init__(self, path, get_config, digest_interval=None, on_failure=None, metrics=None, logger=None):
+		threading.Thread.__init__(self, name="BackupSchedulerMail")
+		self.daemon = True
+		self._path = path
+		self._get_config = get_config
+		self._digest_interval = digest_interval or (lambda: 0)
+		self._on_failure = on_failure
+		self._metrics = metrics
+		self._logger = logger or logging.getLogger(__name__)
+		self._lock = threading.RLock()
+		self._wakeup = threading.Event()
+		self._stopped = False
+		self._server = None
+		self._server_config = None
+		self._last_used = 0
+		self._messages = self._load()
+
+	def _load(self):
+		try:
+			with open(self._path, "r", encoding="utf-8") as f:
+				return list(json.load(f))
+		except (IOError, OSError, ValueError):
+			return []
+
+	def _save(self):
+		with open(self._path + ".tmp", "w", encoding="utf-8") as f:
+			json.dump(self._messages, f)
+		os.replace(self._path + ".tmp", self._path)
+
+	def __len__(self):
+		with self._lock:
+			return len(self._messages)
+
+	def enqueue(self, subject, body, digest=False):
+		now = time.time()
+		interval = self._digest_interval() if digest else 0
+		with self._lock:
+			if interval:
+				# join the digest that is already waiting, if there is one
+				due = min([m["due"] for m in self._messages if m.get("digest")] or [now + interval])
+			else:
+				due = now
+			self._messages.append({"id": uuid.uuid4().hex, "subject": subject, "body": body, "queued": now,
+								   "due": due, "attempts": 0, "digest": bool(interval)})
+			self._save()
+		self._wakeup.set()
+
+	def stop(self):
+		self._stopped = True
+		self._wakeup.set()
+
+	def run(self):
+		while not self._stopped:
+			self._wakeup.clear()
+			now = time.time()
+			with self._lock:
+				due = [m for m in self._messages if m["due"] <= now]
+				next_due = min([m["due"] for m in self._messages if m["due"] > now] or [None])
+			if due:
+				self._send(due)
+				continue
+			if self._server is not None and now - self._last_used >= KEEPALIVE:
+				self._disconnect()
+			timeout = None
+			if next_due is not None:
+				timeout = next_due - now
+			if self._server is not None:
+				timeout = min(timeout or KEEPALIVE, max(KEEPALIVE - (now - self._last_used), 0))
+			self._wakeup.wait(timeout)
+		self._disconnect()
+
+	def _send(self, messages):
+		digests = [m for m in messages if m.get("digest")]
+		batches = [[m] for m in messages if not m.get("digest")]
+		if digests:
+			batches.append(digests)
+		config = self._get_config()
+		for batch in batches:
+			if len(batch) > 1:
+				subject = "{} ({})".format(batch[0]["subject"], len(batch))
+				body = "<hr>".join(m["body"] for m in batch)
+			else:
+				subject, body = batch[0]["subject"], batch[0]["body"]
+			started = time.monotonic()
+			try:
+				server = self._connect(config)
+				send_message(server, config, subject, body)
+				self._last_used = time.time()
+				self._logger.debug(f"Sent mail {subject}.")
+				self._done(batch)
+				self._record("emails_sent", started)
+			except Exception as e:
+				self._disconnect()
+				self._retry(batch, subject, e)
+				self._record("emails_failed", started)
+
+	def _record(self, counter, started):
+		if self._metrics is not None:
+			self._metrics.observe("email_send", time.monotonic() - started)
+			self._metrics.count(counter)
+
+	def _connect(self, config):
+		if self._server is not None and self._server_config != config:
+			# settings changed since the connection was opened
+			self._disconnect()
+		if self._server is not None:
+			try:
+				self._server.noop()
+				return self._server
+			except (smtplib.SMTPException, OSError):
+				self._disconnect()
+		self._server = open_connection(config)
+		self._server_config = dict(config)
+		return self._server
+
+	def _disconnect(self):
+		if self._server is None:
+			return
+		try:
+			self._server.quit()
+		except Exception:
+			pass
+		self._server = None
+
+	def _done(self, batch):
+		ids = set(m["id"] for m in batch)
+		with self._lock:
+			self._messages = [m for m in self._messages if m["id"] not in ids]
+			self._save()
+
+	def _retry(self, batch, subject, error):
+		attempts = max(m["attempts"] for m in batch) + 1
+		if isinstance(error, PERMANENT_ERRORS) or attempts >= MAX_ATTEMPTS:
+			self._logger.error(f"Giving up on mail {subject}: {error}")
+			self._done(batch)
+			if self._on_failure is not None:
+				self._on_failure(subject, error)
+			return
+		delay = min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+		self._logger.warning(f"Could not send mail {subject}, retrying in {delay}s: {error}")
+		ids = set(m["id"] for m in batch)
+		with self._lock:
+			for message in self._messages:
+				if message["id"] in ids:
+					message["attempts"] = attempts
+					message["due"] = time.time() + delay
+			self._save()
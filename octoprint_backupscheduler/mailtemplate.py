@@ -0,0 +1,51 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import os
+import re
+import threading
+
+PLACEHOLDER = re.compile(r"\{\{(\w+)\}\}")
+
+
+class MailTemplates(object):
+	"""
+	Mail templates from `folder` with ``{{placeholder}}`` fields. Every template is parsed once
+	into alternating literal and placeholder segments and reparsed only when its file changes,
+	rendering joins the segments in a single pass. Placeholders without a value are left as is.
+	"""
+
+	def __init__(self, folder):
+		self._folder = folder
+		self._lock = threading.Lock()
+		self._cache = {}
+
+	def _get_segments(self, filename):
+		path = os.path.join(self._folder, filename)
+		mtime = os.stat(path).st_mtime_ns
+		with self._lock:
+			cached = self._cache.get(filename)
+			if cached is not None and cached[0] == mtime:
+				return cached[1]
+		with open(path, "r", encoding="utf-8") as f:
+			# odd indices are placeholder names
+			segments = PLACEHOLDER.split(f.read())
+		with self._lock:
+			self._cache[filename] = (mtime, segments)
+		return segments
+
+	def render(self, filename, placeholders=None):
+		segments = self._get_segments(filename)
+		placeholders = placeholders or {}
+		return "".join(segment if i % 2 == 0 else str(placeholders.get(segment, "{{" + segment + "}}"))
+					   for i, segment in enumerate(segments))
+
+
+def format_size(size):
+	for unit in ("B", "KB", "MB", "GB"):
+		if size < 1024:
+			break
+		size /= 1024.0
+	else:
+		unit = "TB"
+	return "{:.0f} {}".format(size, unit) if unit == "B" else "{:.1f} {}".format(size, unit)
@@ -0,0 +1,96 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+from contextlib import contextmanager
+from time import monotonic
+
+# upper bounds of the duration histogram buckets, in seconds
+DURATION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600)
+
+PHASES = ("coordination_wait", "backup", "mount_check", "change_check", "preflight", "archive", "wait_for_completion",
+		  "verify", "retention", "settings_save", "email_send")
+COUNTERS = ("backups_created", "backups_unchanged", "backups_failed", "backups_deleted", "bytes_written",
+			"files_archived", "skipped_printing", "mount_failures", "insufficient_space", "coordination_timeouts",
+			"backups_verified", "verification_failures", "emails_sent", "emails_failed")
+
+
+class Histogram(object):
+	"""
+	Cumulative histogram over fixed `buckets`, using the same memory however many values
+	are observed.
+	"""
+
+	def __init__(self, buckets=DURATION_BUCKETS):
+		self.buckets = tuple(buckets)
+		self.counts = [0] * (len(self.buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value):
+		for i, bound in enumerate(self.buckets):
+			if value <= bound:
+				break
+		else:
+			i = len(self.buckets)
+		self.counts[i] += 1
+		self.count += 1
+		self.sum += value
+
+	def cumulative(self):
+		total = 0
+		for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+			total += count
+			yield bound, total
+
+
+class BackupMetrics(object):
+	"""
+	Counters and per-phase duration histograms of the backup jobs since OctoPrint started.
+	"""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._counters = dict((name, 0) for name in COUNTERS)
+		self._durations = dict((phase, Histogram()) for phase in PHASES)
+
+	def count(self, name, value=1):
+		with self._lock:
+			self._counters[name] = self._counters.get(name, 0) + value
+
+	def observe(self, phase, duration):
+		with self._lock:
+			if phase not in self._durations:
+				self._durations[phase] = Histogram()
+			self._durations[phase].observe(duration)
+
+	@contextmanager
+	def timer(self, phase):
+		started = monotonic()
+		try:
+			yield
+		finally:
+			self.observe(phase, monotonic() - started)
+
+	def to_dict(self):
+		with self._lock:
+			return {"counters": dict(self._counters),
+					"durations": {phase: {"count": h.count, "sum": h.sum,
+										  "buckets": [[bound if bound != float("inf") else "+Inf", count]
+													  for bound, count in h.cumulative()]}
+								  for phase, h in self._durations.items()}}
+
+	def to_prometheus(self, prefix="octoprint_backupscheduler"):
+		lines = []
+		with self._lock:
+			for name, value in sorted(self._counters.items()):
+				lines.append(f"# TYPE {prefix}_{name}_total counter")
+				lines.append(f"{prefix}_{name}_total {value}")
+			lines.append(f"# TYPE {prefix}_phase_duration_seconds histogram")
+			for phase, h in sorted(self._durations.items()):
+				for bound, count in h.cumulative():
+					le = "+Inf" if bound == float("inf") else repr(float(bound))
+					lines.append(f'{prefix}_phase_duration_seconds_bucket{{phase="{phase}",le="{le}"}} {count}')
+				lines.append(f'{prefix}_phase_duration_seconds_sum{{phase="{phase}"}} {h.sum}')
+				lines.append(f'{prefix}_phase_duration_seconds_count{{phase="{phase}"}} {h.count}')
+		return "\n".join(lines) + "\n"
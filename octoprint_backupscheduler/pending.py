@@ -0,0 +1,122 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+class PendingQueue(object):
+	"""
+	Backups deferred because the printer was busy, persisted to a JSON file so they survive a
+	restart. Every entry is a batch of backup types that were due together, and a backup type
+	is only ever queued once. The file is only rewritten when the queue actually changes.
+	"""
+
+	def __init__(self, path):
+		self._path = path
+		self._lock = threading.RLock()
+		self._entries = self._load()
+
+	def _load(self):
+		try:
+			with open(self._path, "r", encoding="utf-8") as f:
+				return [list(entry) for entry in json.load(f) if entry]
+		except (IOError, OSError, ValueError):
+			return []
+
+	def _save(self):
+		with open(self._path + ".tmp", "w", encoding="utf-8") as f:
+			json.dump(self._entries, f)
+		os.replace(self._path + ".tmp", self._path)
+
+	def __contains__(self, backup_type):
+		with self._lock:
+			return any(backup_type in entry for entry in self._entries)
+
+	def __len__(self):
+		with self._lock:
+			return len(self._entries)
+
+	@property
+	def backup_types(self):
+		with self._lock:
+			return [backup_type for entry in self._entries for backup_type in entry]
+
+	def first(self):
+		with self._lock:
+			return list(self._entries[0]) if self._entries else None
+
+	def add(self, backup_types):
+		with self._lock:
+			entry = [backup_type for backup_type in backup_types if backup_type not in self]
+			if not entry:
+				return False
+			self._entries.append(entry)
+			self._save()
+			return True
+
+	def remove(self, backup_type):
+		with self._lock:
+			if backup_type not in self:
+				return False
+			self._entries = [[t for t in entry if t != backup_type] for entry in self._entries]
+			self._entries = [entry for entry in self._entries if entry]
+			self._save()
+			return True
+
+
+class PendingWorker(threading.Thread):
+	"""
+	Drains a :class:`PendingQueue` one entry at a time while `is_idle` returns ``True``, handing
+	each entry to `callback`. Call :meth:`wake` when the printer might have become idle, and
+	:meth:`retry_later` when the queue can't be worked on for a while although it is.
+	"""
+
+	def __init__(self, queue, callback, is_idle, logger=None):
+		threading.Thread.__init__(self, name="BackupSchedulerPending")
+		self.daemon = True
+		self._queue = queue
+		self._callback = callback
+		self._is_idle = is_idle
+		self._logger = logger or logging.getLogger(__name__)
+		self._wakeup = threading.Event()
+		self._stopped = False
+		self._retry_at = None
+
+	def wake(self):
+		self._wakeup.set()
+
+	def retry_later(self, delay):
+		"""
+		Holds off the queue for `delay` seconds. An entry the callback is running is kept in the
+		queue and tried again then.
+		"""
+		self._retry_at = time.monotonic() + delay
+		self._wakeup.set()
+
+	def stop(self):
+		self._stopped = True
+		self._wakeup.set()
+
+	def run(self):
+		while not self._stopped:
+			self._wakeup.clear()
+			entry = self._queue.first()
+			delay = self._retry_at - time.monotonic() if self._retry_at is not None else 0
+			if entry is None or not self._is_idle() or delay > 0:
+				self._wakeup.wait(delay if entry is not None and delay > 0 else None)
+				continue
+			self._retry_at = None
+			self._logger.debug(f"Starting pending {entry} while the printer is idle.")
+			try:
+				self._callback(entry)
+			except Exception:
+				self._logger.exception(f"Error while running pending {entry}.")
+			if self._queue.first() == entry and self._is_idle() and self._retry_at is None:
+				# the callback didn't take care of it, don't try again forever
+				self._logger.warning(f"Dropping pending {entry}.")
+				for backup_type in entry:
+					self._queue.remove(backup_type)
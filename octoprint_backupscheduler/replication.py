@@ -0,0 +1,398 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+# retry delays double from RETRY_DELAY up to MAX_RETRY_DELAY, a job is given up after MAX_ATTEMPTS
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 6 * 3600
+MAX_ATTEMPTS = 10
+
+# size of the parts of a multipart upload, S3 requires at least 5 MiB for all but the last one
+PART_SIZE = 8 * 1024 * 1024
+
+# size of the reads when copying or uploading a stream
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# suffix of incomplete uploads on targets without multipart uploads
+PARTIAL_SUFFIX = ".part"
+
+
+class ReplicationError(Exception):
+	pass
+
+
+def _copy_stream(source, target, throttle=None):
+	for data in iter(lambda: source.read(COPY_BUFFER_SIZE), b""):
+		if throttle is not None:
+			throttle.consume(len(data))
+		target.write(data)
+
+
+class LocalTarget(object):
+	"""
+	Replicates to a folder, e.g. on another disk or a mounted network share. An interrupted
+	copy is resumed from where it stopped.
+	"""
+
+	def __init__(self, folder):
+		if not folder:
+			raise ReplicationError("No replication folder configured.")
+		self._folder = folder
+
+	def upload(self, path, name, state, throttle=None):
+		os.makedirs(self._folder, exist_ok=True)
+		target = os.path.join(self._folder, name)
+		partial = target + PARTIAL_SUFFIX
+		offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+		with open(path, "rb") as source, open(partial, "ab") as f:
+			source.seek(offset)
+			_copy_stream(source, f, throttle)
+		os.replace(partial, target)
+
+	def copy(self, source, name):
+		source, target = os.path.join(self._folder, source), os.path.join(self._folder, name)
+		if os.path.exists(target):
+			os.remove(target)
+		try:
+			os.link(source, target)
+		except OSError:
+			shutil.copyfile(source, target)
+
+	def delete(self, name):
+		for path in (os.path.join(self._folder, name), os.path.join(self._folder, name + PARTIAL_SUFFIX)):
+			if os.path.exists(path):
+				os.remove(path)
+
+	def close(self):
+		pass
+
+
+class SFTPTarget(object):
+	"""
+	Replicates to a folder on an SFTP server, needs paramiko. An interrupted upload is resumed
+	from the size of the partial file on the server.
+	"""
+
+	def __init__(self, host, port=22, username=None, password=None, key_file=None, folder=""):
+		try:
+			import paramiko
+		except ImportError:
+			raise ReplicationError("SFTP replication needs paramiko, install it with: pip install paramiko")
+		if not host:
+			raise ReplicationError("No SFTP host configured.")
+		key = _load_private_key(paramiko, key_file) if key_file else None
+		self._transport = paramiko.Transport((host, int(port or 22)))
+		self._transport.connect(username=username, password=password or None, pkey=key)
+		self._sftp = paramiko.SFTPClient.from_transport(self._transport)
+		self._folder = folder or "."
+
+	def _path(self, name):
+		return self._folder.rstrip("/") + "/" + name
+
+	def upload(self, path, name, state, throttle=None):
+		partial = self._path(name) + PARTIAL_SUFFIX
+		try:
+			offset = self._sftp.stat(partial).st_size
+		except IOError:
+			offset = 0
+		with open(path, "rb") as source, self._sftp.open(partial, "ab") as f:
+			source.seek(offset)
+			f.set_pipelined(True)
+			_copy_stream(source, f, throttle)
+		try:
+			self._sftp.remove(self._path(name))
+		except IOError:
+			pass
+		self._sftp.rename(partial, self._path(name))
+
+	def copy(self, source, name):
+		# SFTP has no copy, but OpenSSH servers can hardlink
+		from paramiko.sftp import CMD_EXTENDED
+		try:
+			self._sftp.remove(self._path(name))
+		except IOError:
+			pass
+		self._sftp._request(CMD_EXTENDED, "hardlink@openssh.com", self._path(source), self._path(name))
+
+	def delete(self, name):
+		for path in (self._path(name), self._path(name) + PARTIAL_SUFFIX):
+			try:
+				self._sftp.remove(path)
+			except IOError:
+				pass
+
+	def close(self):
+		self._sftp.close()
+		self._transport.close()
+
+
+def _load_private_key(paramiko, key_file):
+	# the key file doesn't say its type, try the ones paramiko has (DSS was dropped in 4.0)
+	for name in ("Ed25519Key", "ECDSAKey", "RSAKey", "DSSKey"):
+		key_class = getattr(paramiko, name, None)
+		if key_class is None:
+			continue
+		try:
+			return key_class.from_private_key_file(key_file)
+		except paramiko.PasswordRequiredException:
+			raise ReplicationError(f"The SSH key {key_file} is encrypted, only keys without a passphrase are supported.")
+		except paramiko.SSHException:
+			continue
+		except (IOError, OSError) as e:
+			raise ReplicationError(f"Can't read the SSH key {key_file}: {e}")
+	raise ReplicationError(f"The SSH key {key_file} isn't an Ed25519, ECDSA, RSA or DSA key.")
+
+
+class S3Target(object):
+	"""
+	Replicates to an S3 compatible bucket, needs boto3. Archives are sent as multipart
+	uploads with `parallel` parts in flight, the upload id is kept in the job's `state` so an
+	interrupted upload continues with the parts that are still missing.
+	"""
+
+	def __init__(self, bucket, prefix="", endpoint=None, access_key=None, secret_key=None, region=None,
+				 parallel=4):
+		try:
+			import boto3
+		except ImportError:
+			raise ReplicationError("S3 replication needs boto3, install it with: pip install boto3")
+		if not bucket:
+			raise ReplicationError("No S3 bucket configured.")
+		self._client = boto3.client("s3", endpoint_url=endpoint or None, aws_access_key_id=access_key or None,
+									aws_secret_access_key=secret_key or None, region_name=region or None)
+		self._bucket = bucket
+		self._prefix = prefix.strip("/") + "/" if prefix else ""
+		self._parallel = max(1, parallel)
+
+	def upload(self, path, name, state, throttle=None):
+		key = self._prefix + name
+		size = os.path.getsize(path)
+		upload_id = state.get("upload_id")
+		done = {}
+		if upload_id:
+			try:
+				paginator = self._client.get_paginator("list_parts")
+				for page in paginator.paginate(Bucket=self._bucket, Key=key, UploadId=upload_id):
+					for part in page.get("Parts", []):
+						done[part["PartNumber"]] = part["ETag"]
+			except Exception:
+				# expired or aborted, start over
+				upload_id, done = None, {}
+		if not upload_id:
+			upload_id = self._client.create_multipart_upload(Bucket=self._bucket, Key=key)["UploadId"]
+			state["upload_id"] = upload_id
+			state.save()
+		numbers = range(1, max(1, -(-size // PART_SIZE)) + 1)
+		missing = [number for number in numbers if number not in done]
+		with ThreadPoolExecutor(max_workers=self._parallel, thread_name_prefix="BackupSchedulerUpload") as pool:
+			# parts are read by the workers, so only the ones being uploaded are held in memory
+			for number, etag in pool.map(lambda n: self._upload_part(path, key, upload_id, n, throttle), missing):
+				done[number] = etag
+		self._client.complete_multipart_upload(
+			Bucket=self._bucket, Key=key, UploadId=upload_id,
+			MultipartUpload={"Parts": [{"PartNumber": number, "ETag": done[number]} for number in numbers]})
+		state.pop("upload_id", None)
+
+	def _upload_part(self, path, key, upload_id, number, throttle=None):
+		with open(path, "rb") as f:
+			f.seek((number - 1) * PART_SIZE)
+			data = f.read(PART_SIZE)
+		if throttle is not None:
+			throttle.consume(len(data))
+		response = self._client.upload_part(Bucket=self._bucket, Key=key, UploadId=upload_id, PartNumber=number,
+											Body=data)
+		return number, response["ETag"]
+
+	def copy(self, source, name):
+		# server side, as a multipart copy if needed
+		self._client.copy({"Bucket": self._bucket, "Key": self._prefix + source}, self._bucket, self._prefix + name)
+
+	def delete(self, name):
+		self._client.delete_object(Bucket=self._bucket, Key=self._prefix + name)
+
+	def close(self):
+		pass
+
+
+def create_target(config):
+	"""
+	The replication target described by `config`, the ``replication`` settings.
+	"""
+	kind = config.get("target")
+	if kind == "local":
+		return LocalTarget(config.get("local", {}).get("folder"))
+	if kind == "sftp":
+		return SFTPTarget(**config.get("sftp", {}))
+	if kind == "s3":
+		return S3Target(parallel=int(config.get("parallel_uploads") or 1), **config.get("s3", {}))
+	raise ReplicationError(f"Unknown replication target {kind}.")
+
+
+class _JobState(dict):
+	# resume state of a job, saved with the queue
+	def __init__(self, save, *args):
+		dict.__init__(self, *args)
+		self.save = save
+
+
+class Replicator(threading.Thread):
+	"""
+	Pushes new backups to a replication target and mirrors deletions, in the background.
+	Backups that are links of the same archive are uploaded once and copied on the target,
+	or uploaded after all if the target can't copy. Jobs are persisted to a JSON file so they
+	survive a restart, together with what is needed to resume an interrupted upload, and
+	retried with exponential backoff.
+
+	`get_config` returns the current ``replication`` settings, `get_path` the local path of
+	a backup, `throttle` caps the upload bandwidth. `on_failure` is called with the job of
+	every upload that is given up.
+	"""
+
+	def __init__(self, path, get_config, get_path, throttle=None, on_failure=None, logger=None):
+		threading.Thread.__init__(self, name="BackupSchedulerReplication")
+		self.daemon = True
+		self._path = path
+		self._get_config = get_config
+		self._get_path = get_path
+		self._throttle = throttle
+		self._on_failure = on_failure
+		self._logger = logger or logging.getLogger(__name__)
+		self._lock = threading.RLock()
+		self._wakeup = threading.Event()
+		self._stopped = False
+		self._jobs = self._load()
+
+	def _load(self):
+		try:
+			with open(self._path, "r", encoding="utf-8") as f:
+				return list(json.load(f))
+		except (IOError, OSError, ValueError):
+			return []
+
+	def _save(self):
+		with self._lock:
+			with open(self._path + ".tmp", "w", encoding="utf-8") as f:
+				json.dump(self._jobs, f)
+			os.replace(self._path + ".tmp", self._path)
+
+	def __len__(self):
+		with self._lock:
+			return len(self._jobs)
+
+	@property
+	def jobs(self):
+		with self._lock:
+			return [dict(job) for job in self._jobs]
+
+	def upload(self, name):
+		self._add("upload", name)
+
+	def copy(self, source, name):
+		"""
+		Replicates `name`, which has the same content as `source`, by copying `source` on the
+		target once it was uploaded.
+		"""
+		self._add("copy", name, source=source)
+
+	def delete(self, name):
+		with self._lock:
+			# no need to finish uploading what is going to be deleted anyway
+			self._jobs = [job for job in self._jobs if job["name"] != name or job["op"] == "delete"]
+		self._add("delete", name)
+
+	def _add(self, op, name, **fields):
+		with self._lock:
+			if any(job["op"] == op and job["name"] == name for job in self._jobs):
+				return
+			job = {"id": uuid.uuid4().hex, "op": op, "name": name, "attempts": 0, "due": time.time(), "state": {}}
+			job.update(fields)
+			self._jobs.append(job)
+			self._save()
+		self._wakeup.set()
+
+	def _waiting(self, job):
+		# a copy waits for the upload of its source
+		return job["op"] == "copy" and any(j["op"] == "upload" and j["name"] == job["source"] for j in self._jobs)
+
+	def stop(self):
+		self._stopped = True
+		self._wakeup.set()
+
+	def run(self):
+		while not self._stopped:
+			self._wakeup.clear()
+			now = time.time()
+			with self._lock:
+				runnable = [job for job in self._jobs if not self._waiting(job)]
+				due = next((job for job in runnable if job["due"] <= now), None)
+				next_due = min([job["due"] for job in runnable] or [None])
+			if due is None:
+				self._wakeup.wait(None if next_due is None else next_due - now)
+				continue
+			self._run_job(due)
+
+	def _run_job(self, job):
+		target = None
+		try:
+			target = create_target(self._get_config())
+			job["state"] = state = _JobState(self._save, job["state"])
+			if job["op"] == "delete":
+				target.delete(job["name"])
+				self._logger.info(f"Deleted replicated {job['name']}.")
+			elif job["op"] == "copy" and self._copy(target, job):
+				self._logger.info(f"Replicated {job['name']} as a copy of {job['source']}.")
+			else:
+				path = self._get_path(job["name"])
+				if not os.path.exists(path):
+					self._logger.info(f"Not replicating {job['name']}, it no longer exists.")
+				else:
+					started = time.monotonic()
+					target.upload(path, job["name"], state, self._throttle)
+					self._logger.info("Replicated {} ({} bytes) in {:.1f}s.".format(
+						job["name"], os.path.getsize(path), time.monotonic() - started))
+			self._done(job)
+		except Exception as e:
+			self._retry(job, e)
+		finally:
+			if target is not None:
+				try:
+					target.close()
+				except Exception:
+					pass
+
+	def _copy(self, target, job):
+		# whether the target copied the source, if not the copy is uploaded like any backup
+		try:
+			target.copy(job["source"], job["name"])
+			return True
+		except Exception as e:
+			self._logger.debug(f"Could not copy {job['source']} to {job['name']} on the target, uploading it: {e}")
+			return False
+
+	def _done(self, job):
+		with self._lock:
+			self._jobs = [j for j in self._jobs if j["id"] != job["id"]]
+			self._save()
+
+	def _retry(self, job, error):
+		attempts = job["attempts"] + 1
+		if isinstance(error, ReplicationError) or attempts >= MAX_ATTEMPTS:
+			self._logger.error(f"Giving up on replicating {job['op']} of {job['name']}: {error}")
+			self._done(job)
+			if self._on_failure is not None:
+				self._on_failure(job, error)
+			return
+		delay = min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+		self._logger.warning(f"Could not replicate {job['op']} of {job['name']}, retrying in {delay}s: {error}")
+		with self._lock:
+			job["attempts"] = attempts
+			job["due"] = time.time() + delay
+			self._save()
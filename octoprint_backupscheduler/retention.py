@@ -0,0 +1,151 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import os
+import re
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+
+BACKUP_NAME = re.compile(r"^(?P<instance>.+)-(?P<type>daily|weekly|monthly|startup)-(?P<created>\d{8}-\d{6})\.zip$")
+
+# grandfather-father-son tiers, under a size quota the lowest tier is pruned first
+TIERS = {"startup_backups": 0, "daily_backups": 1, "weekly_backups": 2, "monthly_backups": 3}
+
+
+class BackupEntry(object):
+	"""
+	A backup found on disk, with the schedule types it belongs to.
+	"""
+
+	__slots__ = ("name", "backup_types", "created", "size", "inode")
+
+	def __init__(self, name, backup_types, created, size=0, inode=None):
+		self.name = name
+		self.backup_types = set(backup_types)
+		self.created = created
+		self.size = size
+		self.inode = inode
+
+	def __repr__(self):
+		return "BackupEntry({!r}, {!r})".format(self.name, sorted(self.backup_types))
+
+
+def parse_backup_name(name, instance_name):
+	"""
+	:return: ``(backup_type, created timestamp)`` if `name` is a backup of this instance, else ``None``
+	"""
+	match = BACKUP_NAME.match(name)
+	if not match or match.group("instance") != instance_name:
+		return None
+	created = datetime.strptime(match.group("created"), "%Y%m%d-%H%M%S")
+	return match.group("type") + "_backups", time.mktime(created.timetuple())
+
+
+def scan_backups(folder, instance_name, assigned, incremental=()):
+	"""
+	Builds an index of the backups that actually exist, from the archives in `folder` and the
+	names of incremental backups in `incremental`. Backups are assigned to the schedule type in
+	their name and to every type whose list in `assigned` (type -> names) contains them.
+	Archives named after this instance but not in any list are picked up as well, while list
+	entries that no longer exist are not.
+	"""
+	assigned_types = defaultdict(set)
+	for backup_type, names in assigned.items():
+		for name in names or []:
+			assigned_types[name].add(backup_type)
+
+	entries = []
+	candidates = OrderedDict((name, None) for name in incremental)
+	# exported incremental backups are indexed as the archive they now are
+	candidates.update((name, os.path.join(folder, name)) for name in _listdir(folder))
+	for name, path in candidates.items():
+		parsed = parse_backup_name(name, instance_name)
+		if parsed is None and name not in assigned_types:
+			continue
+		size, inode, created = 0, None, None
+		if path is not None:
+			try:
+				st = os.stat(path)
+			except OSError:
+				continue
+			size, inode, created = st.st_size, (st.st_dev, st.st_ino), st.st_mtime
+		backup_types = set(assigned_types[name])
+		if parsed is not None:
+			backup_types.add(parsed[0])
+			created = parsed[1]
+		entries.append(BackupEntry(name, backup_types, created or 0, size, inode))
+	return entries
+
+
+def _listdir(folder):
+	try:
+		return [name for name in os.listdir(folder) if name.endswith(".zip")]
+	except OSError:
+		return []
+
+
+def plan_retention(entries, policies, quota=0, now=None, free=0):
+	"""
+	Evaluates grandfather-father-son retention over `entries`.
+
+	Every schedule type in `policies` (type -> ``(count, max_age)``, `max_age` in seconds, 0 for
+	no limit) keeps its `count` newest backups that are not older than `max_age`, and always its
+	newest one. Types without a policy keep all of their backups. If `quota` (bytes) is set, the
+	oldest backups of the lowest tier are pruned next until the kept backups fit, the newest
+	backup overall is never pruned. Hardlinked archives are only counted once. If `free` (bytes)
+	is set, backups are pruned the same way until deleting them frees at least that much.
+
+	:return: ``(names to delete, type -> names to keep ordered oldest first)``
+	"""
+	now = now or time.time()
+	by_type = defaultdict(list)
+	for entry in entries:
+		for backup_type in entry.backup_types:
+			by_type[backup_type].append(entry)
+
+	keep = set()
+	for backup_type, items in by_type.items():
+		items.sort(key=lambda e: e.created, reverse=True)
+		if backup_type not in policies:
+			keep.update(e.name for e in items)
+			continue
+		count, max_age = policies[backup_type]
+		kept = [e for e in items[:max(count, 1)] if not max_age or now - e.created <= max_age]
+		keep.update(e.name for e in kept or items[:1])
+
+	if quota:
+		_apply_quota(entries, keep, quota)
+	if free:
+		_apply_quota(entries, keep, max(0, _total_size(entries) - free))
+
+	delete = [entry.name for entry in entries if entry.name not in keep]
+	kept_by_type = {backup_type: [e.name for e in sorted(items, key=lambda e: e.created) if e.name in keep]
+					for backup_type, items in by_type.items()}
+	return delete, kept_by_type
+
+
+def _total_size(entries):
+	return sum(dict((entry.inode or entry.name, entry.size) for entry in entries).values())
+
+
+def _apply_quota(entries, keep, quota):
+	kept = [entry for entry in entries if entry.name in keep]
+	inodes = defaultdict(int)
+	for entry in kept:
+		inodes[entry.inode or entry.name] += 1
+	sizes = {entry.inode or entry.name: entry.size for entry in kept}
+	total = sum(sizes.values())
+	if total <= quota or not kept:
+		return
+	newest = max(kept, key=lambda e: e.created)
+	candidates = sorted((e for e in kept if e is not newest),
+						key=lambda e: (max(TIERS.get(t, 0) for t in e.backup_types), e.created))
+	for entry in candidates:
+		if total <= quota:
+			break
+		keep.discard(entry.name)
+		key = entry.inode or entry.name
+		inodes[key] -= 1
+		if not inodes[key]:
+			total -= sizes[key]
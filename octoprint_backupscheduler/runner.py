@@ -0,0 +1,55 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import logging
+import threading
+
+# upper bound for a single sleep, so wall clock adjustments (NTP sync, DST) are picked up eventually
+MAX_SLEEP = 900
+# delay before retrying after a scheduled job raised an exception
+RETRY_DELAY = 60
+
+
+class ScheduleRunner(threading.Thread):
+	"""
+	Runs the jobs of a :class:`schedule.Scheduler`, sleeping until the next job is due
+	instead of polling. Call :meth:`wake` whenever jobs were added or removed.
+	"""
+
+	def __init__(self, scheduler, logger=None):
+		threading.Thread.__init__(self, name="BackupSchedulerRunner")
+		self.daemon = True
+		self._scheduler = scheduler
+		self._logger = logger or logging.getLogger(__name__)
+		self._wakeup = threading.Event()
+		self._stopped = False
+
+	def wake(self):
+		self._wakeup.set()
+
+	def stop(self):
+		self._stopped = True
+		self._wakeup.set()
+
+	def run(self):
+		while not self._stopped:
+			self._wakeup.clear()
+			failed = False
+			try:
+				self._scheduler.run_pending()
+			except Exception:
+				self._logger.exception("Error while running scheduled jobs")
+				failed = True
+			timeout = self._next_timeout()
+			if failed and timeout is not None:
+				timeout = max(timeout, RETRY_DELAY)
+			if timeout is None:
+				self._logger.debug("No scheduled jobs, sleeping until woken up.")
+			else:
+				self._logger.debug("Sleeping {:.1f}s until next scheduled job.".format(timeout))
+			self._wakeup.wait(timeout)
+
+	def _next_timeout(self):
+		if self._scheduler.next_run is None:
+			return None
+		return max(0.0, min(self._scheduler.idle_seconds, MAX_SLEEP))
@@ -28,6 +28,9 @@ Usage:
     >>> schedule.every(5).to(10).days.do(job)
     >>> schedule.every().hour.do(job, message='things')
     >>> schedule.every().day.at("10:30").do(job)
+    >>> schedule.every().month.on('last').at("23:00").do(job)
+    >>> schedule.every().cron("30 4 1,15 * *").do(job)
+    >>> schedule.every().planned(lambda now: now + datetime.timedelta(hours=1)).do(job)
 
     >>> while True:
     >>>     schedule.run_pending()
@@ -38,14 +41,17 @@ Usage:
 [3] https://adam.herokuapp.com/past/2010/6/30/replace_cron_with_clockwork/
 """
 try:
-    from collections.abc import Hashable
+    from collections.abc import Hashable, MutableSequence
 except ImportError:
-    from collections import Hashable
+    from collections import Hashable, MutableSequence
+import calendar
 import datetime
 import functools
+import heapq
 import logging
 import random
 import re
+import threading
 import time
 
 logger = logging.getLogger('schedule')
@@ -73,14 +79,174 @@ class CancelJob(object):
     pass
 
 
+class CronExpression(object):
+    """
+    A cron style schedule with the five fields ``minute hour day-of-month
+    month day-of-week``.
+
+    Every field accepts ``*``, single values, ranges (``1-5``), steps
+    (``*/15``, ``0-30/10``) and comma separated lists of those. Months and
+    weekdays may also be given by their three letter english names,
+    weekdays count from ``0`` (sunday) to ``7`` (sunday again). The
+    day-of-month field additionally accepts ``L`` for the last day of the
+    month. As in cron, a day matches if either of day-of-month or
+    day-of-week matches when both are restricted.
+
+    :param expression: The cron expression, e.g. ``"30 4 1,15 * *"``
+    """
+    MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun',
+              'jul', 'aug', 'sep', 'oct', 'nov', 'dec')
+    WEEKDAYS = ('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat')
+
+    #: How many years ahead to look for a matching time
+    MAX_YEARS = 5
+
+    def __init__(self, expression):
+        if not isinstance(expression, str):
+            raise TypeError('cron() should be passed a string')
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ScheduleValueError('Invalid cron expression, expected'
+                                     ' five fields')
+        self.expression = ' '.join(fields)
+        minute, hour, day, month, weekday = fields
+        self.last_day = False
+        if 'L' in day.upper().split(','):
+            self.last_day = True
+            day = ','.join(part for part in day.split(',')
+                           if part.upper() != 'L') or '99'
+        self.minutes = self._parse(minute, 0, 59)
+        self.hours = self._parse(hour, 0, 23)
+        self.days = self._parse(day, 1, 31) if day != '99' else set()
+        self.months = self._parse(month, 1, 12, self.MONTHS, 1)
+        self.weekdays = {d % 7 for d in self._parse(weekday, 0, 7,
+                                                    self.WEEKDAYS, 0)}
+        self.days_restricted = self.last_day or day != '*'
+        self.weekdays_restricted = weekday != '*'
+        self._sorted_hours = sorted(self.hours)
+        self._sorted_minutes = sorted(self.minutes)
+
+    def __str__(self):
+        return self.expression
+
+    @staticmethod
+    def _parse(field, low, high, names=(), offset=0):
+        values = set()
+        for part in field.lower().split(','):
+            step = 1
+            if '/' in part:
+                part, step = part.split('/', 1)
+                if not step.isdigit() or int(step) < 1:
+                    raise ScheduleValueError('Invalid cron step')
+                step = int(step)
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start, end = part.split('-', 1)
+                start = CronExpression._value(start, names, offset)
+                end = CronExpression._value(end, names, offset)
+            else:
+                start = CronExpression._value(part, names, offset)
+                end = high if step != 1 else start
+            if not (low <= start <= end <= high):
+                raise ScheduleValueError('Invalid cron field %r' % field)
+            values.update(range(start, end + 1, step))
+        return values
+
+    @staticmethod
+    def _value(value, names, offset):
+        if value in names:
+            return names.index(value) + offset
+        if not value.isdigit():
+            raise ScheduleValueError('Invalid cron value %r' % value)
+        return int(value)
+
+    def _matches_day(self, date):
+        day_match = date.day in self.days or (
+            self.last_day and
+            date.day == calendar.monthrange(date.year, date.month)[1])
+        weekday_match = date.isoweekday() % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_match or weekday_match
+        if self.days_restricted:
+            return day_match
+        return weekday_match
+
+    def next_after(self, moment):
+        """
+        The first matching time strictly after `moment`.
+
+        :param moment: A :class:`~datetime.datetime`
+        :return: A :class:`~datetime.datetime` object
+        """
+        start = moment.replace(second=0, microsecond=0) + \
+            datetime.timedelta(minutes=1)
+        date = start.date()
+        end = date.replace(year=date.year + self.MAX_YEARS, day=1)
+        while date < end:
+            if date.month not in self.months:
+                # skip straight to the first day of the next month
+                date = (date.replace(day=28) +
+                        datetime.timedelta(days=4)).replace(day=1)
+                continue
+            if self._matches_day(date):
+                for hour in self._sorted_hours:
+                    if date == start.date() and hour < start.hour:
+                        continue
+                    for minute in self._sorted_minutes:
+                        candidate = datetime.datetime.combine(
+                            date, datetime.time(hour, minute))
+                        if candidate >= start:
+                            return candidate
+            date += datetime.timedelta(days=1)
+        raise ScheduleValueError('Cron expression %r never matches'
+                                 % self.expression)
+
+
 class Scheduler(object):
     """
     Objects instantiated by the :class:`Scheduler <Scheduler>` are
     factories to create jobs, keep record of scheduled jobs and
     handle their execution.
+
+    Scheduled jobs are kept in a binary heap ordered by
+    :attr:`Job.next_run`, so looking up the next job is O(1) and
+    (re)scheduling a job is O(log n). Cancelled jobs are removed from
+    the heap lazily, the next time they reach its top.
+
+    The wall clock is checked against a monotonic clock on every
+    :meth:`run_pending`. If it jumped by more than
+    :attr:`CLOCK_JUMP_THRESHOLD` seconds (NTP sync on a host without a
+    real time clock, manual changes) all jobs are rescheduled from the
+    new time instead of running every job the jump skipped over, and
+    :attr:`on_clock_jump` is called with the size of the jump.
+
+    Jobs may be added and cancelled from other threads while one thread
+    calls :meth:`run_pending`, the jobs themselves run outside of the
+    scheduler's lock.
     """
+
+    #: Wall clock deviation from the monotonic clock, in seconds, that
+    #: is treated as a clock jump
+    CLOCK_JUMP_THRESHOLD = 60
+
     def __init__(self):
-        self.jobs = []
+        self._jobs = {}  # registered jobs, in insertion order
+        self._queue = []  # heap of [next_run, sequence, job] entries
+        self._lock = threading.RLock()  # guards _jobs and _queue
+        self._job_list = _JobList(self)
+        self._sequence = 0
+        self._clock = None  # (wall clock, monotonic clock) at last check
+        self.on_clock_jump = None  # called with the jump in seconds
+
+    @property
+    def jobs(self):
+        """
+        All scheduled jobs, in the order they were added, as a live
+        list. Removing a job from it cancels the job, adding one
+        schedules it.
+        """
+        return self._job_list
 
     def run_pending(self):
         """
@@ -90,12 +256,58 @@ class Scheduler(object):
         does not run missed jobs*. For example, if you've registered a job
         that should run every minute and you only call run_pending()
         in one hour increments then your job won't be run 60 times in
-        between but only once.
+        between but only once. Missed runs are left to the caller, see
+        :meth:`Job.last_due`.
         """
-        runnable_jobs = (job for job in self.jobs if job.should_run)
-        for job in sorted(runnable_jobs):
+        self.check_clock()
+        now = datetime.datetime.now()
+        while True:
+            job = self._pop_due(now)
+            if job is None:
+                break
             self._run_job(job)
 
+    def check_clock(self):
+        """
+        Reschedules all jobs if the wall clock jumped since the last
+        check.
+
+        :return: The jump in seconds, ``0`` if there was none
+        """
+        wall, mono = time.time(), time.monotonic()
+        with self._lock:
+            last, self._clock = self._clock, (wall, mono)
+        if last is None:
+            return 0
+        jump = (wall - last[0]) - (mono - last[1])
+        if abs(jump) <= self.CLOCK_JUMP_THRESHOLD:
+            return 0
+        logger.warning('Wall clock jumped by %is, rescheduling %i jobs',
+                       jump, len(self._jobs))
+        self.reschedule()
+        if self.on_clock_jump is not None:
+            self.on_clock_jump(jump)
+        return jump
+
+    def reschedule(self):
+        """
+        Computes the next run of every job anew from the current time.
+
+        Jobs pinned to the calendar don't run again at a time they
+        already ran at when the clock went back, they are scheduled for
+        the first time after their last run instead.
+        """
+        with self._lock:
+            self._queue = []
+            for job in self._jobs:
+                job._schedule_next_run()
+                if job._is_pinned() and job.last_run is not None \
+                        and job.next_run <= job.last_run:
+                    job._schedule_next_run(
+                        job.last_run + datetime.timedelta(seconds=1))
+                job._entry = None
+                self._push(job)
+
     def run_all(self, delay_seconds=0):
         """
         Run all jobs regardless if they are scheduled to run or not.
@@ -107,8 +319,8 @@ class Scheduler(object):
         :param delay_seconds: A delay added between every executed job
         """
         logger.info('Running *all* %i jobs with %is delay inbetween',
-                    len(self.jobs), delay_seconds)
-        for job in self.jobs[:]:
+                    len(self._jobs), delay_seconds)
+        for job in list(self.jobs):
             self._run_job(job)
             time.sleep(delay_seconds)
 
@@ -120,10 +332,15 @@ class Scheduler(object):
         :param tag: An identifier used to identify a subset of
                     jobs to delete
         """
-        if tag is None:
-            del self.jobs[:]
-        else:
-            self.jobs[:] = (job for job in self.jobs if tag not in job.tags)
+        with self._lock:
+            if tag is None:
+                for job in self._jobs:
+                    job._entry = None
+                self._jobs.clear()
+                del self._queue[:]
+            else:
+                for job in [job for job in self._jobs if tag in job.tags]:
+                    self.cancel_job(job)
 
     def cancel_job(self, job):
         """
@@ -131,10 +348,10 @@ class Scheduler(object):
 
         :param job: The job to be unscheduled
         """
-        try:
-            self.jobs.remove(job)
-        except ValueError:
-            pass
+        with self._lock:
+            if self._jobs.pop(job, False) is not False:
+                job._entry = None
+                self._compact()
 
     def every(self, interval=1):
         """
@@ -146,10 +363,86 @@ class Scheduler(object):
         job = Job(interval, self)
         return job
 
+    def _add_job(self, job):
+        with self._lock:
+            self._jobs[job] = None
+            self._push(job)
+
+    def _set_jobs(self, jobs):
+        """
+        Replaces the scheduled jobs by `jobs`, cancelling the ones that
+        are left out and scheduling the new ones.
+        """
+        with self._lock:
+            jobs = list(dict.fromkeys(jobs))
+            for job in self._jobs:
+                job._entry = None
+            self._jobs = dict.fromkeys(jobs)
+            self._queue = []
+            for job in jobs:
+                if job.next_run is None:
+                    job._schedule_next_run()
+                self._push(job)
+
+    def _push(self, job):
+        """
+        (Re)inserts a job into the heap at its current ``next_run``.
+        A previous heap entry of the job becomes stale.
+        """
+        with self._lock:
+            self._sequence += 1
+            job._entry = [job.next_run, self._sequence, job]
+            heapq.heappush(self._queue, job._entry)
+            self._compact()
+
+    def _peek(self):
+        """
+        Returns the job due next, discarding stale heap entries on top.
+        """
+        with self._lock:
+            while self._queue:
+                entry = self._queue[0]
+                job = entry[2]
+                if job in self._jobs and job._entry is entry:
+                    return job
+                heapq.heappop(self._queue)
+            return None
+
+    def _pop_due(self, now):
+        """
+        Takes the job due next off the heap if it is due at `now`.
+        """
+        with self._lock:
+            job = self._peek()
+            if job is None or job.next_run > now:
+                return None
+            # still under the lock, so the entry on top is the one peeked
+            heapq.heappop(self._queue)
+            job._entry = None
+            return job
+
+    def _compact(self):
+        # rebuild the heap once stale entries outnumber the live ones
+        if len(self._queue) > 2 * len(self._jobs) + 16:
+            self._queue = [job._entry for job in self._jobs
+                           if job._entry is not None]
+            heapq.heapify(self._queue)
+
     def _run_job(self, job):
-        ret = job.run()
+        try:
+            ret = job.run()
+        except Exception:
+            # keep a failing job scheduled, it is retried on the next run
+            with self._lock:
+                if job in self._jobs and job._entry is None:
+                    self._push(job)
+            raise
         if isinstance(ret, CancelJob) or ret is CancelJob:
             self.cancel_job(job)
+        else:
+            with self._lock:
+                if job in self._jobs:
+                    self._push(job)
 
     @property
     def next_run(self):
@@ -158,9 +451,9 @@ class Scheduler(object):
 
         :return: A :class:`~datetime.datetime` object
         """
-        if not self.jobs:
-            return None
-        return min(self.jobs).next_run
+        with self._lock:
+            job = self._peek()
+            return None if job is None else job.next_run
 
     @property
     def idle_seconds(self):
@@ -171,6 +464,64 @@ class Scheduler(object):
         return (self.next_run - datetime.datetime.now()).total_seconds()
 
 
+class _JobList(MutableSequence):
+    """
+    The jobs of a :class:`Scheduler` as a list that stays in sync with
+    it, see :attr:`Scheduler.jobs`.
+    """
+
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+
+    def _snapshot(self):
+        with self._scheduler._lock:
+            return list(self._scheduler._jobs)
+
+    def __len__(self):
+        return len(self._scheduler._jobs)
+
+    def __iter__(self):
+        return iter(self._snapshot())
+
+    def __contains__(self, job):
+        return job in self._scheduler._jobs
+
+    def __getitem__(self, index):
+        return self._snapshot()[index]
+
+    def __setitem__(self, index, value):
+        with self._scheduler._lock:
+            jobs = self._snapshot()
+            jobs[index] = value
+            self._scheduler._set_jobs(jobs)
+
+    def __delitem__(self, index):
+        with self._scheduler._lock:
+            jobs = self._snapshot()
+            del jobs[index]
+            self._scheduler._set_jobs(jobs)
+
+    def remove(self, job):
+        if job not in self:
+            raise ValueError('job is not scheduled')
+        self._scheduler.cancel_job(job)
+
+    def clear(self):
+        self._scheduler.clear()
+
+    def insert(self, index, job):
+        with self._scheduler._lock:
+            jobs = self._snapshot()
+            jobs.insert(index, job)
+            self._scheduler._set_jobs(jobs)
+
+    def __eq__(self, other):
+        return self._snapshot() == list(other)
+
+    def __repr__(self):
+        return repr(self._snapshot())
+
+
 class Job(object):
     """
     A periodic job as used by :class:`Scheduler`.
@@ -198,8 +549,12 @@ class Job(object):
         self.next_run = None  # datetime of the next run
         self.period = None  # timedelta between runs, only valid for
         self.start_day = None  # Specific day of the week to start on
+        self.month_day = None  # day of the month for monthly jobs, -1 = last
+        self.cron_expression = None  # CronExpression for cron jobs
+        self.planner = None  # callable picking the next run of planned jobs
         self.tags = set()  # unique set of tags for the job
         self.scheduler = scheduler  # scheduler to register with
+        self._entry = None  # current heap entry in the scheduler
 
     def __lt__(self, other):
         """
@@ -240,6 +595,17 @@ class Job(object):
                   for k, v in self.job_func.keywords.items()]
         call_repr = job_func_name + '(' + ', '.join(args + kwargs) + ')'
 
+        if self.cron_expression is not None:
+            return 'Cron "%s" do %s %s' % (
+                   self.cron_expression, call_repr, timestats)
+        if self.unit == 'planned':
+            return 'Planned do %s %s' % (call_repr, timestats)
+        if self.unit == 'months':
+            return 'Every %s %s on day %s at %s do %s %s' % (
+                   self.interval,
+                   self.unit[:-1] if self.interval == 1 else self.unit,
+                   'last' if self.month_day == -1 else self.month_day or 1,
+                   self.at_time or datetime.time(), call_repr, timestats)
         if self.at_time is not None:
             return 'Every %s %s at %s do %s %s' % (
                    self.interval,
@@ -364,6 +730,68 @@ class Job(object):
         self.start_day = 'sunday'
         return self.weeks
 
+    @property
+    def month(self):
+        if self.interval != 1:
+            raise IntervalError('Use months instead of month')
+        return self.months
+
+    @property
+    def months(self):
+        self.unit = 'months'
+        return self
+
+    def on(self, day):
+        """
+        Specify the day of the month a monthly job runs on.
+
+        Days past the end of a shorter month run on that month's last
+        day, so `on(31)` runs on the last day of every month.
+
+        :param day: The day of the month (1-31), or `'last'` / `-1`
+            for the last day of the month.
+        :return: The invoked job instance
+        """
+        if self.unit != 'months':
+            raise ScheduleValueError('on() is only valid for monthly jobs')
+        if day in ('last', -1):
+            self.month_day = -1
+        else:
+            day = int(day)
+            if not (1 <= day <= 31):
+                raise ScheduleValueError('Invalid day of the month')
+            self.month_day = day
+        return self
+
+    def cron(self, expression):
+        """
+        Schedule the job with a cron expression instead of a fixed
+        interval, see :class:`CronExpression`.
+
+        :param expression: A five field cron expression
+        :return: The invoked job instance
+        """
+        if self.interval != 1:
+            raise IntervalError('Cron jobs do not support an interval')
+        self.unit = 'cron'
+        self.cron_expression = CronExpression(expression)
+        return self
+
+    def planned(self, planner):
+        """
+        Let `planner` pick every run of the job instead of a fixed
+        interval, e.g. from what was learned about the system.
+
+        :param planner: A callable taking the :class:`~datetime.datetime`
+                        to schedule from and returning the next run
+        :return: The invoked job instance
+        """
+        if self.interval != 1:
+            raise IntervalError('Planned jobs do not support an interval')
+        self.unit = 'planned'
+        self.planner = planner
+        return self
+
     def tag(self, *tags):
         """
         Tags the job with one or more unique indentifiers.
@@ -390,12 +818,12 @@ class Job(object):
             (e.g. `every().hour.at(':30')` vs. `every().minute.at(':30')`).
         :return: The invoked job instance
         """
-        if (self.unit not in ('days', 'hours', 'minutes')
+        if (self.unit not in ('days', 'hours', 'minutes', 'months')
                 and not self.start_day):
             raise ScheduleValueError('Invalid unit')
         if not isinstance(time_str, str):
             raise TypeError('at() should be passed a string')
-        if self.unit == 'days' or self.start_day:
+        if self.unit in ('days', 'months') or self.start_day:
             if not re.match(r'^([0-2]\d:)?[0-5]\d:[0-5]\d$', time_str):
                 raise ScheduleValueError('Invalid time format')
         if self.unit == 'hours':
@@ -416,7 +844,7 @@ class Job(object):
         else:
             hour, minute = time_values
             second = 0
-        if self.unit == 'days' or self.start_day:
+        if self.unit in ('days', 'months') or self.start_day:
             hour = int(hour)
             if not (0 <= hour <= 23):
                 raise ScheduleValueError('Invalid number of hours')
@@ -465,7 +893,7 @@ class Job(object):
             # call will fail.
             pass
         self._schedule_next_run()
-        self.scheduler.jobs.append(self)
+        self.scheduler._add_job(self)
         return self
 
     @property
@@ -487,10 +915,60 @@ class Job(object):
         self._schedule_next_run()
         return ret
 
-    def _schedule_next_run(self):
+    def last_due(self, moment=None, horizon=datetime.timedelta(days=31)):
+        """
+        The latest time at or before `moment` this job was due to run,
+        looking back no further than `horizon`. Runs of planned jobs
+        can't be replayed, they are never due in the past.
+
+        :param moment: A :class:`~datetime.datetime`, defaults to now
+        :param horizon: A :class:`~datetime.timedelta`
+        :return: A :class:`~datetime.datetime` or ``None``
+        """
+        if self.unit == 'planned':
+            return None
+        moment = moment or datetime.datetime.now()
+        probe = Job(self.interval)
+        probe.__dict__.update(self.__dict__)
+        probe.scheduler = None
+        probe._entry = None
+        probe.last_run = None
+        probe._schedule_next_run(moment - horizon)
+        due = None
+        for _ in range(10000):
+            if probe.next_run > moment or (due and probe.next_run <= due):
+                break
+            due = probe.next_run
+            probe.last_run = due
+            # scheduling from the exact due time would yield it again
+            probe._schedule_next_run(due + datetime.timedelta(seconds=1))
+        return due
+
+    def _is_pinned(self):
+        """
+        Whether the runs of this job are fixed to the calendar rather
+        than following each other at an interval.
+        """
+        return (self.unit in ('cron', 'months')
+                or self.at_time is not None or self.start_day is not None)
+
+    def _schedule_next_run(self, now=None):
         """
         Compute the instant when this job should run next.
+
+        :param now: The :class:`~datetime.datetime` to schedule from,
+                    defaults to now
         """
+        now = now or datetime.datetime.now()
+        if self.unit == 'cron':
+            self.next_run = self.cron_expression.next_after(now)
+            return
+        if self.unit == 'planned':
+            self.next_run = self.planner(now)
+            return
+        if self.unit == 'months':
+            self.next_run = self._next_monthly_run(now)
+            return
         if self.unit not in ('seconds', 'minutes', 'hours', 'days', 'weeks'):
             raise ScheduleValueError('Invalid unit')
 
@@ -502,7 +980,7 @@ class Job(object):
             interval = self.interval
 
         self.period = datetime.timedelta(**{self.unit: interval})
-        self.next_run = datetime.datetime.now() + self.period
+        self.next_run = now + self.period
         if self.start_day is not None:
             if self.unit != 'weeks':
                 raise ScheduleValueError('`unit` should be \'weeks\'')
@@ -539,7 +1017,6 @@ class Job(object):
             # If we are running for the first time, make sure we run
             # at the specified time *today* (or *this hour*) as well
             if not self.last_run:
-                now = datetime.datetime.now()
                 if (self.unit == 'days' and self.at_time > now.time() and
                         self.interval == 1):
                     self.next_run = self.next_run - datetime.timedelta(days=1)
@@ -554,9 +1031,27 @@ class Job(object):
                                     datetime.timedelta(minutes=1)
         if self.start_day is not None and self.at_time is not None:
             # Let's see if we will still make that time we specified today
-            if (self.next_run - datetime.datetime.now()).days >= 7:
+            if (self.next_run - now).days >= 7:
                 self.next_run -= self.period
 
+    def _next_monthly_run(self, now):
+        """
+        The first run on the configured day of the month after `now`,
+        stepping `interval` months at a time.
+        """
+        at_time = self.at_time or datetime.time()
+        year, month = now.year, now.month
+        while True:
+            last_day = calendar.monthrange(year, month)[1]
+            day = self.month_day or 1
+            day = last_day if day == -1 else min(day, last_day)
+            candidate = datetime.datetime.combine(
+                datetime.date(year, month, day), at_time)
+            if candidate > now:
+                return candidate
+            month += self.interval
+            year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+
 
 # The following methods are shortcuts for not having to
 # create a Scheduler instance:
@@ -564,8 +1059,10 @@ class Job(object):
 #: Default :class:`Scheduler <Scheduler>` object
 default_scheduler = Scheduler()
 
-#: Default :class:`Jobs <Job>` list
-jobs = default_scheduler.jobs  # todo: should this be a copy, e.g. jobs()?
+
+#: The :attr:`jobs <Scheduler.jobs>` of the
+#: :data:`default scheduler instance <default_scheduler>`
+jobs = default_scheduler.jobs
 
 
 def every(interval=1):
@@ -0,0 +1,240 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import zipfile
+
+from .archive import get_entry_compression, open_for_writing
+
+# size of the reads when copying a changed file into a snapshot
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+class SnapshotStore(object):
+	"""
+	Hardlink snapshots, like ``rsync --link-dest``.
+
+	Every backup is a browsable folder laid out like an OctoPrint backup archive, with
+	``basedir/``, ``metadata.json`` and ``plugin_list.json``. Files whose size and mtime did
+	not change since the previous snapshot are hardlinked to it, only changed files are
+	copied, so a file takes up space until the last snapshot referencing it is deleted.
+
+	Snapshot folders are named after the backup without its ``.zip`` extension, the
+	backup plugin only lists archives. The store offers the same interface as
+	:class:`chunkstore.ChunkStore`, with a ``manifest.json`` in every snapshot recording
+	size, mtime, mode and SHA-256 of its files.
+	"""
+
+	def __init__(self, folder):
+		self._folder = folder
+		self._lock = threading.RLock()
+		if not os.path.isdir(folder):
+			os.makedirs(folder)
+
+	def snapshot_path(self, name):
+		return os.path.join(self._folder, name[:-4] if name.endswith(".zip") else name)
+
+	# ~~ manifests
+
+	def manifest_path(self, name):
+		return os.path.join(self.snapshot_path(name), "manifest.json")
+
+	def has_manifest(self, name):
+		return os.path.exists(self.manifest_path(name))
+
+	def list_manifests(self):
+		return sorted(folder + ".zip" for folder in os.listdir(self._folder) if not folder.endswith(".tmp")
+					  and os.path.exists(os.path.join(self._folder, folder, "manifest.json")))
+
+	def load_manifest(self, name):
+		with open(self.manifest_path(name), "r", encoding="utf-8") as f:
+			return json.load(f)
+
+	def _save_manifest(self, manifest):
+		path = self.manifest_path(manifest["name"])
+		with open(path + ".tmp", "w", encoding="utf-8") as f:
+			json.dump(manifest, f)
+		os.replace(path + ".tmp", path)
+
+	def latest_manifest(self):
+		names = self.list_manifests()
+		if not names:
+			return None
+		return self.load_manifest(max(names, key=lambda name: os.path.getmtime(self.manifest_path(name))))
+
+	def copy_manifest(self, name, target):
+		"""
+		Records snapshot `name` again as `target`, with every file hardlinked.
+		"""
+		with self._lock:
+			manifest = self.load_manifest(name)
+			source, folder = self.snapshot_path(name), self.snapshot_path(target)
+			for root, dirs, files in os.walk(source):
+				target_root = os.path.join(folder, os.path.relpath(root, source))
+				os.makedirs(target_root, exist_ok=True)
+				for filename in files:
+					if filename != "manifest.json":
+						_link_or_copy(os.path.join(root, filename), os.path.join(target_root, filename))
+			manifest["name"] = target
+			self._save_manifest(manifest)
+
+	def delete_manifest(self, name):
+		"""
+		Deletes snapshot `name`.
+
+		:return: the number of bytes freed, of files no other snapshot links to
+		"""
+		with self._lock:
+			folder = self.snapshot_path(name)
+			freed = 0
+			for root, dirs, files in os.walk(folder):
+				for filename in files:
+					try:
+						st = os.lstat(os.path.join(root, filename))
+					except OSError:
+						continue
+					if st.st_nlink == 1:
+						freed += st.st_size
+			shutil.rmtree(folder, ignore_errors=True)
+			return freed
+
+	# ~~ backups
+
+	def snapshot(self, name, files, metadata=None, previous=None, throttle=None):
+		"""
+		Records a new snapshot `name` from `files`, an iterable of ``(name, path)`` tuples,
+		linking unchanged files to snapshot `previous` (a manifest). Copies go through
+		`throttle` if given.
+
+		:return: statistics of the run - files, bytes, copied files/bytes and linked files
+		"""
+		metadata = metadata or {}
+		previous_files = previous["files"] if previous else {}
+		previous_folder = self.snapshot_path(previous["name"]) if previous else None
+		folder = self.snapshot_path(name)
+		stats = {"files": 0, "bytes": 0, "new_files": 0, "new_bytes": 0, "linked_files": 0}
+		entries = {}
+		with self._lock:
+			temp_folder = folder + ".tmp"
+			shutil.rmtree(temp_folder, ignore_errors=True)
+			os.makedirs(os.path.join(temp_folder, "basedir"))
+			for arcname, path in files:
+				try:
+					st = os.stat(path)
+				except OSError:
+					continue
+				target = os.path.join(temp_folder, "basedir", *arcname.split("/"))
+				os.makedirs(os.path.dirname(target), exist_ok=True)
+				entry = {"size": st.st_size, "mtime": st.st_mtime, "mode": st.st_mode & 0o7777}
+				known = previous_files.get(arcname)
+				if known and known["size"] == st.st_size and known["mtime"] == st.st_mtime and \
+						self._link(os.path.join(previous_folder, "basedir", *arcname.split("/")), target):
+					entry["sha256"] = known["sha256"]
+					stats["linked_files"] += 1
+				else:
+					entry["sha256"] = _copy_file(path, target, st, throttle)
+					entry["new"] = True
+					stats["new_files"] += 1
+					stats["new_bytes"] += st.st_size
+				entries[arcname] = entry
+				stats["files"] += 1
+				stats["bytes"] += st.st_size
+			with open(os.path.join(temp_folder, "metadata.json"), "w", encoding="utf-8") as f:
+				json.dump(metadata.get("backup", {}), f)
+			with open(os.path.join(temp_folder, "plugin_list.json"), "w", encoding="utf-8") as f:
+				json.dump(metadata.get("plugin_list", []), f)
+			with open(os.path.join(temp_folder, "manifest.json"), "w", encoding="utf-8") as f:
+				json.dump({"name": name, "created": time.time(), "metadata": metadata, "files": entries}, f)
+			shutil.rmtree(folder, ignore_errors=True)
+			os.rename(temp_folder, folder)
+		return stats
+
+	@staticmethod
+	def _link(source, target):
+		try:
+			os.link(source, target)
+			return True
+		except OSError:
+			# gone, or too many links to it already
+			return False
+
+	def verify(self, name, throttle=None):
+		"""
+		Checks that every file of snapshot `name` is there with its recorded size, and reads
+		back the files this snapshot copied to check their hash - linked files were checked
+		when they were copied. Reads go through `throttle` if given.
+
+		:return: ``{"entries", "bytes", "errors"}``, with a message for every problem found
+		"""
+		result = {"entries": 0, "bytes": 0, "errors": []}
+		folder = self.snapshot_path(name)
+		for arcname, entry in sorted(self.load_manifest(name)["files"].items()):
+			path = os.path.join(folder, "basedir", *arcname.split("/"))
+			try:
+				size = os.path.getsize(path)
+				if size != entry["size"]:
+					result["errors"].append(f"{arcname}: {size} bytes instead of {entry['size']}")
+				elif entry.get("new") and _file_digest(path, throttle) != entry["sha256"]:
+					result["errors"].append(f"{arcname}: differs from what was written")
+			except (IOError, OSError) as e:
+				result["errors"].append(f"{arcname}: {e}")
+				continue
+			result["entries"] += 1
+			result["bytes"] += size
+		return result
+
+	def export(self, name, target_path, strategy="deflate"):
+		"""
+		Writes snapshot `name` as an OctoPrint backup archive to `target_path`, compressed
+		according to `strategy` (see :func:`archive.get_entry_compression`).
+		"""
+		folder = self.snapshot_path(name)
+		manifest = self.load_manifest(name)
+		temp_path = target_path + ".tmp"
+		with zipfile.ZipFile(temp_path, mode="w", compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zip_file:
+			for arcname, entry in sorted(manifest["files"].items()):
+				info = zipfile.ZipInfo("basedir/" + arcname, date_time=time.localtime(max(entry["mtime"], 315532800))[:6])
+				info.external_attr = (0o100000 | entry["mode"]) << 16
+				info.compress_type, level = get_entry_compression(arcname, strategy)
+				# ZipFile.open() has no compresslevel argument, it takes the level from the entry
+				info._compresslevel = level
+				with open(os.path.join(folder, "basedir", *arcname.split("/")), "rb") as f, \
+						zip_file.open(info, mode="w", force_zip64=entry["size"] > 0x7fffffff) as target:
+					shutil.copyfileobj(f, target)
+			for filename in ("metadata.json", "plugin_list.json"):
+				zip_file.write(os.path.join(folder, filename), arcname=filename)
+		os.replace(temp_path, target_path)
+
+
+def _copy_file(path, target, st, throttle=None):
+	# copies with the source's mode and mtime, returning the SHA-256 of what was copied
+	digest = hashlib.sha256()
+	with open(path, "rb") as source, open_for_writing(target, throttle) as f:
+		for data in iter(lambda: source.read(COPY_BUFFER_SIZE), b""):
+			digest.update(data)
+			f.write(data)
+	os.chmod(target, st.st_mode & 0o7777)
+	os.utime(target, ns=(st.st_atime_ns, st.st_mtime_ns))
+	return digest.hexdigest()
+
+
+def _link_or_copy(source, target):
+	try:
+		os.link(source, target)
+	except OSError:
+		shutil.copy2(source, target)
+
+
+def _file_digest(path, throttle=None):
+	digest = hashlib.sha256()
+	with open(path, "rb") as f:
+		for data in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+			if throttle is not None:
+				throttle.consume(len(data))
+			digest.update(data)
+	return digest.hexdigest()
@@ -0,0 +1,100 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import copy
+import json
+import os
+import threading
+
+# how long to wait for further changes before writing them, in seconds
+DEBOUNCE_DELAY = 1.0
+
+
+class DebouncedWriter(object):
+	"""
+	Coalesces write requests: `write` is called once, `delay` seconds after the first request
+	since the last write, or right away on :meth:`flush`. `write` gets ``True`` if any of the
+	coalesced requests asked for it by passing ``flag=True``.
+	"""
+
+	def __init__(self, write, delay=DEBOUNCE_DELAY):
+		self._write = write
+		self._delay = delay
+		self._lock = threading.Lock()
+		self._requested = False
+		self._flag = False
+		self._timer = None
+
+	def request(self, flag=False):
+		with self._lock:
+			self._requested = True
+			self._flag = self._flag or flag
+			if self._timer is None:
+				self._timer = threading.Timer(self._delay, self.flush)
+				self._timer.daemon = True
+				self._timer.start()
+
+	def flush(self):
+		with self._lock:
+			requested, flag = self._requested, self._flag
+			self._requested = self._flag = False
+			if self._timer is not None:
+				self._timer.cancel()
+				self._timer = None
+		if requested:
+			self._write(flag)
+
+
+class PluginState(object):
+	"""
+	Runtime state of the plugin, like the lists of retained backups, kept in a JSON file of its
+	own instead of ``config.yaml``. Changes are written after a short debounce or on
+	:meth:`flush`.
+
+	:meth:`get` returns a copy, changes only take effect through :meth:`set` or :meth:`update`.
+	"""
+
+	def __init__(self, path, delay=DEBOUNCE_DELAY):
+		self._path = path
+		self._lock = threading.RLock()
+		self._data = self._load()
+		self._writer = DebouncedWriter(lambda flag: self._save(), delay)
+
+	def _load(self):
+		try:
+			with open(self._path, "r", encoding="utf-8") as f:
+				return dict(json.load(f))
+		except (IOError, OSError, ValueError):
+			return {}
+
+	def _save(self):
+		with self._lock:
+			with open(self._path + ".tmp", "w", encoding="utf-8") as f:
+				json.dump(self._data, f)
+			os.replace(self._path + ".tmp", self._path)
+
+	def __contains__(self, key):
+		return key in self._data
+
+	def get(self, key, default=None):
+		with self._lock:
+			return copy.deepcopy(self._data.get(key, default))
+
+	def set(self, key, value):
+		with self._lock:
+			self._data[key] = value
+		self._writer.request()
+
+	def update(self, key, fn, default=None):
+		"""
+		Replaces the value of `key` with what `fn` returns for (a copy of) it, without another
+		thread changing it in between. Returns the new value.
+		"""
+		with self._lock:
+			value = fn(copy.deepcopy(self._data.get(key, default)))
+			self._data[key] = value
+		self._writer.request()
+		return copy.deepcopy(value)
+
+	def flush(self):
+		self._writer.flush()
@@ -11,6 +11,12 @@ $(function () {
         self.settingsViewModel = parameters[0];
         self.sendTestEmailRunning = ko.observable(false);
         self.sendTestEmailSuccess = ko.observable(false);
+        self.nextRuns = {
+            daily_backups: ko.observable(""),
+            weekly_backups: ko.observable(""),
+            monthly_backups: ko.observable("")
+        };
+        self.incrementalBackups = ko.observableArray([]);
 
         // Hack to remove automatically added Cancel button
 		// See https://github.com/sciactive/pnotify/issues/141
@@ -24,6 +30,35 @@ $(function () {
             }
         };
 
+        self.requestStatus = function () {
+            OctoPrint.simpleApiGet("backupscheduler").done(function (data) {
+                _.each(self.nextRuns, function (observable, backup_type) {
+                    var next_run = data.next_runs[backup_type];
+                    observable(next_run ? new Date(next_run).toLocaleString() : "");
+                });
+                self.incrementalBackups(data.incremental_backups.slice().reverse());
+            });
+        };
+
+        // write an incremental backup to the backup folder as a regular backup archive
+        self.exportBackup = function (name) {
+            OctoPrint.simpleApiCommand("backupscheduler", "exportBackup", {"name": name}).done(function () {
+                new PNotify({
+                    title: "Backup Scheduler",
+                    text: _.sprintf(gettext("Exporting %(name)s, it will show up in the backup list once done."), {name: name}),
+                    type: "info"
+                });
+            });
+        };
+
+        self.onSettingsShown = function () {
+            self.requestStatus();
+        };
+
+        self.onSettingsAfterSave = function () {
+            self.requestStatus();
+        };
+
         self.onSettingsBeforeSave = function () {
             if (!self.settingsViewModel.settings.plugins.backupscheduler.daily.time().match(/([01]?[0-9]|2[0-3]):[0-5][0-9]/)) {
                 self.settingsViewModel.settings.plugins.backupscheduler.daily.time('00:00');
@@ -0,0 +1,131 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import time
+
+# files modified in place don't touch their folder's mtime, all of them are stat'ed again this often
+RESCAN_INTERVAL = 24 * 3600
+
+
+class StatIndex(object):
+	"""
+	The sizes of all files below a folder, kept up to date without walking the whole tree
+	again for every backup.
+
+	A folder is only listed again when its mtime changed, which happens whenever a file in it
+	is created, deleted or renamed - including files saved atomically through a temporary
+	file. Files in unchanged folders keep their recorded size, a full rescan every
+	`rescan_interval` seconds catches files that were modified in place. The index is
+	persisted to the JSON file `path`.
+	"""
+
+	def __init__(self, path, rescan_interval=RESCAN_INTERVAL):
+		self._path = path
+		self._rescan_interval = rescan_interval
+		self._folders = {}
+		self._rescanned = 0
+		try:
+			with open(path, "r", encoding="utf-8") as f:
+				data = json.load(f)
+			self._folders = data["folders"]
+			self._rescanned = data["rescanned"]
+		except (IOError, OSError, ValueError, KeyError):
+			pass
+
+	def _save(self):
+		with open(self._path + ".tmp", "w", encoding="utf-8") as f:
+			json.dump({"folders": self._folders, "rescanned": self._rescanned}, f)
+		os.replace(self._path + ".tmp", self._path)
+
+	def refresh(self, root, skip=()):
+		"""
+		Brings the index of `root` up to date, leaving out the folders in `skip` (real paths).
+		Like ``os.walk``, symlinked folders are not descended into.
+
+		:return: statistics of the run - folders, folders listed again and files indexed
+		"""
+		root = os.path.realpath(root)
+		skip = set(skip)
+		rescan = time.time() - self._rescanned >= self._rescan_interval
+		stats = {"folders": 0, "listed": 0, "files": 0}
+		folders = {}
+		stack = [root]
+		while stack:
+			path = stack.pop()
+			try:
+				mtime = os.stat(path).st_mtime
+			except OSError:
+				continue
+			entry = self._folders.get(path)
+			if rescan or entry is None or entry["mtime"] != mtime:
+				entry = self._list(path, mtime)
+				if entry is None:
+					continue
+				stats["listed"] += 1
+			folders[path] = entry
+			stats["folders"] += 1
+			stats["files"] += len(entry["files"])
+			stack.extend(os.path.join(path, name) for name in entry["folders"]
+						 if os.path.join(path, name) not in skip)
+		# folders elsewhere are kept, they may belong to another root
+		self._folders = dict((path, entry) for path, entry in self._folders.items()
+							 if not is_below(path, root))
+		self._folders.update(folders)
+		if rescan:
+			self._rescanned = time.time()
+		self._save()
+		return stats
+
+	@staticmethod
+	def _list(path, mtime):
+		entry = {"mtime": mtime, "files": {}, "folders": []}
+		try:
+			with os.scandir(path) as it:
+				for item in it:
+					try:
+						if item.is_dir():
+							if not item.is_symlink():
+								entry["folders"].append(item.name)
+						elif item.is_file():
+							entry["files"][item.name] = item.stat().st_size
+					except OSError:
+						continue
+		except OSError:
+			return None
+		return entry
+
+	def size(self, root, excluded_paths=()):
+		"""
+		The total size of the indexed files below `root`, leaving out the files and folders in
+		`excluded_paths` (real paths).
+		"""
+		root = os.path.realpath(root)
+		excluded = set(excluded_paths)
+		total = 0
+		stack = [root]
+		while stack:
+			path = stack.pop()
+			entry = self._folders.get(path)
+			if entry is None or path in excluded:
+				continue
+			total += sum(size for name, size in entry["files"].items()
+						 if os.path.join(path, name) not in excluded)
+			stack.extend(os.path.join(path, name) for name in entry["folders"])
+		return total
+
+
+def get_free_space(path):
+	"""
+	The free space of the file system `path` is on, of its closest existing parent if `path`
+	doesn't exist yet.
+	"""
+	while not os.path.exists(path) and os.path.dirname(path) != path:
+		path = os.path.dirname(path)
+	return shutil.disk_usage(path).free
+
+
+def is_below(path, root):
+	return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
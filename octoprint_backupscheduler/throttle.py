@@ -0,0 +1,126 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import logging
+import os
+import sys
+import threading
+import time
+
+# niceness for low impact backups, on Linux this also lowers the I/O priority of the
+# thread as long as no explicit I/O class was set for it
+LOW_PRIORITY = 19
+
+
+class IOThrottle(object):
+	"""
+	Limits the write bandwidth of a backup to `rate` bytes per second (0 = unlimited) and
+	allows pausing it altogether, e.g. while a print is running. `on_pause` and `on_resume` are
+	called on the writing thread when it stops at and continues after a pause.
+	"""
+
+	def __init__(self, rate=0):
+		self._rate = rate
+		self._resumed = threading.Event()
+		self._resumed.set()
+		self._lock = threading.Lock()
+		self._allowance = 0.0
+		self._last = time.monotonic()
+		self.on_pause = None
+		self.on_resume = None
+
+	@property
+	def rate(self):
+		return self._rate
+
+	@rate.setter
+	def rate(self, rate):
+		with self._lock:
+			self._rate = rate
+			self._allowance = 0.0
+
+	@property
+	def paused(self):
+		return not self._resumed.is_set()
+
+	def pause(self):
+		self._resumed.clear()
+
+	def resume(self):
+		self._resumed.set()
+
+	def consume(self, size):
+		"""
+		Blocks until `size` more bytes may be written.
+		"""
+		if not self._resumed.is_set():
+			if self.on_pause is not None:
+				self.on_pause()
+			self._resumed.wait()
+			if self.on_resume is not None:
+				self.on_resume()
+		with self._lock:
+			now = time.monotonic()
+			if not self._rate:
+				self._last = now
+				return
+			# token bucket holding at most one second worth of writes
+			self._allowance = min(self._rate, self._allowance + (now - self._last) * self._rate) - size
+			self._last = now
+			delay = -self._allowance / self._rate if self._allowance < 0 else 0
+		if delay > 0:
+			time.sleep(delay)
+
+
+class ThrottledFile(object):
+	"""
+	Wraps a writable file object so that every write goes through an :class:`IOThrottle`.
+	"""
+
+	def __init__(self, fileobj, throttle):
+		self._fileobj = fileobj
+		self._throttle = throttle
+
+	def write(self, data):
+		self._throttle.consume(len(data))
+		return self._fileobj.write(data)
+
+	def __getattr__(self, name):
+		return getattr(self._fileobj, name)
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self._fileobj.close()
+
+
+def run_at_low_priority(func, *args, **kwargs):
+	"""
+	Runs `func` on a separate thread with the lowest CPU (and thereby I/O) priority and waits for
+	its result. A thread of its own is used because an unprivileged process can't raise the
+	priority again afterwards.
+	"""
+	result = {}
+
+	def target():
+		try:
+			if not sys.platform.startswith("linux"):
+				# only Linux applies process priorities to thread ids
+				raise OSError("unsupported platform {}".format(sys.platform))
+			os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), LOW_PRIORITY)
+		except (AttributeError, OSError) as e:
+			# not supported on this platform, run at normal priority
+			logging.getLogger(__name__).debug("Could not lower thread priority: {}".format(e))
+		try:
+			result["value"] = func(*args, **kwargs)
+		except BaseException as e:
+			result["error"] = e
+
+	thread = threading.Thread(target=target, name="BackupSchedulerLowPriority")
+	thread.daemon = True
+	thread.start()
+	thread.join()
+	if "error" in result:
+		raise result["error"]
+	return result.get("value")
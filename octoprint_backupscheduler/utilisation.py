@@ -0,0 +1,139 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import math
+import threading
+from datetime import datetime, timedelta
+
+# one slot per hour of the week, monday 00:00 first
+SLOTS = 7 * 24
+
+# weight of the latest hour in its slot, every slot is updated once a week so about the last month counts
+DECAY = 0.25
+
+# hours further apart are not observed, e.g. because OctoPrint was off
+MAX_GAP = timedelta(days=7)
+
+# expected idle time is not looked at beyond this many hours
+IDLE_HORIZON = 24
+
+
+def slot_of(moment):
+	return moment.weekday() * 24 + moment.hour
+
+
+class UtilisationHistogram(object):
+	"""
+	How busy the printer is by weekday and hour: an exponentially decaying average of the
+	share of every hour of the week spent printing, in a fixed number of slots however long
+	it has been recording.
+
+	Print events are fed to :meth:`print_started` and :meth:`print_ended`, hours are
+	committed to their slot lazily when the next event or query comes in. The hours before
+	the histogram was created are not observed, so time OctoPrint was off doesn't count as
+	idle. `data` is what :meth:`to_dict` returned.
+	"""
+
+	def __init__(self, data=None, now=None):
+		data = data or {}
+		self.busy = list(data.get("busy") or [0.0] * SLOTS)
+		self.samples = list(data.get("samples") or [0] * SLOTS)
+		self._lock = threading.Lock()
+		self._hour = self._hour_of(now or datetime.now())
+		self._observed_from = now or datetime.now()
+		self._busy_seconds = 0.0
+		self._printing_since = None
+
+	@staticmethod
+	def _hour_of(moment):
+		return moment.replace(minute=0, second=0, microsecond=0)
+
+	def to_dict(self):
+		with self._lock:
+			return {"busy": list(self.busy), "samples": list(self.samples)}
+
+	def print_started(self, now=None):
+		with self._lock:
+			now = now or datetime.now()
+			self._advance(now)
+			if self._printing_since is None:
+				self._printing_since = now
+
+	def print_ended(self, now=None):
+		with self._lock:
+			now = now or datetime.now()
+			self._advance(now)
+			if self._printing_since is not None:
+				self._busy_seconds += (now - self._printing_since).total_seconds()
+				self._printing_since = None
+
+	def update(self, now=None):
+		"""
+		Commits the hours that passed since the last event.
+
+		:return: whether any slot changed
+		"""
+		with self._lock:
+			return self._advance(now or datetime.now())
+
+	def _advance(self, now):
+		if now - self._hour > MAX_GAP or now < self._hour:
+			# not observed or the clock jumped, start over from here
+			self._hour = self._hour_of(now)
+			self._observed_from = now
+			self._busy_seconds = 0.0
+			if self._printing_since is not None:
+				self._printing_since = now
+			return False
+		changed = False
+		while now >= self._hour + timedelta(hours=1):
+			end = self._hour + timedelta(hours=1)
+			if self._printing_since is not None:
+				self._busy_seconds += (end - max(self._printing_since, self._hour)).total_seconds()
+				self._printing_since = end
+			observed = (end - max(self._observed_from, self._hour)).total_seconds()
+			if observed > 0:
+				slot = slot_of(self._hour)
+				self.busy[slot] += DECAY * (min(1.0, self._busy_seconds / observed) - self.busy[slot])
+				self.samples[slot] += 1
+				changed = True
+			self._hour = end
+			self._busy_seconds = 0.0
+		return changed
+
+	def idle_probability(self, moment):
+		return 1.0 - self.busy[slot_of(moment)]
+
+	def expected_idle_hours(self, moment):
+		"""
+		How long the printer is expected to stay idle from the hour of `moment` on, taking the
+		hours as independent.
+		"""
+		expected, p = 0.0, 1.0
+		for hour in range(IDLE_HORIZON):
+			p *= self.idle_probability(moment + timedelta(hours=hour))
+			expected += p
+		return expected
+
+	def best_slot(self, candidates, duration, preferred=None):
+		"""
+		Picks the hour from `candidates` (datetimes) that is most likely idle for the `duration`
+		(seconds) of a backup. Hours expected to stay idle long enough come first, ties go to
+		the candidate closest to `preferred` (a :class:`datetime.time`), then the earliest.
+		"""
+		hours = max(1, int(math.ceil(duration / 3600.0)))
+
+		def score(candidate):
+			p = 1.0
+			for hour in range(hours):
+				p *= self.idle_probability(candidate + timedelta(hours=hour))
+			long_enough = self.expected_idle_hours(candidate) * 3600 >= duration
+			distance = 0
+			if preferred is not None:
+				minutes = abs(candidate.hour * 60 + candidate.minute - preferred.hour * 60 - preferred.minute)
+				distance = min(minutes, 24 * 60 - minutes)
+			# rounded so that hours with the same history tie
+			return not long_enough, -round(p, 3), distance, candidate
+
+		with self._lock:
+			return min(candidates, key=score) if candidates else None
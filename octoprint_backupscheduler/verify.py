@@ -0,0 +1,54 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import zipfile
+import zlib
+
+# size of the reads when streaming an archive, memory use doesn't depend on the archive size
+VERIFY_BUFFER_SIZE = 1024 * 1024
+
+
+def verify_archive(path, manifest=None, buffer_size=VERIFY_BUFFER_SIZE, throttle=None):
+	"""
+	Reads every entry of the zip archive at `path` with a fixed size buffer and checks its
+	CRC, against the archive's own central directory and, if given, against `manifest`
+	(``{name: [size, crc]}`` as recorded when the archive was written, or with a `crc` of
+	None to only check the size). Reads go through `throttle` if given.
+
+	:return: ``{"entries", "bytes", "errors"}``, with a message for every problem found
+	"""
+	result = {"entries": 0, "bytes": 0, "errors": []}
+	expected = dict(manifest or {})
+	try:
+		with zipfile.ZipFile(path) as zip_file:
+			for info in zip_file.infolist():
+				if info.is_dir():
+					continue
+				crc, size = 0, 0
+				try:
+					# ZipExtFile checks the CRC of the central directory itself once it reaches the end
+					with zip_file.open(info) as f:
+						for data in iter(lambda: f.read(buffer_size), b""):
+							if throttle is not None:
+								throttle.consume(len(data))
+							crc = zlib.crc32(data, crc)
+							size += len(data)
+				except (zipfile.BadZipFile, zlib.error, EOFError, OSError) as e:
+					result["errors"].append(f"{info.filename}: {e}")
+					expected.pop(info.filename, None)
+					continue
+				result["entries"] += 1
+				result["bytes"] += size
+				if info.filename not in expected:
+					continue
+				expected_size, expected_crc = expected.pop(info.filename)
+				if expected_crc is None and size != expected_size:
+					result["errors"].append(f"{info.filename}: {size} of {expected_size} bytes")
+				elif expected_crc is not None and [size, crc] != [expected_size, expected_crc]:
+					result["errors"].append(f"{info.filename}: differs from what was written")
+	except (zipfile.BadZipFile, OSError) as e:
+		result["errors"].append(str(e))
+		return result
+	if manifest:
+		result["errors"].extend(f"{name}: missing" for name in sorted(expected))
+	return result
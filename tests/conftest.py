@@ -0,0 +1,100 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import datetime
+import os
+import types
+
+import pytest
+
+
+class FakeClock(object):
+	"""
+	A wall and a monotonic clock that only move when told to.
+	"""
+
+	def __init__(self, now):
+		self.wall = now
+		self.mono = 1000.0
+
+	def now(self):
+		return self.wall
+
+	def time(self):
+		return self.wall.timestamp()
+
+	def monotonic(self):
+		return self.mono
+
+	def advance(self, seconds, wall=None):
+		"""
+		Moves both clocks `seconds` ahead, the wall clock `wall` seconds instead if given.
+		"""
+		self.mono += seconds
+		self.wall += datetime.timedelta(seconds=seconds if wall is None else wall)
+
+	def sleep(self, seconds):
+		self.advance(seconds)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+	"""
+	The clock of the scheduler and the plugin, starting on 2026-10-18 at 23:00.
+	"""
+	import octoprint_backupscheduler
+	from octoprint_backupscheduler import schedule
+
+	clock = FakeClock(datetime.datetime(2026, 10, 18, 23, 0))
+
+	class FakeDatetime(datetime.datetime):
+
+		@classmethod
+		def now(cls, tz=None):
+			return clock.now()
+
+	monkeypatch.setattr(schedule, "datetime", types.SimpleNamespace(
+		datetime=FakeDatetime, date=datetime.date, time=datetime.time, timedelta=datetime.timedelta))
+	monkeypatch.setattr(schedule, "time", types.SimpleNamespace(time=clock.time, monotonic=clock.monotonic))
+	monkeypatch.setattr(octoprint_backupscheduler, "datetime", FakeDatetime)
+	monkeypatch.setattr(octoprint_backupscheduler, "time", clock.time)
+	return clock
+
+
+@pytest.fixture
+def stop_after_test():
+	"""
+	Takes callables that stop what a test started, like the workers of the objects a factory
+	fixture created, and calls them after the test, the last one first.
+	"""
+	stops = []
+	yield stops.append
+	for stop in reversed(stops):
+		stop()
+
+
+def stop_plugin_workers(plugin):
+	plugin._mail_outbox.stop()
+	plugin._replicator.stop()
+	if plugin._coordinator is not None:
+		plugin._coordinator.stop()
+
+
+@pytest.fixture
+def create_plugin(tmp_path, stop_after_test):
+	"""
+	Creates plugin instances wired up to the benchmark fakes, each with a small base folder of
+	its own below `tmp_path`, and shuts their workers down after the test.
+	"""
+	from benchmarks.datafolder import DataFolderSpec, generate_basedir
+	from benchmarks.fakes import create_plugin as create
+
+	def factory(name="octoprint", overrides=None, printing=False):
+		basedir = str(tmp_path / name)
+		generate_basedir(basedir, DataFolderSpec(uploads=2, upload_size=64 * 1024, timelapses=0, plugins=2,
+												 plugin_files=2, plugin_file_size=1024))
+		plugin = create(basedir, os.path.join(basedir, "data", "backupscheduler"), overrides, printing)
+		stop_after_test(lambda: stop_plugin_workers(plugin))
+		return plugin
+
+	return factory
@@ -0,0 +1,139 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import os
+import time
+import zipfile
+
+import pytest
+
+pytest.importorskip("octoprint")
+
+
+@pytest.fixture
+def plugin(tmp_path, create_plugin, monkeypatch):
+	"""
+	A plugin building its own daily archives, with the uploads folder moved out of the base
+	folder and a second plugin's backup hooks registered.
+	"""
+	plugin = create_plugin(overrides={"daily.enabled": True, "daily.compression": "store"})
+	uploads = str(tmp_path / "elsewhere" / "uploads")
+	os.makedirs(uploads)
+	with open(os.path.join(uploads, "moved.gcode"), "w") as f:
+		f.write("G28\n")
+	base_folder = plugin._settings.getBaseFolder
+	monkeypatch.setattr(plugin._settings, "getBaseFolder",
+						lambda name: uploads if name == "uploads" else base_folder(name))
+	os.makedirs(plugin._get_backup_folder(), exist_ok=True)
+
+	plugin.hook_calls = []
+	hooks = {
+		"octoprint.plugin.backup.before_backup": {"other": lambda: plugin.hook_calls.append("before")},
+		"octoprint.plugin.backup.after_backup": {"other": lambda error: plugin.hook_calls.append(("after", error)),
+												 "backupscheduler": plugin.after_backup},
+	}
+	get_hooks = plugin._plugin_manager.get_hooks
+	monkeypatch.setattr(plugin._plugin_manager, "get_hooks", lambda name: hooks.get(name) or get_hooks(name))
+	return plugin
+
+
+def archive_names(plugin):
+	names = []
+	for filename in os.listdir(plugin._get_backup_folder()):
+		with zipfile.ZipFile(os.path.join(plugin._get_backup_folder(), filename)) as zip_file:
+			names += zip_file.namelist()
+	return names
+
+
+def test_archive_includes_folders_outside_basedir(plugin):
+	plugin._perform_backup(["daily_backups"])
+	plugin._maintenance_executor.submit(lambda: None).result()
+	assert "basedir/uploads/moved.gcode" in archive_names(plugin)
+
+
+def test_backup_hooks_are_called(plugin):
+	plugin._perform_backup(["daily_backups"])
+	assert plugin.hook_calls == ["before", ("after", False)]
+
+
+def test_backup_hooks_learn_about_failures(plugin, monkeypatch):
+	def fail(*args, **kwargs):
+		raise OSError("disk on fire")
+
+	monkeypatch.setattr(plugin, "_run_archiver", fail)
+	plugin._perform_backup(["daily_backups"])
+	assert plugin.hook_calls == ["before", ("after", True)]
+
+
+# ~~ backups created by the backup plugin
+
+
+@pytest.fixture
+def full_plugin(create_plugin, monkeypatch):
+	plugin = create_plugin(overrides={"backup_timeout": 120})
+	plugin.failure_notifications = []
+	monkeypatch.setattr(plugin, "_notify_backup_failed", lambda: plugin.failure_notifications.append(True))
+	return plugin
+
+
+def test_backup_failing_to_start_isnt_waited_for(full_plugin):
+	def create_backup(exclude=None, filename=None):
+		# like the backup plugin running out of space, after_backup isn't called
+		full_plugin._plugin_manager.send_plugin_message("backup", {"type": "backup_error", "name": filename,
+																	"error": "Not enough free disk space"})
+
+	full_plugin.backup_helpers["create_backup"] = create_backup
+	started = time.monotonic()
+	assert full_plugin._create_full_backup("scheduled.zip", []) is None
+	assert time.monotonic() - started < 5
+	assert full_plugin.failure_notifications == [True]
+
+
+def test_unrelated_failed_backup_doesnt_fail_scheduled_one(full_plugin):
+	create_backup = full_plugin.backup_helpers["create_backup"]
+
+	def create_backups(exclude=None, filename=None):
+		# a backup started from the UI fails while the scheduled one is created
+		full_plugin.after_backup(True)
+		full_plugin._plugin_manager.send_plugin_message("backup", {"type": "backup_error", "name": "manual.zip"})
+		create_backup(exclude=exclude, filename=filename)
+
+	full_plugin.backup_helpers["create_backup"] = create_backups
+	assert full_plugin._create_full_backup("scheduled.zip", []) is not None
+
+
+def test_unreplicated_backups_are_reported(tmp_path, create_plugin, monkeypatch):
+	plugin = create_plugin(overrides={"daily.enabled": True, "backup_mode": "incremental", "replication.enabled": True,
+									  "replication.local.folder": str(tmp_path / "replica")})
+	notified = []
+	monkeypatch.setattr(plugin, "_notify_not_replicated", notified.append)
+	plugin._perform_backup(["daily_backups"])
+	assert [len(names) for names in notified] == [1]
+
+
+def test_full_backup_is_verified_against_the_files_backed_up(create_plugin, monkeypatch):
+	plugin = create_plugin(overrides={"daily.enabled": True, "verify_backups": True})
+	with open(os.path.join(plugin._settings.getBaseFolder("uploads"), "part.gcode"), "w") as f:
+		f.write("G1 X10\n" * 1024)
+	create_backup = plugin.backup_helpers["create_backup"]
+	corrupt = []
+	monkeypatch.setattr(plugin, "_notify_backup_corrupt", lambda name, errors: corrupt.append(errors))
+
+	def create_truncated_backup(exclude=None, filename=None):
+		create_backup(exclude=exclude, filename=filename)
+		# an archive that reads back fine, but lost half of a file
+		path = os.path.join(plugin._get_backup_folder(), filename)
+		with zipfile.ZipFile(path) as zip_file:
+			entries = [(info.filename, zip_file.read(info)) for info in zip_file.infolist()]
+		with zipfile.ZipFile(path, "w") as zip_file:
+			for name, data in entries:
+				zip_file.writestr(name, data[:len(data) // 2] if name == "basedir/uploads/part.gcode" else data)
+
+	plugin._perform_backup(["daily_backups"])
+	plugin._maintenance_executor.submit(lambda: None).result()
+	assert corrupt == []
+
+	plugin.backup_helpers["create_backup"] = create_truncated_backup
+	plugin._perform_backup(["daily_backups"])
+	plugin._maintenance_executor.submit(lambda: None).result()
+	assert corrupt == [["basedir/uploads/part.gcode: 3584 of 7168 bytes"]]
@@ -0,0 +1,268 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("octoprint")
+
+from octoprint_backupscheduler import coordination  # noqa: E402
+from octoprint_backupscheduler.coordination import HostCoordinator  # noqa: E402
+from octoprint_backupscheduler.pending import PendingQueue, PendingWorker  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not coordination.SUPPORTED, reason="needs flock")
+
+# where the clock of a test starts, long after the start of the last backup of a fresh host
+START = 1000000.0
+
+
+class SteppedClock(object):
+	"""
+	A clock shared by several threads that only moves when the test advances it. Sleeping
+	threads wake up once it reached the end of their sleep.
+	"""
+
+	def __init__(self):
+		self.now = START
+		self._cond = threading.Condition()
+		self._sleepers = {}
+
+	def time(self):
+		with self._cond:
+			return self.now
+
+	def sleep(self, seconds):
+		with self._cond:
+			self._sleepers[threading.get_ident()] = self.now + seconds
+			self._cond.notify_all()
+			while self.now < self._sleepers[threading.get_ident()]:
+				self._cond.wait()
+			del self._sleepers[threading.get_ident()]
+
+	def settle(self, threads):
+		"""
+		Waits until each of `threads` finished or sleeps until after the current time.
+		"""
+		deadline = time.monotonic() + 5
+		with self._cond:
+			while not all(not thread.is_alive() or self._sleepers.get(thread.ident, self.now) > self.now
+						  for thread in threads):
+				assert time.monotonic() < deadline, "threads didn't settle"
+				self._cond.wait(0.01)
+
+	def advance(self, seconds, threads=()):
+		with self._cond:
+			self.now += seconds
+			self._cond.notify_all()
+		self.settle(threads)
+
+
+class Contender(threading.Thread):
+	"""
+	Waits for a backup slot of `coordinator` on a thread of its own.
+	"""
+
+	def __init__(self, coordinator, clock, timeout=None, started=None):
+		threading.Thread.__init__(self, name=coordinator.member)
+		self.daemon = True
+		self.coordinator = coordinator
+		self.clock = clock
+		self.timeout = timeout
+		self.started = started if started is not None else []
+		self.slot = None
+
+	def run(self):
+		self.slot = self.coordinator.acquire(timeout=self.timeout)
+		if self.slot is not None:
+			self.started.append((self.coordinator.member, self.clock.time() - START))
+
+	def start(self):
+		threading.Thread.start(self)
+		self.clock.settle([self])
+		return self
+
+
+@pytest.fixture
+def stepped_clock():
+	return SteppedClock()
+
+
+@pytest.fixture
+def create_coordinator(tmp_path, stepped_clock, stop_after_test):
+	def factory(member, max_concurrent=1, stagger=0):
+		coordinator = HostCoordinator(str(tmp_path / "coordination"), member, max_concurrent=max_concurrent,
+									  stagger=stagger, clock=stepped_clock.time, sleep=stepped_clock.sleep)
+		stop_after_test(coordinator.stop)
+		return coordinator
+
+	return factory
+
+
+def waiting(coordinator):
+	return sorted(coordinator._load_state().get("waiting", {}))
+
+
+def test_waiting_instances_go_in_order(stepped_clock, create_coordinator):
+	a, b, c = create_coordinator("a"), create_coordinator("b"), create_coordinator("c")
+	slot = a.acquire()
+	started = []
+	b_waits = Contender(b, stepped_clock, started=started).start()
+	stepped_clock.advance(1, [b_waits])
+	c_waits = Contender(c, stepped_clock, started=started).start()
+	assert waiting(a) == ["b", "c"]
+
+	a.release(slot)
+	stepped_clock.advance(coordination.POLL_INTERVAL, [b_waits, c_waits])
+	assert started == [("b", 1 + coordination.POLL_INTERVAL)]
+	assert c_waits.is_alive()
+
+	b.release(b_waits.slot)
+	stepped_clock.advance(coordination.POLL_INTERVAL, [c_waits])
+	assert [member for member, _ in started] == ["b", "c"]
+	c.release(c_waits.slot)
+	assert waiting(a) == []
+
+
+def test_backups_start_stagger_apart(stepped_clock, create_coordinator):
+	a, b = create_coordinator("a", stagger=60), create_coordinator("b", stagger=60)
+	a.release(a.acquire())
+	b_waits = Contender(b, stepped_clock).start()
+	while b_waits.is_alive():
+		stepped_clock.advance(coordination.POLL_INTERVAL, [b_waits])
+	assert b_waits.started == [("b", 60)]
+	b.release(b_waits.slot)
+
+
+def test_max_concurrent_backups(stepped_clock, create_coordinator):
+	a, b, c = [create_coordinator(member, max_concurrent=2) for member in "abc"]
+	slots = [a.acquire(timeout=0), b.acquire(timeout=0)]
+	assert None not in slots
+	c_waits = Contender(c, stepped_clock).start()
+	stepped_clock.advance(coordination.POLL_INTERVAL, [c_waits])
+	assert c_waits.is_alive()
+
+	a.release(slots[0])
+	stepped_clock.advance(coordination.POLL_INTERVAL, [c_waits])
+	assert c_waits.slot is not None
+	b.release(slots[1])
+	c.release(c_waits.slot)
+
+
+def test_timeout_leaves_the_queue(stepped_clock, create_coordinator):
+	a, b = create_coordinator("a"), create_coordinator("b")
+	slot = a.acquire()
+	b_waits = Contender(b, stepped_clock, timeout=30).start()
+	while b_waits.is_alive():
+		stepped_clock.advance(coordination.POLL_INTERVAL, [b_waits])
+	assert b_waits.slot is None
+	assert stepped_clock.time() - START == 30
+	assert waiting(a) == []
+	a.release(slot)
+
+
+# ~~ plugins sharing a host
+
+
+def coordinated(create_plugin, name, folder, **overrides):
+	settings = {"coordination.enabled": True, "coordination.folder": folder, "coordination.stagger": 0,
+				"daily.enabled": True}
+	settings.update(overrides)
+	return create_plugin(name, settings)
+
+
+def test_timed_out_backup_is_retried_later(tmp_path, stepped_clock, create_plugin):
+	folder = str(tmp_path / "coordination")
+	busy = coordinated(create_plugin, "busy", folder)
+	plugin = coordinated(create_plugin, "octoprint", folder, backup_timeout=1)
+	plugin._coordinator._clock, plugin._coordinator._sleep = stepped_clock.time, stepped_clock.sleep
+	retries = []
+	plugin._pending_worker = type("Worker", (object,), {"retry_later": lambda self, delay: retries.append(delay)})()
+	slot = busy._coordinator.acquire()
+
+	backup = threading.Thread(target=plugin._perform_backup, args=(["daily_backups"],), daemon=True)
+	backup.start()
+	stepped_clock.settle([backup])
+	while backup.is_alive():
+		stepped_clock.advance(coordination.POLL_INTERVAL, [backup])
+	busy._coordinator.release(slot)
+
+	assert plugin._pending_backups.backup_types == ["daily_backups"]
+	assert plugin._metrics.to_dict()["counters"]["coordination_timeouts"] == 1
+	assert len(retries) == 1
+
+
+def test_pending_worker_keeps_entry_to_retry(tmp_path):
+	queue = PendingQueue(str(tmp_path / "pending.json"))
+	queue.add(["daily_backups"])
+	calls = []
+	finished = threading.Event()
+
+	def callback(entry):
+		calls.append(entry)
+		if len(calls) == 1:
+			worker.retry_later(0.05)
+		else:
+			queue.remove("daily_backups")
+			finished.set()
+
+	worker = PendingWorker(queue, callback, lambda: True)
+	worker.start()
+	try:
+		assert finished.wait(5)
+	finally:
+		worker.stop()
+	assert calls == [["daily_backups"], ["daily_backups"]]
+
+
+def test_paused_backup_releases_its_slot(tmp_path, create_plugin):
+	folder = str(tmp_path / "coordination")
+	other = coordinated(create_plugin, "other", folder)
+	plugin = coordinated(create_plugin, "octoprint", folder, **{"low_impact.enabled": True,
+																 "low_impact.on_print": "pause"})
+	slot = plugin._coordinator.acquire(timeout=0)
+	plugin._backup_slot = (plugin._coordinator, slot)
+	paused = threading.Event()
+	held = []
+
+	def archiver(throttle=None):
+		plugin.on_event("PrintStarted", {})
+		paused.set()
+		throttle.consume(1)
+		held.append(plugin._backup_slot[1] is not None)
+
+	backup = threading.Thread(target=plugin._run_archiver, args=(archiver,), daemon=True)
+	backup.start()
+	assert paused.wait(5)
+	deadline = time.monotonic() + 5
+	other_slot = None
+	while other_slot is None and time.monotonic() < deadline:
+		other_slot = other._coordinator.acquire(timeout=0)
+	assert other_slot is not None
+	other._coordinator.release(other_slot)
+
+	plugin.on_event("PrintDone", {})
+	backup.join(5)
+	assert held == [True]
+	plugin._coordinator.release(plugin._backup_slot[1])
+
+
+def test_shared_chunks_survive_other_instances_gc(tmp_path, create_plugin):
+	folder = str(tmp_path / "coordination")
+	plugins = [coordinated(create_plugin, name, folder, backup_mode="incremental",
+						   **{"coordination.share_chunks": True}) for name in ("first", "second")]
+	with open(os.path.join(plugins[0]._settings.getBaseFolder("uploads"), "only-first.gcode"), "w") as f:
+		f.write("G28\n" * 4096)
+	for plugin in plugins:
+		plugin._perform_backup(["daily_backups"])
+		plugin._maintenance_executor.submit(lambda: None).result()
+	first, second = [plugin._get_chunk_store([]) for plugin in plugins]
+	assert first is not second
+	assert len(second.list_manifests()) == 1
+
+	# deleting a backup collects the chunks no manifest of any instance references anymore
+	assert sum(first.delete_manifest(name) for name in first.list_manifests()) > 0
+	for name in second.list_manifests():
+		assert second.verify(name)["errors"] == []
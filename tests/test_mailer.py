@@ -0,0 +1,79 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import json
+import time
+
+import pytest
+
+pytest.importorskip("octoprint")
+
+from octoprint_backupscheduler import mailer  # noqa: E402
+from octoprint_backupscheduler.mailer import MailOutbox  # noqa: E402
+
+from benchmarks.smtpserver import SMTPStandIn  # noqa: E402
+
+
+@pytest.fixture
+def smtp_server():
+	server = SMTPStandIn().start()
+	yield server
+	server.stop()
+
+
+@pytest.fixture
+def create_outbox(tmp_path, smtp_server, stop_after_test):
+	def factory(digest_interval=None, start=True):
+		outbox = MailOutbox(str(tmp_path / "outbox.json"), smtp_server.config, digest_interval=digest_interval)
+		stop_after_test(outbox.stop)
+		if start:
+			outbox.start()
+		return outbox
+
+	return factory
+
+
+def subjects(server):
+	return [message["Subject"] for _, message in server.messages]
+
+
+def test_mails_share_a_connection(smtp_server, create_outbox):
+	outbox = create_outbox()
+	for i in range(5):
+		outbox.enqueue(f"mail {i}", "<p>body</p>")
+	assert smtp_server.wait_for(5)
+	assert subjects(smtp_server) == [f"mail {i}" for i in range(5)]
+	assert smtp_server.connections == 1
+
+
+def test_failed_mail_is_retried_after_restart(tmp_path, smtp_server, create_outbox, monkeypatch):
+	monkeypatch.setattr(mailer, "RETRY_DELAY", 0.5)
+	smtp_server.failures = 1
+	outbox = create_outbox()
+	outbox.enqueue("mail", "<p>body</p>")
+	deadline = time.monotonic() + 5
+	while smtp_server.failures and time.monotonic() < deadline:
+		time.sleep(0.01)
+	outbox.stop()
+	outbox.join(5)
+
+	with open(str(tmp_path / "outbox.json"), encoding="utf-8") as f:
+		persisted = json.load(f)
+	assert [(m["subject"], m["attempts"]) for m in persisted] == [("mail", 1)]
+	assert persisted[0]["due"] > persisted[0]["queued"]
+
+	restarted = create_outbox()
+	assert len(restarted) == 1
+	assert smtp_server.wait_for(1)
+	assert subjects(smtp_server) == ["mail"]
+
+
+def test_digest_mails_are_sent_together(smtp_server, create_outbox):
+	outbox = create_outbox(digest_interval=lambda: 0.2)
+	for i in range(3):
+		outbox.enqueue("Backup created", f"<p>backup {i}</p>", digest=True)
+	outbox.enqueue("Backup failed", "<p>error</p>")
+	assert smtp_server.wait_for(2)
+	assert subjects(smtp_server) == ["Backup failed", "Backup created (3)"]
+	body = smtp_server.messages[1][1].get_payload(decode=True).decode("utf-8")
+	assert all(f"backup {i}" in body for i in range(3))
@@ -0,0 +1,156 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import datetime
+
+import pytest
+
+pytest.importorskip("octoprint")
+
+from octoprint_backupscheduler import schedule  # noqa: E402
+
+HOUR = 3600
+
+
+@pytest.fixture
+def plugin(clock, create_plugin, monkeypatch):
+	"""
+	A plugin with a daily backup at midnight that records the backups it queues.
+	"""
+	plugin = create_plugin(overrides={"daily.enabled": True, "daily.time": "00:00", "catch_up_window": 24})
+	plugin.queued = []
+	monkeypatch.setattr(plugin._backup_coalescer, "add", plugin.queued.append)
+	plugin._schedule_backups()
+	plugin._scheduler.run_pending()
+	return plugin
+
+
+def set_last_run(plugin, backup_type, moment):
+	plugin._state.set("last_runs", {backup_type: moment.timestamp()})
+
+
+def test_backward_jump_doesnt_repeat_run(clock):
+	scheduler = schedule.Scheduler()
+	runs = []
+	job = scheduler.every().day.at("00:00").do(lambda: runs.append(clock.now()))
+	scheduler.run_pending()
+	clock.advance(HOUR + 1)
+	scheduler.run_pending()
+	assert len(runs) == 1
+
+	# NTP corrects a clock that ran two hours fast
+	clock.advance(60, wall=-2 * HOUR)
+	scheduler.run_pending()
+	assert job.next_run == datetime.datetime(2026, 10, 20, 0, 0)
+	clock.advance(2 * HOUR)
+	scheduler.run_pending()
+	assert len(runs) == 1
+
+
+def test_backward_jump_reschedules_interval_job_from_new_time(clock):
+	scheduler = schedule.Scheduler()
+	job = scheduler.every(10).minutes.do(lambda: None)
+	scheduler.run_pending()
+	clock.advance(600)
+	scheduler.run_pending()
+
+	clock.advance(60, wall=-2 * HOUR)
+	scheduler.run_pending()
+	assert job.next_run == clock.now() + datetime.timedelta(minutes=10)
+
+
+def test_forward_jump_reschedules_and_reports(clock):
+	scheduler = schedule.Scheduler()
+	runs, jumps = [], []
+	scheduler.on_clock_jump = jumps.append
+	job = scheduler.every().day.at("00:00").do(lambda: runs.append(clock.now()))
+	scheduler.run_pending()
+
+	clock.advance(60, wall=3 * HOUR)
+	scheduler.run_pending()
+	assert jumps == [3 * HOUR - 60]
+	# the skipped run is left to the caller
+	assert runs == []
+	assert job.next_run == datetime.datetime(2026, 10, 20, 0, 0)
+	assert job.last_due() == datetime.datetime(2026, 10, 19, 0, 0)
+
+
+def test_forward_jump_catches_up_missed_backup(clock, plugin):
+	set_last_run(plugin, "daily_backups", datetime.datetime(2026, 10, 18, 0, 0))
+
+	clock.advance(60, wall=3 * HOUR)
+	plugin._scheduler.run_pending()
+	assert plugin.queued == ["daily_backups"]
+
+	# caught up once, not on every check
+	plugin._queue_missed_backups()
+	assert plugin.queued == ["daily_backups"]
+
+
+def test_backward_jump_doesnt_queue_backup_again(clock, plugin):
+	set_last_run(plugin, "daily_backups", datetime.datetime(2026, 10, 18, 0, 0))
+	clock.advance(HOUR)
+	plugin._scheduler.run_pending()
+	assert plugin.queued == ["daily_backups"]
+	set_last_run(plugin, "daily_backups", clock.now())
+
+	clock.advance(60, wall=-2 * HOUR)
+	plugin._scheduler.run_pending()
+	clock.advance(2 * HOUR)
+	plugin._scheduler.run_pending()
+	assert plugin.queued == ["daily_backups"]
+
+
+def test_startup_seeds_last_runs(clock, plugin):
+	# the daily backup was due at midnight, but nothing was recorded yet
+	clock.advance(2 * HOUR)
+	plugin._queue_missed_backups()
+	assert plugin.queued == []
+	assert plugin._state.get("last_runs") == {"daily_backups": clock.time()}
+
+	# from then on missed backups are caught up
+	clock.advance(60, wall=24 * HOUR)
+	plugin._scheduler.run_pending()
+	assert plugin.queued == ["daily_backups"]
+
+
+def test_jobs_is_a_live_list(clock):
+	scheduler = schedule.Scheduler()
+	jobs = scheduler.jobs
+	hourly = scheduler.every().hour.do(lambda: None)
+	minutely = scheduler.every().minute.do(lambda: None)
+	assert jobs == [hourly, minutely]
+	assert scheduler.next_run == minutely.next_run
+
+	jobs.remove(minutely)
+	assert list(scheduler.jobs) == [hourly]
+	assert scheduler.next_run == hourly.next_run
+	del jobs[:]
+	assert scheduler.next_run is None
+	assert schedule.jobs is schedule.default_scheduler.jobs
+
+
+def test_jobs_added_while_running_are_kept(clock):
+	scheduler = schedule.Scheduler()
+	added = []
+
+	def add_job():
+		# like the event thread adding a job while the runner is between peek and pop
+		added.append(scheduler.every().minute.do(lambda: None))
+
+	scheduler.every().minute.do(add_job)
+	scheduler.run_pending()
+	clock.advance(60)
+	scheduler.run_pending()
+	assert len(added) == 1
+	assert scheduler.next_run == min(job.next_run for job in scheduler.jobs)
+	assert all(job._entry is not None for job in scheduler.jobs)
+
+
+def test_shutdown_stops_the_runner(create_plugin):
+	plugin = create_plugin(overrides={"daily.enabled": True, "daily.time": "00:00"})
+	plugin.on_event("Startup", {})
+	assert plugin._schedule_runner.is_alive()
+	plugin.on_shutdown()
+	plugin._schedule_runner.join(5)
+	assert not plugin._schedule_runner.is_alive()
@@ -0,0 +1,36 @@
+# coding=utf-8
+from __future__ import absolute_import
+
+import threading
+
+import pytest
+
+pytest.importorskip("octoprint")
+
+from octoprint_backupscheduler.state import PluginState  # noqa: E402
+
+
+@pytest.fixture
+def state(tmp_path):
+	state = PluginState(str(tmp_path / "state.json"))
+	yield state
+	state.flush()
+
+
+def test_get_returns_a_copy(state):
+	state.set("last_runs", {"daily_backups": 1})
+	state.get("last_runs")["weekly_backups"] = 2
+	assert state.get("last_runs") == {"daily_backups": 1}
+
+
+def test_concurrent_updates_arent_lost(state):
+	def record(backup_type):
+		for i in range(200):
+			state.update("last_runs", lambda last_runs: dict(last_runs or {}, **{f"{backup_type}-{i}": i}))
+
+	threads = [threading.Thread(target=record, args=(backup_type,)) for backup_type in ("daily", "weekly", "monthly")]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	assert len(state.get("last_runs")) == 600